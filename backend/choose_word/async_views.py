@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.urls import reverse
+
+from src.Scheduler import ExecutorBusyError
+
+from .jobs import job_queue
+from .models import Job
+from .serializers import (
+    BertTestItemSerializer, GPTTestItemSerializer, JobSerializer
+)
+from .utils import (
+    prepare_text_bert, normalize_scores_bert,
+    prepare_text_gpt, normalize_scores_gpt
+)
+from .registry import registry
+from .views import InferenceBusy, is_oversized
+
+
+def method_not_allowed(request) -> JsonResponse:
+    """Make response for unsupported method of request."""
+    return JsonResponse(
+        {'detail': f'Method "{request.method}" not allowed.'}, status=405
+    )
+
+
+def inference_busy() -> JsonResponse:
+    """Make response for overloaded inference executor."""
+    return JsonResponse(
+        {'detail': InferenceBusy.default_detail},
+        status=InferenceBusy.status_code
+    )
+
+
+def job_accepted(job: Job) -> JsonResponse:
+    """Make response for job put into queue.
+
+    :param job: created job
+
+    :returns: response with state of job and link to poll it
+    """
+    response = JsonResponse(JobSerializer(job).data, status=202)
+    response['Location'] = reverse('choose_word_job', args=[job.id])
+    return response
+
+
+async def solve(request, kind, serializer_class, tokenization_memo, prepare,
+                batcher, normalize) -> JsonResponse:
+    """Validate request on event loop and await its inference.
+
+    :param request: request with test item
+    :param kind: kind of job to solve too big test item
+    :param serializer_class: serializer to validate test item
+    :param tokenization_memo: memo to share tokenization
+        between validation and processing
+    :param prepare: function to create tasks from test item
+    :param batcher: micro-batcher to score tasks
+    :param normalize: function to turn scores into percents
+
+    :returns: percent of each candidate in each gap
+    """
+    if request.method != 'POST':
+        return method_not_allowed(request)
+    try:
+        data = json.loads(request.body)
+    except ValueError as e:
+        return JsonResponse(
+            {'detail': f'JSON parse error - {e}'}, status=400
+        )
+
+    with tokenization_memo.scope():
+        serializer = serializer_class(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        data = serializer.data
+        try:
+            tasks = prepare(data['text_parts'], data['candidates'])
+        except ValueError as e:
+            return JsonResponse({'detail': str(e)}, status=400)
+
+    # big test item would hold request until proxy timeout
+    if is_oversized(tasks):
+        return job_accepted(
+            await sync_to_async(job_queue.submit)(kind, data)
+        )
+    try:
+        scores = await asyncio.wrap_future(batcher.submit(*tasks))
+    except ExecutorBusyError:
+        return inference_busy()
+    return JsonResponse(normalize(scores), safe=False)
+
+
+async def choose_word_bert(request):
+    """Controller for running BERT algorithm without blocking the loop."""
+    return await solve(
+        request, Job.KIND_BERT, BertTestItemSerializer,
+        registry.bert_tokenization_memo, prepare_text_bert,
+        registry.bert_batcher, normalize_scores_bert
+    )
+
+
+async def choose_word_gpt(request):
+    """Controller for running GPT algorithm without blocking the loop."""
+    return await solve(
+        request, Job.KIND_GPT, GPTTestItemSerializer,
+        registry.gpt_tokenization_memo, prepare_text_gpt,
+        registry.gpt_batcher, normalize_scores_gpt
+    )
+
+
+async def benchmark(request):
+    """Controller for running benchmark in background."""
+    if request.method != 'GET':
+        return method_not_allowed(request)
+    return job_accepted(
+        await sync_to_async(job_queue.submit)(Job.KIND_BENCHMARK)
+    )
+
+
+# views take JSON only, so they are exempt from CSRF checks like APIView,
+# csrf_exempt decorator can't wrap coroutines in this version of Django
+for view in [choose_word_bert, choose_word_gpt, benchmark]:
+    view.csrf_exempt = True
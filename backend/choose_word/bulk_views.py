@@ -0,0 +1,219 @@
+import json
+import logging
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from src.Scheduler import ExecutorBusyError, MicroBatcher, count_tokens
+
+from .async_views import method_not_allowed
+from .serializers import BertTestItemSerializer, GPTTestItemSerializer
+from .utils import (
+    prepare_text_bert, normalize_scores_bert,
+    prepare_text_gpt, normalize_scores_gpt
+)
+from .registry import registry
+from .views import InferenceBusy
+
+logger = logging.getLogger(__name__)
+
+
+class _Chunk:
+    """Items of bulk request scored by one call of micro-batcher."""
+
+    def __init__(self):
+        self.input_ids = []
+        self.gap_indexes = []
+        self.candidates = []
+        self.num_tokens = 0
+        # index of each item and number of its gaps
+        self.items = []
+        self.future = None
+
+    def add(self, index: int, tasks: Tuple):
+        """Add tasks of item to chunk.
+
+        :param index: index of item in request
+        :param tasks: token ids of contexts, indexes of gaps
+            and token ids of candidates of item
+        """
+        input_ids, gap_indexes, candidates = tasks
+        self.input_ids += input_ids
+        self.gap_indexes += gap_indexes
+        self.candidates += candidates
+        self.num_tokens += count_tokens(input_ids, candidates)
+        self.items.append((index, len(input_ids)))
+
+
+def to_line(result: Dict) -> bytes:
+    """Encode result of one item as line of NDJSON."""
+    return json.dumps(result).encode('utf-8') + b'\n'
+
+
+def read_items(lines: Iterable[bytes]) -> Iterator[Tuple[int, bytes]]:
+    """Enumerate non-empty lines of NDJSON stream.
+
+    :param lines: lines of request body
+
+    :returns: index of item and its line
+    """
+    index = 0
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        yield index, line
+        index += 1
+
+
+def solve_bulk(
+        lines: Iterable[bytes],
+        serializer_class,
+        tokenization_memo,
+        prepare: Callable,
+        batcher: MicroBatcher,
+        normalize: Callable
+) -> Iterator[bytes]:
+    """Solve items of bulk request and yield result of each item.
+
+    Valid items are gathered into chunks of the token budget of
+    micro-batcher, so all their gaps are scored together. Only a few chunks
+    are in flight at once, so memory doesn't depend on size of request.
+
+    :param lines: lines of request body, one test item per line
+    :param serializer_class: serializer to validate test item
+    :param tokenization_memo: memo to share tokenization
+        between validation and processing
+    :param prepare: function to create tasks from test item
+    :param batcher: micro-batcher to score tasks
+    :param normalize: function to turn scores into percents
+
+    :returns: NDJSON lines with index of item and its result or errors
+    """
+    in_flight = deque()
+    chunk = _Chunk()
+    for index, line in read_items(lines):
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield to_line({
+                'index': index,
+                'errors': {'detail': f'JSON parse error - {e}'}
+            })
+            continue
+
+        errors = None
+        with tokenization_memo.scope():
+            serializer = serializer_class(data=data)
+            if serializer.is_valid():
+                data = serializer.data
+                try:
+                    tasks = prepare(data['text_parts'], data['candidates'])
+                except ValueError as e:
+                    errors = {'detail': str(e)}
+            else:
+                errors = serializer.errors
+        if errors is not None:
+            yield to_line({'index': index, 'errors': errors})
+            continue
+        chunk.add(index, tasks)
+
+        if chunk.num_tokens >= batcher.max_batch_tokens:
+            chunk.future = batcher.submit(
+                chunk.input_ids, chunk.gap_indexes, chunk.candidates
+            )
+            in_flight.append(chunk)
+            chunk = _Chunk()
+        # wait for the oldest chunk only if too many chunks are scored
+        while len(in_flight) > 0 and (
+                in_flight[0].future.done()
+                or len(in_flight) > settings.CHOOSE_WORD_BULK_MAX_CHUNKS
+        ):
+            yield from finish_chunk(in_flight.popleft(), normalize)
+
+    if len(chunk.items) > 0:
+        chunk.future = batcher.submit(
+            chunk.input_ids, chunk.gap_indexes, chunk.candidates
+        )
+        in_flight.append(chunk)
+    while len(in_flight) > 0:
+        yield from finish_chunk(in_flight.popleft(), normalize)
+
+
+def finish_chunk(chunk: _Chunk, normalize: Callable) -> Iterator[bytes]:
+    """Wait for scores of chunk and yield result of each its item.
+
+    :param chunk: chunk submitted to micro-batcher
+    :param normalize: function to turn scores into percents
+
+    :returns: NDJSON lines with index of item and its result or errors
+    """
+    try:
+        scores = chunk.future.result()
+    except Exception as e:
+        detail = error_detail(e)
+        for index, _ in chunk.items:
+            yield to_line({'index': index, 'errors': {'detail': detail}})
+        return
+
+    cur_cnt = 0
+    for index, cnt in chunk.items:
+        try:
+            line = {
+                'index': index,
+                'result': normalize(scores[cur_cnt:cur_cnt+cnt])
+            }
+        except Exception as e:
+            line = {'index': index, 'errors': {'detail': error_detail(e)}}
+        yield to_line(line)
+        cur_cnt += cnt
+
+
+def error_detail(error: Exception) -> str:
+    """Describe error of scoring, that is reported to the caller.
+
+    :param error: raised exception
+
+    :returns: message of error
+    """
+    if isinstance(error, ExecutorBusyError):
+        return InferenceBusy.default_detail
+    logger.exception('Failed to score items of bulk request')
+    return str(error) or type(error).__name__
+
+
+def stream_bulk(request, *args) -> StreamingHttpResponse:
+    """Make streamed response for bulk request.
+
+    :param request: request with one test item per line
+    :param args: arguments of solve_bulk after lines
+
+    :returns: response with one NDJSON line per item
+    """
+    if request.method != 'POST':
+        return method_not_allowed(request)
+    # request is read line by line while results are sent
+    return StreamingHttpResponse(
+        solve_bulk(request, *args), content_type='application/x-ndjson'
+    )
+
+
+@csrf_exempt
+def choose_word_bert(request):
+    """Controller for running BERT algorithm on many test items."""
+    return stream_bulk(
+        request, BertTestItemSerializer, registry.bert_tokenization_memo,
+        prepare_text_bert, registry.bert_batcher, normalize_scores_bert
+    )
+
+
+@csrf_exempt
+def choose_word_gpt(request):
+    """Controller for running GPT algorithm on many test items."""
+    return stream_bulk(
+        request, GPTTestItemSerializer, registry.gpt_tokenization_memo,
+        prepare_text_gpt, registry.gpt_batcher, normalize_scores_gpt
+    )
@@ -0,0 +1,303 @@
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Count
+from django.utils import timezone
+
+from src.Scheduler import ExecutorBusyError, MicroBatcher
+
+from .models import Job
+from .registry import registry
+from .utils import (
+    prepare_text_bert, normalize_scores_bert,
+    prepare_text_gpt, normalize_scores_gpt, run_benchmarks
+)
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Class for draining jobs stored in database by worker threads.
+
+    Workers are started by the process serving requests, so each forked
+    process starts its own workers. Job is claimed by conditional update
+    of its status, so processes sharing the database never run the same
+    job twice. Claimed job records its process, so jobs left running
+    by dead process are put back into queue when workers start.
+    """
+
+    # minimum time in seconds between writes of progress of a job
+    progress_interval = 0.5
+
+    def __init__(self):
+        """Init object."""
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+
+    @staticmethod
+    def worker_name(pid: Optional[int] = None) -> str:
+        """Get name of process, that is saved in claimed job.
+
+        :param pid: id of process, the current process if None
+
+        :returns: host and id of process
+        """
+        return f'{socket.gethostname()}:{pid or os.getpid()}'
+
+    def ensure_started(self):
+        """Start worker threads in the current process if not started.
+
+        Stale jobs are put back into queue and workers drain the queue
+        right after start.
+        """
+        num_workers = settings.CHOOSE_WORD_JOB_WORKERS
+        if num_workers <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            try:
+                self.recover_stale()
+            except DatabaseError:
+                logger.exception('Failed to recover stale jobs')
+            for _ in range(num_workers):
+                threading.Thread(
+                    target=self._work, name='job-worker', daemon=True
+                ).start()
+        self._wakeup.set()
+
+    def recover_stale(self) -> int:
+        """Put jobs of dead processes of this host back into queue.
+
+        Jobs of other hosts are left as is, their processes can't
+        be checked from here.
+
+        :returns: number of jobs put back into queue
+        """
+        host_prefix = self.worker_name().rsplit(':', 1)[0] + ':'
+        running = Job.objects.filter(
+            status=Job.STATUS_RUNNING
+        ).values_list('id', 'worker')
+        stale_ids = []
+        for job_id, worker in running:
+            # jobs claimed before processes were recorded are stale too
+            if worker == '':
+                stale_ids.append(job_id)
+            elif worker.startswith(host_prefix):
+                pid = int(worker[len(host_prefix):])
+                # job of this process is stale before its workers start
+                if pid == os.getpid() or not is_alive(pid):
+                    stale_ids.append(job_id)
+        if len(stale_ids) == 0:
+            return 0
+        recovered = Job.objects.filter(
+            id__in=stale_ids, status=Job.STATUS_RUNNING
+        ).update(
+            status=Job.STATUS_QUEUED, started_at=None, progress=0.0,
+            worker=''
+        )
+        logger.warning('Put %d stale jobs back into queue', recovered)
+        return recovered
+
+    def submit(self, kind: str, payload: Optional[Dict] = None) -> Job:
+        """Put job into queue and wake up workers.
+
+        Benchmark has no input, so queued or running benchmark job
+        is reused instead of creating a new one.
+
+        :param kind: kind of job
+        :param payload: validated input of job
+
+        :returns: created or reused job
+        """
+        if kind == Job.KIND_BENCHMARK:
+            job = Job.objects.filter(
+                kind=kind, status__in=[Job.STATUS_QUEUED, Job.STATUS_RUNNING]
+            ).first()
+            if job is not None:
+                self.ensure_started()
+                return job
+        job = Job.objects.create(kind=kind, payload=payload or {})
+        self.ensure_started()
+        self._wakeup.set()
+        return job
+
+    def _work(self):
+        """Wait for jobs and run them until queue is empty."""
+        while True:
+            self._wakeup.wait(settings.CHOOSE_WORD_JOB_POLL_INTERVAL)
+            self._wakeup.clear()
+            try:
+                while self.run_next():
+                    pass
+            except Exception:
+                logger.exception('Job worker failed to process queue')
+            finally:
+                close_old_connections()
+
+    def run_next(self) -> bool:
+        """Claim the oldest queued job and run it.
+
+        :returns: True if job was finished, False if there is no job
+            to run or inference is busy
+        """
+        queued_ids = Job.objects.filter(
+            status=Job.STATUS_QUEUED
+        ).values_list('id', flat=True)[:16]
+        for job_id in queued_ids:
+            claimed = Job.objects.filter(
+                id=job_id, status=Job.STATUS_QUEUED
+            ).update(
+                status=Job.STATUS_RUNNING, started_at=timezone.now(),
+                worker=self.worker_name()
+            )
+            if claimed:
+                return self._run(Job.objects.get(id=job_id))
+        return False
+
+    def _run(self, job: Job) -> bool:
+        """Run claimed job and save its result.
+
+        :param job: job to run
+
+        :returns: True if job was finished, False if it was put back
+        """
+        handlers = {
+            Job.KIND_BERT: lambda: self._solve(
+                job, prepare_text_bert, registry.bert_batcher,
+                normalize_scores_bert
+            ),
+            Job.KIND_GPT: lambda: self._solve(
+                job, prepare_text_gpt, registry.gpt_batcher,
+                normalize_scores_gpt
+            ),
+            Job.KIND_BENCHMARK: lambda: run_benchmarks(
+                on_progress=self._progress_reporter(job)
+            )
+        }
+        try:
+            result = handlers[job.kind]()
+        except ExecutorBusyError:
+            # wait for free inference workers instead of failing
+            Job.objects.filter(id=job.id).update(
+                status=Job.STATUS_QUEUED, started_at=None, progress=0.0,
+                worker=''
+            )
+            with self._lock:
+                self.requeued += 1
+            return False
+        except Exception as e:
+            logger.exception('Job %s failed', job.id)
+            Job.objects.filter(id=job.id).update(
+                status=Job.STATUS_FAILED, error=str(e) or type(e).__name__,
+                finished_at=timezone.now()
+            )
+            with self._lock:
+                self.failed += 1
+            return True
+
+        Job.objects.filter(id=job.id).update(
+            status=Job.STATUS_DONE, result=result, progress=1.0,
+            finished_at=timezone.now()
+        )
+        with self._lock:
+            self.completed += 1
+        return True
+
+    def _solve(
+            self, job: Job, prepare: Callable, batcher: MicroBatcher,
+            normalize: Callable
+    ):
+        """Solve test item of job reporting fraction of scored gaps.
+
+        :param job: job with validated test item in payload
+        :param prepare: function to create tasks from test item
+        :param batcher: micro-batcher to score tasks
+        :param normalize: function to turn scores into percents
+
+        :returns: percent of each candidate in each gap
+        """
+        tasks = prepare(job.payload['text_parts'], job.payload['candidates'])
+        num_gaps = max(1, len(tasks[0]))
+        scored_gaps = []
+        future = batcher.submit(
+            *tasks,
+            on_gap_scored=lambda gap_idx, _: scored_gaps.append(gap_idx)
+        )
+        report = self._progress_reporter(job)
+        while True:
+            try:
+                scores = future.result(timeout=self.progress_interval)
+            except FutureTimeoutError:
+                report(len(scored_gaps) / num_gaps)
+            else:
+                return normalize(scores)
+
+    def _progress_reporter(self, job: Job) -> Callable:
+        """Create function to save progress of job not too often.
+
+        :param job: job to report progress of
+
+        :returns: function with fraction of processed work as argument
+        """
+        last_time = [0.0]
+
+        def report(fraction: float):
+            now = time.monotonic()
+            if now - last_time[0] < self.progress_interval:
+                return
+            last_time[0] = now
+            Job.objects.filter(id=job.id).update(progress=fraction)
+
+        return report
+
+    def stats(self) -> Dict:
+        """Get counters of jobs.
+
+        :returns: dict with number of jobs in each status in database
+            and counters of jobs run by this process
+        """
+        statuses = {status: 0 for status, _ in Job.STATUS_CHOICES}
+        counts = Job.objects.order_by().values('status').annotate(
+            count=Count('id')
+        )
+        for row in counts:
+            statuses[row['status']] = row['count']
+        return {
+            'statuses': statuses,
+            'completed': self.completed,
+            'failed': self.failed,
+            'requeued': self.requeued
+        }
+
+
+def is_alive(pid: int) -> bool:
+    """Check that process with given id exists.
+
+    :param pid: id of process
+
+    :returns: False if there is no such process
+    """
+    try:
+        # signal 0 only checks existence of process
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+job_queue = JobQueue()
@@ -0,0 +1,347 @@
+import itertools
+import json
+import os
+import resource
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+from django.core.management.base import BaseCommand, CommandError
+
+from src.Precision import PRECISION_MODES
+from src.Timing import StageTimer
+
+from ...registry import registry
+from ...utils import load_benchmark_data, process_text_bert, process_text_gpt
+
+PROCESSORS = {
+    'bert': process_text_bert,
+    'gpt': process_text_gpt
+}
+SCORERS = {
+    'bert': 'bert_scorer_correction',
+    'gpt': 'gpt_scorer_sentence'
+}
+BACKENDS = ['eager', 'torchscript', 'onnx']
+# fields, that identify configuration in baseline
+CONFIG_FIELDS = ['model', 'precision', 'backend', 'threads', 'batch_tokens']
+
+
+def available_cores() -> List[int]:
+    """Get ids of cores available to the process."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def peak_rss_mb() -> float:
+    """Get peak resident set size of the process in megabytes."""
+    # ru_maxrss is measured in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(
+        processor: Callable, data: List[Dict], repeat: int, warmup: int
+) -> Dict:
+    """Run processor on exercises and collect latency of each of them.
+
+    :param processor: function to process text parts with candidates
+    :param data: blocks of tasks in sdamgia format
+    :param repeat: number of passes over data
+    :param warmup: number of exercises to run before measurement
+
+    :returns: accuracy, latency percentiles, throughput and mean time
+        of each stage per exercise
+    """
+    exercises = []
+    for task_block in data:
+        exercises.append((
+            task_block['text'].split('_____'),
+            [gap['choices'] for gap in task_block['gaps']],
+            [gap['answer'] for gap in task_block['gaps']]
+        ))
+    for text_parts, candidates, _ in exercises[:warmup]:
+        processor(text_parts, candidates)
+
+    latencies = []
+    stages = {}
+    num_gaps = 0
+    is_correct = []
+    for _ in range(repeat):
+        # score cache would turn next passes into lookups
+        if registry.bert_score_cache is not None:
+            registry.bert_score_cache.clear()
+        for text_parts, candidates, answers in exercises:
+            timer = StageTimer()
+            with timer.scope():
+                start_time = time.perf_counter()
+                results = processor(text_parts, candidates)
+                latencies.append(time.perf_counter() - start_time)
+            for name, seconds in timer.stats().items():
+                stages[name] = stages.get(name, 0.0) + seconds
+            num_gaps += len(answers)
+            is_correct += [
+                np.argmax(gap_answers) + 1 == answer
+                for gap_answers, answer in zip(results, answers)
+            ]
+
+    latencies_ms = np.array(latencies) * 1000
+    wall_time = float(np.sum(latencies))
+    return {
+        'exercises': len(latencies),
+        'gaps': num_gaps,
+        'accuracy': float(np.mean(is_correct)),
+        'latency_ms': {
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p95': float(np.percentile(latencies_ms, 95)),
+            'p99': float(np.percentile(latencies_ms, 99)),
+            'mean': float(np.mean(latencies_ms))
+        },
+        'throughput': {
+            'exercises_per_s': len(latencies) / wall_time,
+            'gaps_per_s': num_gaps / wall_time
+        },
+        'stages_ms': {
+            name: seconds * 1000 / len(latencies)
+            for name, seconds in stages.items()
+        }
+    }
+
+
+def find_regressions(
+        results: List[Dict], baseline: List[Dict],
+        tolerance: float, accuracy_tolerance: float
+) -> List[str]:
+    """Compare results with baseline of the same configurations.
+
+    :param results: results of benchmark
+    :param baseline: results of previous run
+    :param tolerance: allowed relative growth of p95 latency
+        and drop of throughput
+    :param accuracy_tolerance: allowed absolute drop of accuracy
+
+    :returns: description of each regression
+    """
+    baseline_results = {
+        tuple(x[field] for field in CONFIG_FIELDS): x for x in baseline
+    }
+    regressions = []
+    for result in results:
+        key = tuple(result[field] for field in CONFIG_FIELDS)
+        base = baseline_results.get(key)
+        if base is None:
+            continue
+        name = ' '.join(str(x) for x in key)
+        p95 = result['latency_ms']['p95']
+        base_p95 = base['latency_ms']['p95']
+        if p95 > base_p95 * (1 + tolerance):
+            regressions.append(
+                f'{name}: p95 latency {base_p95:.1f} -> {p95:.1f} ms'
+            )
+        gaps_per_s = result['throughput']['gaps_per_s']
+        base_gaps_per_s = base['throughput']['gaps_per_s']
+        if gaps_per_s < base_gaps_per_s * (1 - tolerance):
+            regressions.append(
+                f'{name}: throughput {base_gaps_per_s:.2f} -> '
+                f'{gaps_per_s:.2f} gaps/s'
+            )
+        if result['accuracy'] < base['accuracy'] - accuracy_tolerance:
+            regressions.append(
+                f'{name}: accuracy {base["accuracy"]:.4f} -> '
+                f'{result["accuracy"]:.4f}'
+            )
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        'Run sdamgia.json through solving algorithms for each combination '
+        'of precision, backend, number of threads and batch size, '
+        'report latency percentiles, throughput, peak memory '
+        'and time of stages, compare them with baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--models', nargs='+', default=['bert', 'gpt'],
+            choices=['bert', 'gpt'], help='models to benchmark'
+        )
+        parser.add_argument(
+            '--precisions', nargs='+', choices=PRECISION_MODES,
+            help='precision modes to sweep, current one by default'
+        )
+        parser.add_argument(
+            '--backends', nargs='+', choices=BACKENDS,
+            help='inference backends to sweep, current one by default'
+        )
+        parser.add_argument(
+            '--threads', nargs='+', type=int,
+            help='numbers of cores for inference to sweep, '
+                 'current executor by default'
+        )
+        parser.add_argument(
+            '--batch-tokens', nargs='+', type=int,
+            help='maximum numbers of tokens in padded batch of scorer '
+                 'to sweep, configured one by default'
+        )
+        parser.add_argument(
+            '--limit', type=int,
+            help='number of exercises to use, all by default'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=1,
+            help='number of passes over exercises'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=1,
+            help='number of exercises to run before measurement'
+        )
+        parser.add_argument(
+            '--output', help='path of JSON file to save results'
+        )
+        parser.add_argument(
+            '--baseline', help='path of JSON file with results to compare'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.1,
+            help='allowed relative growth of p95 latency '
+                 'and drop of throughput'
+        )
+        parser.add_argument(
+            '--accuracy-tolerance', type=float, default=0.005,
+            help='allowed absolute drop of accuracy'
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline'] is not None:
+            with open(options['baseline'], 'r') as inf:
+                baseline = json.load(inf)['results']
+
+        data = load_benchmark_data()
+        if options['limit'] is not None:
+            data = data[:options['limit']]
+
+        cores = available_cores()
+        for threads in options['threads'] or []:
+            if not 0 < threads <= len(cores):
+                raise CommandError(
+                    f'Number of threads should be from 1 to {len(cores)}!'
+                )
+
+        results = []
+        for model_name in options['models']:
+            initial_precision = registry.precision[model_name]
+            initial_backend = registry.backend[model_name]
+            scorer = getattr(registry, SCORERS[model_name])
+            initial_batch_tokens = (
+                scorer.max_batch_tokens, scorer.scheduler.max_batch_tokens
+            )
+            configs = itertools.product(
+                options['precisions'] or [initial_precision],
+                options['backends'] or [initial_backend],
+                options['threads'] or [None],
+                options['batch_tokens'] or [None]
+            )
+            try:
+                for precision, backend, threads, batch_tokens in configs:
+                    results.append(self.run_config(
+                        model_name, precision, backend, threads,
+                        batch_tokens, data, cores, options
+                    ))
+            finally:
+                scorer = getattr(registry, SCORERS[model_name])
+                (
+                    scorer.max_batch_tokens,
+                    scorer.scheduler.max_batch_tokens
+                ) = initial_batch_tokens
+                registry.set_precision(model_name, initial_precision)
+                registry.set_backend(model_name, initial_backend)
+                if options['threads'] is not None:
+                    # executor of the registry uses all cores by default
+                    registry.set_inference_cores(cores)
+
+        self.write_table(results)
+        report = {
+            'environment': {
+                'torch': torch.__version__,
+                'cores': len(cores)
+            },
+            'results': results
+        }
+        if options['output'] is not None:
+            with open(options['output'], 'w') as ouf:
+                json.dump(report, ouf, indent=2)
+
+        if baseline is not None:
+            regressions = find_regressions(
+                results, baseline, options['tolerance'],
+                options['accuracy_tolerance']
+            )
+            for regression in regressions:
+                self.stdout.write(self.style.WARNING(regression))
+            if len(regressions) > 0:
+                raise CommandError(
+                    f'{len(regressions)} regressions against baseline!'
+                )
+            self.stdout.write(self.style.SUCCESS('No regressions.'))
+
+    def run_config(
+            self, model_name: str, precision: str, backend: str,
+            threads: Optional[int], batch_tokens: Optional[int],
+            data: List[Dict], cores: List[int], options: Dict
+    ) -> Dict:
+        """Apply configuration and measure it.
+
+        :returns: configuration with its measurements
+        """
+        if precision != registry.precision[model_name]:
+            registry.set_precision(model_name, precision)
+        if backend != registry.backend[model_name]:
+            registry.set_backend(model_name, backend)
+        if threads is not None:
+            registry.set_inference_cores(cores[:threads])
+        scorer = getattr(registry, SCORERS[model_name])
+        if batch_tokens is not None:
+            scorer.max_batch_tokens = batch_tokens
+            scorer.scheduler.max_batch_tokens = batch_tokens
+
+        result = {
+            'model': model_name,
+            'precision': precision,
+            'backend': backend,
+            'threads': (
+                registry.inference_executor.threads_per_worker
+            ),
+            'batch_tokens': scorer.max_batch_tokens
+        }
+        result.update(measure(
+            PROCESSORS[model_name], data,
+            options['repeat'], options['warmup']
+        ))
+        # peak of the whole process up to the end of this configuration
+        result['peak_rss_mb'] = peak_rss_mb()
+        return result
+
+    def write_table(self, results: List[Dict]):
+        """Print main measurements of each configuration."""
+        self.stdout.write(
+            f'{"model":<6}{"prec":<6}{"backend":<12}{"thr":>4}'
+            f'{"tokens":>8}{"acc":>8}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"gaps/s":>9}{"rss, MB":>9}'
+        )
+        for x in results:
+            latency = x['latency_ms']
+            self.stdout.write(
+                f'{x["model"]:<6}{x["precision"]:<6}{x["backend"]:<12}'
+                f'{x["threads"]:>4}{x["batch_tokens"]:>8}'
+                f'{x["accuracy"]:>8.4f}{latency["p50"]:>9.1f}'
+                f'{latency["p95"]:>9.1f}{latency["p99"]:>9.1f}'
+                f'{x["throughput"]["gaps_per_s"]:>9.2f}'
+                f'{x["peak_rss_mb"]:>9.0f}'
+            )
+            stages = ', '.join(
+                f'{name} {ms:.1f}' for name, ms in x['stages_ms'].items()
+            )
+            self.stdout.write(f'    stages, ms per exercise: {stages}')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from transformers import BertForMaskedLM, GPT2LMHeadModel
+
+from src.MmapWeights import save_mmap_weights
+
+from ...apps import ChooseWordConfig
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert weights of models into flat memory-mappable files, '
+        'that are shared between worker processes.'
+    )
+
+    def handle(self, *args, **options):
+        models = [
+            (BertForMaskedLM, ChooseWordConfig.bert_path),
+            (GPT2LMHeadModel, ChooseWordConfig.gpt_path)
+        ]
+        for model_class, path in models:
+            model = model_class.from_pretrained(path)
+            save_mmap_weights(model, path)
+            self.stdout.write(self.style.SUCCESS(f'Converted {path}'))
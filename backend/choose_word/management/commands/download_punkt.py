@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+
+import nltk
+from django.core.management.base import BaseCommand, CommandError
+
+from ...apps import ChooseWordConfig
+
+
+class Command(BaseCommand):
+    help = (
+        'Save punkt model for splitting sentences into models directory, '
+        'so it is loaded from disk without network access. Model is '
+        'copied from installed nltk data or downloaded.'
+    )
+
+    def handle(self, *args, **options):
+        os.makedirs(
+            os.path.dirname(ChooseWordConfig.punkt_path), exist_ok=True
+        )
+        try:
+            path = nltk.data.find('tokenizers/punkt/english.pickle')
+        except LookupError:
+            path = None
+        if path is not None:
+            shutil.copyfile(path, ChooseWordConfig.punkt_path)
+        else:
+            with tempfile.TemporaryDirectory() as download_dir:
+                if not nltk.download(
+                        'punkt', download_dir=download_dir, quiet=True
+                ):
+                    raise CommandError('Failed to download punkt!')
+                shutil.copyfile(
+                    os.path.join(
+                        download_dir, 'tokenizers', 'punkt', 'PY3',
+                        'english.pickle'
+                    ),
+                    ChooseWordConfig.punkt_path
+                )
+        self.stdout.write(
+            self.style.SUCCESS(f'Saved {ChooseWordConfig.punkt_path}')
+        )
@@ -0,0 +1,85 @@
+import asyncio
+import time
+import uuid
+
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from src.Metrics import solve_requests, stage_seconds
+from src.Profiling import RequestProfile
+from src.Timing import StageTimer
+
+from .profiling import has_profile_token
+
+
+def finish_timing(request, response, timer: StageTimer, start_time: float):
+    """Add Server-Timing header and count request to choose_word views.
+
+    Stages, that run in inference threads for merged requests,
+    are not attributed to the request and are visible in metrics only.
+
+    :param request: processed request
+    :param response: response to the request
+    :param timer: timer of stages of the request
+    :param start_time: time of start of the request
+    """
+    match = request.resolver_match
+    if match is None or not (match.url_name or '').startswith('choose_word'):
+        return
+    total = time.perf_counter() - start_time
+    stage_seconds.observe(total, stage='total')
+    solve_requests.inc(view=match.url_name, status=response.status_code)
+
+    durations = list(timer.stats().items()) + [('total', total)]
+    response['Server-Timing'] = ', '.join(
+        f'{name};dur={seconds * 1000:.2f}' for name, seconds in durations
+    )
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """Measure stages of each request to choose_word views."""
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            timer = StageTimer()
+            start_time = time.perf_counter()
+            with timer.scope():
+                response = await get_response(request)
+            finish_timing(request, response, timer, start_time)
+            return response
+    else:
+        def middleware(request):
+            timer = StageTimer()
+            start_time = time.perf_counter()
+            with timer.scope():
+                response = get_response(request)
+            finish_timing(request, response, timer, start_time)
+            return response
+
+    return middleware
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """Profile request if authorized caller asked for it.
+
+    Files of profile are written into CHOOSE_WORD_PROFILE_DIR and their
+    common prefix is returned in X-Profile-Id header. Requests to async
+    views are not profiled, because profile of event loop would include
+    other requests.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            return await get_response(request)
+    else:
+        def middleware(request):
+            if not has_profile_token(request):
+                return get_response(request)
+            name = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+            profile = RequestProfile(settings.CHOOSE_WORD_PROFILE_DIR, name)
+            with profile.scope():
+                response = get_response(request)
+            response['X-Profile-Id'] = name
+            return response
+
+    return middleware
@@ -1,3 +1,51 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+
+class Job(models.Model):
+    """Long-running solve or benchmark processed by background workers."""
+
+    KIND_BERT = 'bert'
+    KIND_GPT = 'gpt'
+    KIND_BENCHMARK = 'benchmark'
+    KIND_CHOICES = [
+        (KIND_BERT, 'Solve by BERT'),
+        (KIND_GPT, 'Solve by GPT'),
+        (KIND_BENCHMARK, 'Benchmark')
+    ]
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed')
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED,
+        db_index=True
+    )
+    # validated input of the job, e.g. text parts and candidates
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    # fraction of processed work from 0 to 1
+    progress = models.FloatField(default=0.0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # host and pid of process running the job
+    worker = models.CharField(max_length=128, blank=True, default='')
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f'{self.kind} job {self.id} ({self.status})'
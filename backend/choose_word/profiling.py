@@ -0,0 +1,34 @@
+import hmac
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+# header and query parameter with token to profile request
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = 'profile'
+
+
+def has_profile_token(request) -> bool:
+    """Check that request has valid token of profiling.
+
+    :param request: incoming request
+
+    :returns: True if profiling is enabled and token is correct
+    """
+    token = settings.CHOOSE_WORD_PROFILE_TOKEN
+    if not token:
+        return False
+    given = request.headers.get(PROFILE_HEADER)
+    if given is None:
+        given = request.GET.get(PROFILE_PARAM)
+    return given is not None and hmac.compare_digest(given, token)
+
+
+class CanProfile(BasePermission):
+    """Allow access to profiles for staff and holders of token."""
+
+    def has_permission(self, request, view):
+        user = request.user
+        if user is not None and user.is_staff:
+            return True
+        return has_profile_token(request)
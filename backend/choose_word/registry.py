@@ -0,0 +1,361 @@
+import os
+import threading
+import warnings
+from typing import Callable, Dict, List
+
+from django.conf import settings
+from transformers import (
+    BertForMaskedLM, BertTokenizerFast, GPT2TokenizerFast, GPT2LMHeadModel
+)
+
+from src.BertScorer import BertScorerCorrection, BertScorerSentence
+from src.BertScorer import ScoreCache, create_masked_lm_backend
+from src.GPTScorer import GPTScorerSentence, create_causal_lm_backend
+from src.MmapWeights import build_mmap_model, has_mmap_weights
+from src.Precision import apply_precision
+from src.Profiling import run_traced
+from src.Scheduler import InferenceExecutor, MicroBatcher
+from src.Splitting import create_sentence_splitter
+from src.Tokenization import TokenizationMemo
+
+from .apps import ChooseWordConfig
+
+
+def load_model(model_class, path: str, precision: str = 'fp32'):
+    """Load model from memory-mapped weights if they are converted.
+
+    :param model_class: class of model from transformers library
+    :param path: directory with model
+    :param precision: precision mode of inference
+
+    :returns: loaded model
+    """
+    if settings.CHOOSE_WORD_MMAP_WEIGHTS and has_mmap_weights(path):
+        if precision == 'fp32':
+            return build_mmap_model(model_class, path)
+        # conversion copies every weight out of the mapped file, so pages
+        # would not be shared between workers anyway
+        warnings.warn(
+            f'Memory-mapped weights are not used with {precision} '
+            f'precision of {path}.'
+        )
+    return apply_precision(model_class.from_pretrained(path), precision)
+
+
+class ModelRegistry:
+    """Class for lazy loading of models shared by the whole process.
+
+    Each object is created once on first use or during warmup.
+    """
+
+    def __init__(self):
+        """Init object."""
+        self._objects = {}
+        self._lock = threading.RLock()
+        self._ready = threading.Event()
+        self.precision = {
+            'bert': settings.CHOOSE_WORD_BERT_PRECISION,
+            'gpt': settings.CHOOSE_WORD_GPT_PRECISION
+        }
+        self.backend = {
+            'bert': settings.CHOOSE_WORD_BERT_BACKEND,
+            'gpt': settings.CHOOSE_WORD_GPT_BACKEND
+        }
+
+    def _get(self, name: str, factory: Callable):
+        """Get object by name, create it if it is not created yet.
+
+        :param name: name of object
+        :param factory: function to create object
+
+        :returns: shared object
+        """
+        obj = self._objects.get(name)
+        if obj is None:
+            with self._lock:
+                obj = self._objects.get(name)
+                if obj is None:
+                    obj = factory()
+                    self._objects[name] = obj
+        return obj
+
+    @property
+    def sentence_splitter(self) -> Callable:
+        return self._get(
+            'sentence_splitter',
+            lambda: create_sentence_splitter(
+                settings.CHOOSE_WORD_SENTENCE_SPLITTER,
+                punkt_path=ChooseWordConfig.punkt_path
+            )
+        )
+
+    @property
+    def inference_executor(self) -> InferenceExecutor:
+        return self._get(
+            'inference_executor',
+            lambda: InferenceExecutor(
+                num_workers=settings.CHOOSE_WORD_INFERENCE_WORKERS,
+                max_queue=settings.CHOOSE_WORD_INFERENCE_MAX_QUEUE or None
+            )
+        )
+
+    @property
+    def bert_tokenizer(self) -> BertTokenizerFast:
+        return self._get(
+            'bert_tokenizer',
+            lambda: BertTokenizerFast.from_pretrained(
+                ChooseWordConfig.bert_path
+            )
+        )
+
+    @property
+    def bert_tokenization_memo(self) -> TokenizationMemo:
+        return self._get(
+            'bert_tokenization_memo',
+            lambda: TokenizationMemo(
+                self.bert_tokenizer,
+                max_entries=settings.CHOOSE_WORD_TOKENIZATION_CACHE_ENTRIES
+            )
+        )
+
+    @property
+    def bert_model(self) -> BertForMaskedLM:
+        return self._get(
+            'bert_model',
+            lambda: load_model(
+                BertForMaskedLM, ChooseWordConfig.bert_path,
+                precision=self.precision['bert']
+            )
+        )
+
+    @property
+    def bert_backend(self):
+        def create():
+            kwargs = {}
+            if self.backend['bert'] == 'onnx':
+                kwargs['export_path'] = os.path.join(
+                    ChooseWordConfig.bert_path, 'onnx',
+                    f'masked_lm_{self.precision["bert"]}.onnx'
+                )
+                # session runs on the share of cores of one worker
+                kwargs['num_threads'] = (
+                    self.inference_executor.threads_per_worker
+                )
+            if self.backend['bert'] != 'eager':
+                kwargs['max_length'] = ChooseWordConfig.max_bert_size
+            return create_masked_lm_backend(
+                self.bert_model, self.backend['bert'], **kwargs
+            )
+
+        return self._get('bert_backend', create)
+
+    @property
+    def bert_score_cache(self) -> ScoreCache:
+        if settings.CHOOSE_WORD_BERT_CACHE_MEMORY <= 0:
+            return None
+        return self._get(
+            'bert_score_cache',
+            lambda: ScoreCache(
+                max_memory=settings.CHOOSE_WORD_BERT_CACHE_MEMORY
+            )
+        )
+
+    @property
+    def bert_scorer_correction(self) -> BertScorerCorrection:
+        return self._get(
+            'bert_scorer_correction',
+            lambda: BertScorerCorrection(
+                self.bert_model, self.bert_tokenizer,
+                max_length=ChooseWordConfig.max_bert_size,
+                max_batch_tokens=ChooseWordConfig.max_bert_batch_tokens,
+                cache=self.bert_score_cache,
+                backend=self.bert_backend
+            )
+        )
+
+    @property
+    def bert_scorer_sentence(self) -> BertScorerSentence:
+        return self._get(
+            'bert_scorer_sentence',
+            lambda: BertScorerSentence(
+                self.bert_model, self.bert_tokenizer,
+                backend=self.bert_backend
+            )
+        )
+
+    @property
+    def bert_batcher(self) -> MicroBatcher:
+        return self._get(
+            'bert_batcher',
+            lambda: MicroBatcher(
+                # model is loaded only when the first batch is flushed
+                lambda *args, **kwargs: self.inference_executor.run(
+                    run_traced, self.bert_scorer_correction.score_tokenized,
+                    *args, **kwargs
+                ),
+                max_batch_tokens=settings.CHOOSE_WORD_MICRO_BATCH_TOKENS,
+                max_wait=settings.CHOOSE_WORD_MICRO_BATCH_WAIT
+            )
+        )
+
+    @property
+    def gpt_tokenizer(self) -> GPT2TokenizerFast:
+        return self._get(
+            'gpt_tokenizer',
+            lambda: GPT2TokenizerFast.from_pretrained(
+                ChooseWordConfig.gpt_path
+            )
+        )
+
+    @property
+    def gpt_tokenization_memo(self) -> TokenizationMemo:
+        return self._get(
+            'gpt_tokenization_memo',
+            lambda: TokenizationMemo(
+                self.gpt_tokenizer,
+                max_entries=settings.CHOOSE_WORD_TOKENIZATION_CACHE_ENTRIES
+            )
+        )
+
+    @property
+    def gpt_model(self) -> GPT2LMHeadModel:
+        return self._get(
+            'gpt_model',
+            lambda: load_model(
+                GPT2LMHeadModel, ChooseWordConfig.gpt_path,
+                precision=self.precision['gpt']
+            )
+        )
+
+    @property
+    def gpt_backend(self):
+        def create():
+            kwargs = {}
+            if self.backend['gpt'] == 'onnx':
+                kwargs['export_dir'] = os.path.join(
+                    ChooseWordConfig.gpt_path, 'onnx',
+                    self.precision['gpt']
+                )
+                # sessions run on the share of cores of one worker
+                kwargs['num_threads'] = (
+                    self.inference_executor.threads_per_worker
+                )
+            if self.backend['gpt'] != 'eager':
+                kwargs['max_length'] = ChooseWordConfig.max_gpt_size
+            return create_causal_lm_backend(
+                self.gpt_model, self.backend['gpt'], **kwargs
+            )
+
+        return self._get('gpt_backend', create)
+
+    @property
+    def gpt_scorer_sentence(self) -> GPTScorerSentence:
+        return self._get(
+            'gpt_scorer_sentence',
+            lambda: GPTScorerSentence(
+                self.gpt_model, self.gpt_tokenizer,
+                max_length=ChooseWordConfig.max_gpt_size,
+                max_batch_tokens=ChooseWordConfig.max_gpt_batch_tokens,
+                backend=self.gpt_backend
+            )
+        )
+
+    @property
+    def gpt_batcher(self) -> MicroBatcher:
+        return self._get(
+            'gpt_batcher',
+            lambda: MicroBatcher(
+                # model is loaded only when the first batch is flushed
+                lambda *args, **kwargs: self.inference_executor.run(
+                    run_traced, self.gpt_scorer_sentence.score_tokenized,
+                    *args, **kwargs
+                ),
+                max_batch_tokens=settings.CHOOSE_WORD_MICRO_BATCH_TOKENS,
+                max_wait=settings.CHOOSE_WORD_MICRO_BATCH_WAIT
+            )
+        )
+
+    def set_precision(self, model_name: str, precision: str):
+        """Change precision mode of model, it is reloaded on next use.
+
+        :param model_name: 'bert' or 'gpt'
+        :param precision: precision mode of inference
+        """
+        with self._lock:
+            self.precision[model_name] = precision
+            # drop model, scorers and cached scores built on top of it
+            for name in list(self._objects):
+                if name.startswith(model_name) and not (
+                        name.endswith('tokenizer')
+                        or name.endswith('tokenization_memo')
+                ):
+                    del self._objects[name]
+
+    def set_backend(self, model_name: str, backend: str):
+        """Change backend of model, it is rebuilt on next use.
+
+        :param model_name: 'bert' or 'gpt'
+        :param backend: name of backend: eager, torchscript or onnx
+        """
+        with self._lock:
+            self.backend[model_name] = backend
+            self._drop_backend(model_name)
+
+    def _drop_backend(self, model_name: str):
+        """Drop backend of model and scorers running it, model is kept.
+
+        :param model_name: 'bert' or 'gpt'
+        """
+        for name in list(self._objects):
+            if name.startswith(model_name) and (
+                    name.endswith('backend') or 'scorer' in name
+            ):
+                del self._objects[name]
+
+    def set_inference_cores(self, cores: List[int]):
+        """Replace inference executor by one running on given cores.
+
+        :param cores: ids of cores to split between workers
+        """
+        with self._lock:
+            executor = self._objects.pop('inference_executor', None)
+            if executor is not None:
+                executor.shutdown()
+            self._objects['inference_executor'] = InferenceExecutor(
+                num_workers=settings.CHOOSE_WORD_INFERENCE_WORKERS,
+                cores=cores,
+                max_queue=settings.CHOOSE_WORD_INFERENCE_MAX_QUEUE or None
+            )
+            # threads of ONNX Runtime are fixed when session is created,
+            # so sessions are rebuilt for the new share of cores
+            for model_name, backend in self.backend.items():
+                if backend == 'onnx':
+                    self._drop_backend(model_name)
+
+    def warmup(self):
+        """Load all models and run one forward pass through each scorer."""
+        self.sentence_splitter
+
+        mask_token = self.bert_tokenizer.mask_token
+        self.bert_scorer_correction(
+            [f'Paris is the {mask_token} of France.'], [['capital', 'city']]
+        )
+        self.bert_scorer_sentence(['Paris is the capital of France.'])
+        self.gpt_scorer_sentence(['Paris is the capital of France.'])
+
+        self._ready.set()
+
+    def is_ready(self) -> bool:
+        """Check that warmup is finished."""
+        return self._ready.is_set()
+
+    def stats(self) -> Dict[str, bool]:
+        """Get which objects are already loaded.
+
+        :returns: dict with loaded names
+        """
+        with self._lock:
+            return {name: True for name in self._objects}
+
+
+registry = ModelRegistry()
@@ -1,12 +1,17 @@
 from typing import List
 
 from rest_framework import serializers
+from rest_framework.fields import empty
 from rest_framework.exceptions import ValidationError
 
+from src.Timing import timed_stage
+
 from .apps import ChooseWordConfig
+from .models import Job
+from .registry import registry
 
 
-def validator_no_unk_mask_tokens(tokenizer):
+def validator_no_unk_mask_tokens(get_tokenization_memo):
     def validate_no_unk_mask_tokens(string_to_check):
         """Check absense of [UNK] and [MASK] tokens in value.
 
@@ -14,12 +19,9 @@ def validator_no_unk_mask_tokens(tokenizer):
 
         :returns: validated value
         """
-        tokenized_string = tokenizer(
-            string_to_check,
-            add_special_tokens=False,
-            padding=False,
-            truncation='do_not_truncate',
-        )['input_ids']
+        tokenization_memo = get_tokenization_memo()
+        tokenizer = tokenization_memo.tokenizer
+        tokenized_string = tokenization_memo([string_to_check])[0]
         # validate absense of [UNK] tokens
         if tokenizer.unk_token_id is not None:
             if tokenized_string.count(tokenizer.unk_token_id):
@@ -79,13 +81,9 @@ def validate_candidates_sizes(list_candidates: List[str]):
     :returns: validated value
     """
     # tokenize candidates for further validation
-    tokenizer = ChooseWordConfig.bert_tokenizer
-    tokenized_candidates = tokenizer(
-        list_candidates,
-        add_special_tokens=False,
-        padding=False,
-        truncation='do_not_truncate',
-    )['input_ids']
+    tokenized_candidates = registry.bert_tokenization_memo(
+        list_candidates
+    )
 
     # validate candidates are not too big
     max_len = max(
@@ -99,13 +97,39 @@ def validate_candidates_sizes(list_candidates: List[str]):
     return list_candidates
 
 
+def collect_strings(data) -> List[str]:
+    """Collect all strings of test item to tokenize them in advance.
+
+    :param data: raw data of test item, it may be invalid
+
+    :returns: list of strings from text parts and candidates
+        with whitespaces trimmed as CharField does
+    """
+    strings = []
+    if not isinstance(data, dict):
+        return strings
+    text_parts = data.get('text_parts')
+    if isinstance(text_parts, list):
+        strings += [x.strip() for x in text_parts if isinstance(x, str)]
+    candidates = data.get('candidates')
+    if isinstance(candidates, list):
+        for gap_candidates in candidates:
+            if isinstance(gap_candidates, list):
+                strings += [
+                    x.strip() for x in gap_candidates if isinstance(x, str)
+                ]
+    return strings
+
+
 class BertTestItemSerializer(serializers.Serializer):
     """Item of test to solve using BERT algorightm."""
     text_parts = serializers.ListField(
         child=serializers.CharField(
             allow_blank=True,
             validators=[
-                validator_no_unk_mask_tokens(ChooseWordConfig.bert_tokenizer)
+                validator_no_unk_mask_tokens(
+                    lambda: registry.bert_tokenization_memo
+                )
             ]
         ),
     )
@@ -113,12 +137,24 @@ class BertTestItemSerializer(serializers.Serializer):
         child=serializers.CharField(
             allow_blank=True,
             validators=[
-                validator_no_unk_mask_tokens(ChooseWordConfig.bert_tokenizer)
+                validator_no_unk_mask_tokens(
+                    lambda: registry.bert_tokenization_memo
+                )
             ]
         ),
         validators=[validate_candidates_numbers, validate_candidates_sizes]
     ))
 
+    def to_internal_value(self, data):
+        """Tokenize all strings by one call before validation of fields."""
+        registry.bert_tokenization_memo(collect_strings(data))
+        return super().to_internal_value(data)
+
+    def run_validation(self, data=empty):
+        """Validate test item measuring time of validation."""
+        with timed_stage('validate'):
+            return super().run_validation(data)
+
     def validate(self, data):
         """Make validation, that requires many fields."""
         if len(data['text_parts']) != len(data['candidates']) + 1:
@@ -133,7 +169,9 @@ class GPTTestItemSerializer(serializers.Serializer):
         child=serializers.CharField(
             allow_blank=True,
             validators=[
-                validator_no_unk_mask_tokens(ChooseWordConfig.gpt_tokenizer)
+                validator_no_unk_mask_tokens(
+                    lambda: registry.gpt_tokenization_memo
+                )
             ]
         ),
     )
@@ -141,15 +179,66 @@ class GPTTestItemSerializer(serializers.Serializer):
         child=serializers.CharField(
             allow_blank=True,
             validators=[
-                validator_no_unk_mask_tokens(ChooseWordConfig.gpt_tokenizer)
+                validator_no_unk_mask_tokens(
+                    lambda: registry.gpt_tokenization_memo
+                )
             ]
         ),
         validators=[validate_candidates_numbers]
     ))
 
+    def to_internal_value(self, data):
+        """Tokenize all strings by one call before validation of fields."""
+        registry.gpt_tokenization_memo(collect_strings(data))
+        return super().to_internal_value(data)
+
+    def run_validation(self, data=empty):
+        """Validate test item measuring time of validation."""
+        with timed_stage('validate'):
+            return super().run_validation(data)
+
     def validate(self, data):
         """Make validation, that requires many fields."""
         if len(data['text_parts']) != len(data['candidates']) + 1:
             raise ValidationError('Wrong lengths of input!')
 
         return data
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """State of background job without its input and result."""
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'status', 'progress', 'error',
+            'created_at', 'started_at', 'finished_at'
+        ]
+
+
+class JobCreateSerializer(serializers.Serializer):
+    """Request to put job into queue."""
+    kind = serializers.ChoiceField(choices=Job.KIND_CHOICES)
+    payload = serializers.DictField(required=False, default=dict)
+
+    def validate(self, data):
+        """Validate test item of solve jobs by serializer of algorithm."""
+        item_serializers = {
+            Job.KIND_BERT: (
+                BertTestItemSerializer, registry.bert_tokenization_memo
+            ),
+            Job.KIND_GPT: (
+                GPTTestItemSerializer, registry.gpt_tokenization_memo
+            )
+        }
+        if data['kind'] not in item_serializers:
+            data['payload'] = {}
+            return data
+
+        serializer_class, tokenization_memo = item_serializers[data['kind']]
+        with tokenization_memo.scope():
+            serializer = serializer_class(data=data['payload'])
+            if not serializer.is_valid():
+                raise ValidationError({'payload': serializer.errors})
+        data['payload'] = serializer.data
+        return data
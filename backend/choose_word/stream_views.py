@@ -0,0 +1,139 @@
+import json
+import logging
+import queue
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterator
+
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from src.Scheduler import ExecutorBusyError, MicroBatcher
+
+from .async_views import method_not_allowed
+from .serializers import BertTestItemSerializer, GPTTestItemSerializer
+from .utils import (
+    prepare_text_bert, normalize_scores_bert,
+    prepare_text_gpt, normalize_scores_gpt
+)
+from .registry import registry
+from .views import InferenceBusy
+
+logger = logging.getLogger(__name__)
+
+
+def to_event(event: str, data: Dict) -> bytes:
+    """Encode server-sent event.
+
+    :param event: name of event
+    :param data: data of event to send as JSON
+
+    :returns: event in text/event-stream format
+    """
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8')
+
+
+def stream_gaps(
+        events: queue.Queue, future: Future, normalize: Callable
+) -> Iterator[bytes]:
+    """Yield result of each gap as soon as it is scored.
+
+    :param events: queue with index and scores of each scored gap,
+        None is put after the end of scoring
+    :param future: future of scoring of all gaps
+    :param normalize: function to turn scores into percents
+
+    :returns: gap events followed by done or error event
+    """
+    num_gaps = 0
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            gap_idx, scores = event
+            num_gaps += 1
+            yield to_event('gap', {
+                'gap': gap_idx, 'result': normalize([scores])[0]
+            })
+        future.result()
+    except ExecutorBusyError:
+        yield to_event('error', {'detail': InferenceBusy.default_detail})
+    except Exception as e:
+        logger.exception('Failed to stream results of gaps')
+        yield to_event('error', {'detail': str(e) or type(e).__name__})
+    else:
+        yield to_event('done', {'gaps': num_gaps})
+
+
+def stream_solve(
+        request,
+        serializer_class,
+        tokenization_memo,
+        prepare: Callable,
+        batcher: MicroBatcher,
+        normalize: Callable
+):
+    """Validate request and stream results of gaps as server-sent events.
+
+    Gaps are scored in order of the text, so the first gaps
+    are sent before the whole text is processed.
+
+    :param request: request with test item
+    :param serializer_class: serializer to validate test item
+    :param tokenization_memo: memo to share tokenization
+        between validation and processing
+    :param prepare: function to create tasks from test item
+    :param batcher: micro-batcher to score tasks
+    :param normalize: function to turn scores into percents
+
+    :returns: response with event for each gap
+    """
+    if request.method != 'POST':
+        return method_not_allowed(request)
+    try:
+        data = json.loads(request.body)
+    except ValueError as e:
+        return JsonResponse(
+            {'detail': f'JSON parse error - {e}'}, status=400
+        )
+
+    with tokenization_memo.scope():
+        serializer = serializer_class(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        data = serializer.data
+        tasks = prepare(data['text_parts'], data['candidates'])
+
+    events = queue.Queue()
+    future = batcher.submit(
+        *tasks,
+        on_gap_scored=lambda gap_idx, scores: events.put((gap_idx, scores))
+    )
+    future.add_done_callback(lambda _: events.put(None))
+
+    response = StreamingHttpResponse(
+        stream_gaps(events, future, normalize),
+        content_type='text/event-stream'
+    )
+    # events should reach client without buffering
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@csrf_exempt
+def choose_word_bert(request):
+    """Controller for streaming results of BERT algorithm by gaps."""
+    return stream_solve(
+        request, BertTestItemSerializer, registry.bert_tokenization_memo,
+        prepare_text_bert, registry.bert_batcher, normalize_scores_bert
+    )
+
+
+@csrf_exempt
+def choose_word_gpt(request):
+    """Controller for streaming results of GPT algorithm by gaps."""
+    return stream_solve(
+        request, GPTTestItemSerializer, registry.gpt_tokenization_memo,
+        prepare_text_gpt, registry.gpt_batcher, normalize_scores_gpt
+    )
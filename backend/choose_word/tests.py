@@ -1,14 +1,62 @@
+import json
+import os
+import tempfile
+from concurrent.futures import Future
+from typing import List, Tuple
+from unittest import mock
+
+import torch
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
+from transformers import BertForMaskedLM, GPT2LMHeadModel
+from transformers.modeling_utils import Conv1D
+
+from src.BertScorer import (
+    BertScorerCorrection, EagerMaskedLMBackend, ScoreCache,
+    create_masked_lm_backend, masked_lm_logits
+)
+from src.GPTScorer import (
+    EagerCausalLMBackend, GPTScorerSentence, causal_lm_log_probs,
+    create_causal_lm_backend
+)
+from src.MmapWeights import (
+    build_mmap_model, has_mmap_weights, save_mmap_weights
+)
+from src.Precision import apply_precision, bf16_supported
+from src.Precision.precision import _conv1d_to_linear
+from src.Scheduler import (
+    ExecutorBusyError, MicroBatcher, ShapeBuckets, TokenBudgetScheduler
+)
+from src.Splitting import RuleSplitter
+from src.Tokenization import TokenizationMemo
 
 from .apps import ChooseWordConfig
+from .jobs import job_queue
+from .models import Job
+from .registry import registry
+from .utils import (
+    normalize_scores_gpt, prepare_text_gpt, process_text_gpt, split_sentences
+)
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+def failed_submit(*args, **kwargs) -> Future:
+    """Replace submit of micro-batcher by one failing to score."""
+    future = Future()
+    future.set_exception(RuntimeError('Scorer failed!'))
+    return future
 
 
 class BertValidationTests(APITestCase):
     """Test case to test validation of input for BERT algorithm."""
     url = reverse('choose_word_bert')
-    tokenizer = ChooseWordConfig.bert_tokenizer
+    tokenizer = registry.bert_tokenizer
 
     def test_ok(self):
         """Test good case."""
@@ -151,7 +199,7 @@ class BertValidationTests(APITestCase):
 class GPTValidationTests(APITestCase):
     """Test case to test validation of input for GPT algorithm."""
     url = reverse('choose_word_gpt')
-    tokenizer = ChooseWordConfig.gpt_tokenizer
+    tokenizer = registry.gpt_tokenizer
 
     def test_ok(self):
         """Test good case."""
@@ -257,3 +305,1418 @@ class GPTValidationTests(APITestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+
+class StatsTests(APITestCase):
+    """Test case to test counters of inference caches."""
+    url = reverse('choose_word_stats')
+
+    def test_bert_cache_hits(self):
+        """Test that repeated request is taken from cache."""
+        data = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital', 'city']]
+        }
+        self.client.post(reverse('choose_word_bert'), data, format='json')
+        hits = self.client.get(self.url).data['bert_cache']['hits']
+
+        response = self.client.post(
+            reverse('choose_word_bert'), data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = self.client.get(self.url).data['bert_cache']
+        self.assertGreater(stats['hits'], hits)
+        self.assertLessEqual(stats['memory'], stats['max_memory'])
+
+    def test_tokenization_memo_misses(self):
+        """Test that strings of request are tokenized only once."""
+        data = {
+            'text_parts': ['Berlin is the', 'of Germany.'],
+            'candidates': [['capital', 'town']]
+        }
+        misses = self.client.get(self.url).data['gpt_tokenization']['misses']
+
+        response = self.client.post(
+            reverse('choose_word_gpt'), data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = self.client.get(self.url).data['gpt_tokenization']
+        # text parts, candidates with and without the leading space
+        # and the sentence at most
+        self.assertLessEqual(stats['misses'] - misses, 7)
+        self.assertGreater(stats['hits'], 0)
+
+    def test_inference_executor_counters(self):
+        """Test that requests are run on inference executor."""
+        data = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital', 'city']]
+        }
+        completed = self.client.get(
+            self.url
+        ).data['inference_executor']['completed']
+
+        response = self.client.post(
+            reverse('choose_word_bert'), data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = self.client.get(self.url).data['inference_executor']
+        self.assertEqual(stats['completed'], completed + 1)
+        self.assertEqual(stats['queued'], 0)
+
+    def test_micro_batcher_counters(self):
+        """Test that gaps of request are scored by micro-batcher."""
+        data = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital', 'city']]
+        }
+        gaps = self.client.get(self.url).data['gpt_batcher']['gaps']
+
+        response = self.client.post(
+            reverse('choose_word_gpt'), data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = self.client.get(self.url).data['gpt_batcher']
+        self.assertEqual(stats['gaps'], gaps + 1)
+        self.assertEqual(stats['pending_calls'], 0)
+
+
+class ReadyTests(APITestCase):
+    """Test case to test readiness of models."""
+    url = reverse('choose_word_ready')
+
+    def test_ready_after_warmup(self):
+        """Test that service is ready after warmup."""
+        registry.warmup()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['ready'])
+
+
+class AsyncSolveTests(APITestCase):
+    """Test case to test async endpoints of algorithms."""
+
+    def test_bert_results(self):
+        """Test that async BERT endpoint returns percents for each gap."""
+        data = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital', 'city']]
+        }
+        response = self.client.post(
+            reverse('choose_word_bert_async'), data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 1)
+        self.assertAlmostEqual(sum(response.json()[0]), 1)
+
+    def test_gpt_results(self):
+        """Test that async GPT endpoint returns percents for each gap."""
+        data = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital', 'city']]
+        }
+        response = self.client.post(
+            reverse('choose_word_gpt_async'), data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertAlmostEqual(sum(response.json()[0]), 1)
+
+    def test_validation(self):
+        """Test that async endpoint validates input."""
+        data = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital']]
+        }
+        response = self.client.post(
+            reverse('choose_word_bert_async'), data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('candidates', response.json())
+
+
+class BulkSolveTests(APITestCase):
+    """Test case to test bulk endpoints of algorithms."""
+
+    def post_items(self, url_name, lines):
+        """Post NDJSON lines and read streamed result lines."""
+        response = self.client.generic(
+            'POST', reverse(url_name), '\n'.join(lines),
+            content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join(response.streaming_content)
+        results = [json.loads(line) for line in content.splitlines()]
+        return sorted(results, key=lambda x: x['index'])
+
+    def test_bert_results(self):
+        """Test that each item gets its own result line."""
+        item = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital', 'city']]
+        }
+        lines = [json.dumps(item)] * 3
+        results = self.post_items('choose_word_bert_bulk', lines)
+        self.assertEqual([x['index'] for x in results], [0, 1, 2])
+        for result in results:
+            self.assertEqual(len(result['result']), 1)
+            self.assertAlmostEqual(sum(result['result'][0]), 1)
+
+    def test_gpt_errors(self):
+        """Test that invalid items get errors without stopping others."""
+        item = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital', 'city']]
+        }
+        invalid_item = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital']]
+        }
+        lines = [json.dumps(invalid_item), 'not json', json.dumps(item)]
+        results = self.post_items('choose_word_gpt_bulk', lines)
+        self.assertIn('candidates', results[0]['errors'])
+        self.assertIn('detail', results[1]['errors'])
+        self.assertAlmostEqual(sum(results[2]['result'][0]), 1)
+
+    def test_scoring_error(self):
+        """Test that error of scoring is reported for each item."""
+        item = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital', 'city']]
+        }
+        lines = [json.dumps(item)] * 2
+        with mock.patch.object(
+                registry.gpt_batcher, 'submit', failed_submit
+        ):
+            results = self.post_items('choose_word_gpt_bulk', lines)
+        self.assertEqual([x['index'] for x in results], [0, 1])
+        for result in results:
+            self.assertEqual(result['errors']['detail'], 'Scorer failed!')
+
+
+class StreamSolveTests(APITestCase):
+    """Test case to test streaming of results by gaps."""
+
+    data = {
+        'text_parts': ['Paris is the', 'of France. It is a', 'city.'],
+        'candidates': [['capital', 'city'], ['big', 'small']]
+    }
+
+    def read_events(self, url_name):
+        """Post test item and parse server-sent events."""
+        response = self.client.post(
+            reverse(url_name), self.data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        events = []
+        for block in content.strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event[len('event: '):],
+                           json.loads(data[len('data: '):])))
+        return events
+
+    def test_bert_events(self):
+        """Test that each gap is sent before the done event."""
+        events = self.read_events('choose_word_bert_stream')
+        self.assertEqual([x[0] for x in events], ['gap', 'gap', 'done'])
+        self.assertEqual(sorted(x[1]['gap'] for x in events[:-1]), [0, 1])
+        for _, data in events[:-1]:
+            self.assertAlmostEqual(sum(data['result']), 1)
+
+    def test_gpt_events_match_results(self):
+        """Test that streamed results are the same as results of solve."""
+        events = self.read_events('choose_word_gpt_stream')
+        response = self.client.post(
+            reverse('choose_word_gpt'), self.data, format='json'
+        )
+        streamed = sorted(
+            (data['gap'], data['result']) for event, data in events
+            if event == 'gap'
+        )
+        for (_, result), expected in zip(streamed, response.data):
+            for x, y in zip(result, expected):
+                self.assertAlmostEqual(x, y)
+
+    def test_scoring_error(self):
+        """Test that error of scoring ends stream with error event."""
+        with mock.patch.object(
+                registry.bert_batcher, 'submit', failed_submit
+        ):
+            events = self.read_events('choose_word_bert_stream')
+        self.assertEqual(
+            events, [('error', {'detail': 'Scorer failed!'})]
+        )
+
+
+@override_settings(CHOOSE_WORD_JOB_WORKERS=0)
+class JobTests(APITestCase):
+    """Test case to test background jobs, they are run by the test."""
+
+    data = {
+        'text_parts': ['Paris is the', 'of France.'],
+        'candidates': [['capital', 'city']]
+    }
+
+    def test_solve_job(self):
+        """Test that job goes from queue to result."""
+        response = self.client.post(
+            reverse('choose_word_jobs'),
+            {'kind': 'bert', 'payload': self.data}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'queued')
+        job_url = response['Location']
+        result_url = reverse(
+            'choose_word_job_result', args=[response.data['id']]
+        )
+        response = self.client.get(result_url)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        self.assertTrue(job_queue.run_next())
+        response = self.client.get(job_url)
+        self.assertEqual(response.data['status'], 'done')
+        self.assertEqual(response.data['progress'], 1.0)
+        response = self.client.get(result_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertAlmostEqual(sum(response.data[0]), 1)
+
+    def test_invalid_payload(self):
+        """Test that test item of job is validated."""
+        data = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital']]
+        }
+        response = self.client.post(
+            reverse('choose_word_jobs'),
+            {'kind': 'gpt', 'payload': data}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('payload', response.data)
+
+    @override_settings(CHOOSE_WORD_MAX_SYNC_TOKENS=1)
+    def test_oversized_solve(self):
+        """Test that too big test item is put into queue."""
+        response = self.client.post(
+            reverse('choose_word_gpt'), self.data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['kind'], 'gpt')
+        self.assertTrue(job_queue.run_next())
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.data['status'], 'done')
+
+    def test_sync_solve_default(self):
+        """Test that test items are solved during request by default."""
+        response = self.client.post(
+            reverse('choose_word_gpt'), self.data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Job.objects.exists())
+
+    def test_benchmark_job(self):
+        """Test that benchmark is run in background."""
+        response = self.client.get(reverse('choose_word_benchmark'))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['kind'], 'benchmark')
+
+        # unfinished benchmark is reused by repeated requests
+        job_id = response.data['id']
+        response = self.client.get(reverse('choose_word_benchmark_async'))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['id'], job_id)
+
+    @override_settings(CHOOSE_WORD_MAX_SYNC_TOKENS=1)
+    def test_oversized_async_solve(self):
+        """Test that too big test item is put into queue by async view."""
+        response = self.client.post(
+            reverse('choose_word_bert_async'), self.data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['kind'], 'bert')
+
+    def test_recover_stale(self):
+        """Test that jobs of dead processes are put back into queue."""
+        dead_job = Job.objects.create(
+            kind=Job.KIND_GPT, payload=self.data, status=Job.STATUS_RUNNING,
+            worker=job_queue.worker_name(2 ** 22 + 1)
+        )
+        alive_job = Job.objects.create(
+            kind=Job.KIND_GPT, payload=self.data, status=Job.STATUS_RUNNING,
+            worker=job_queue.worker_name(os.getppid())
+        )
+        self.assertEqual(job_queue.recover_stale(), 1)
+        dead_job.refresh_from_db()
+        alive_job.refresh_from_db()
+        self.assertEqual(dead_job.status, Job.STATUS_QUEUED)
+        self.assertEqual(alive_job.status, Job.STATUS_RUNNING)
+
+
+class MetricsTests(APITestCase):
+    """Test case to test timing of requests and metrics endpoint."""
+
+    def test_server_timing(self):
+        """Test that solve response has time of each stage."""
+        data = {
+            'text_parts': ['Paris is the', 'of France.'],
+            'candidates': [['capital', 'city']]
+        }
+        response = self.client.post(
+            reverse('choose_word_bert'), data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stages = [
+            x.split(';')[0] for x in response['Server-Timing'].split(', ')
+        ]
+        for stage in ['validate', 'split', 'tokenize', 'inference', 'total']:
+            self.assertIn(stage, stages)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = response.content.decode('utf-8')
+        self.assertIn('# TYPE choose_word_batch_rows histogram', content)
+        pid = os.getpid()
+        self.assertIn(
+            f'choose_word_scorer_rows_count{{pid="{pid}",model="bert"}}',
+            content
+        )
+        self.assertIn(
+            f'choose_word_requests_total{{pid="{pid}",'
+            f'view="choose_word_bert",status="200"}}',
+            content
+        )
+
+
+@override_settings(
+    CHOOSE_WORD_PROFILE_TOKEN='secret',
+    CHOOSE_WORD_PROFILE_DIR=os.path.join(tempfile.mkdtemp(), 'profiles')
+)
+class ProfilingTests(APITestCase):
+    """Test case to test profiling of requests on demand."""
+    data = {
+        'text_parts': ['Paris is the', 'of France.'],
+        'candidates': [['capital', 'city']]
+    }
+
+    def test_not_requested(self):
+        """Test that request without token is not profiled."""
+        response = self.client.post(
+            reverse('choose_word_bert'), self.data, format='json',
+            HTTP_X_PROFILE='wrong'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+
+        response = self.client.get(reverse('choose_word_profiles'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_profile(self):
+        """Test that profile files are written and listed."""
+        url = reverse('choose_word_gpt') + '?profile=secret'
+        response = self.client.post(url, self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        name = response['X-Profile-Id']
+
+        response = self.client.get(
+            reverse('choose_word_profiles'), HTTP_X_PROFILE='secret'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [x['name'] for x in response.data]
+        self.assertIn(f'{name}.pstats', names)
+        self.assertIn(f'{name}.torch0.json', names)
+
+        response = self.client.get(
+            reverse('choose_word_profile', args=[f'{name}.pstats']),
+            HTTP_X_PROFILE='secret'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SentenceSplitterTests(APITestCase):
+    """Test case to test rule-based splitting into sentences."""
+
+    def test_split(self):
+        """Test that sentences end only at real boundaries."""
+        text = (
+            'Mr. Smith met Dr. J. Brown, e.g. at noon. Was it [UNK]? '
+            '“Yes!” [UNK] said... and left.'
+        )
+        self.assertEqual(RuleSplitter()(text), [
+            'Mr. Smith met Dr. J. Brown, e.g. at noon.',
+            'Was it [UNK]?',
+            '“Yes!”',
+            '[UNK] said... and left.'
+        ])
+
+    @override_settings(CHOOSE_WORD_SENTENCE_SPLITTER='rules')
+    def test_solve(self):
+        """Test that gaps are assigned to sentences split by rules."""
+        registry._objects.pop('sentence_splitter', None)
+        try:
+            data = {
+                'text_parts': ['Paris is the', 'of France. It is', '.'],
+                'candidates': [['capital', 'city'], ['big', 'small']]
+            }
+            response = self.client.post(
+                reverse('choose_word_bert'), data, format='json'
+            )
+        finally:
+            registry._objects.pop('sentence_splitter', None)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+
+
+class BertScorerCorrectionTests(APITestCase):
+    """Test case to test batching of rows of BERT correction scorer."""
+    sentence = 'paris is the [MASK] of france.'
+    # candidates of two tokens share both of their rows
+    candidates = ['capital', 'big city', 'the city']
+
+    def setUp(self):
+        """Take model and tokenizer."""
+        self.model = registry.bert_model
+        self.tokenizer = registry.bert_tokenizer
+
+    def score(self, scorer):
+        """Score the sentence and collect batches passed to the model."""
+        batches = []
+        score_batch = scorer._score_batch
+
+        def record_batch(batch):
+            batches.append(batch)
+            return score_batch(batch)
+
+        with mock.patch.object(scorer, '_score_batch', record_batch):
+            scores = scorer([self.sentence], [self.candidates])
+        return scores, batches
+
+    def test_rows(self):
+        """Test that each pattern of candidates is scored by one row."""
+        scorer = BertScorerCorrection(
+            self.model, self.tokenizer, batch_size=2
+        )
+        scores, batches = self.score(scorer)
+        self.assertEqual([len(x) for x in scores[0]], [1, 2, 2])
+        self.assertEqual(scores[0][1][1], scores[0][2][1])
+        self.assertEqual(sum(len(x['answers']) for x in batches), 3)
+        self.assertTrue(all(len(x['answers']) <= 2 for x in batches))
+
+        # [MASK] is replaced by [UNK] tokens of the candidate
+        # with one [MASK] among them, only [MASK] is attended to
+        tokenizer = self.tokenizer
+        input_ids = tokenizer(self.sentence)['input_ids']
+        mask_index = input_ids.index(tokenizer.mask_token_id)
+        expected_rows = set()
+        for length, position in [(1, 0), (2, 0), (2, 1)]:
+            span = [tokenizer.unk_token_id] * length
+            span[position] = tokenizer.mask_token_id
+            row = input_ids[:mask_index] + span + input_ids[mask_index + 1:]
+            attention_mask = [1] * len(row)
+            for i in range(length):
+                if i != position:
+                    attention_mask[mask_index + i] = 0
+            expected_rows.add(
+                (tuple(row), tuple(attention_mask), mask_index + position)
+            )
+
+        rows = set()
+        for batch in batches:
+            for row, attention_mask, row_mask_index in zip(
+                    batch['input_ids'].tolist(),
+                    batch['attention_mask'].tolist(),
+                    batch['mask_indexes'].tolist()
+            ):
+                # rows are padded from the right without attention
+                length = len(row)
+                while row[length - 1] == tokenizer.pad_token_id:
+                    length -= 1
+                self.assertEqual(sum(attention_mask[length:]), 0)
+                rows.add((
+                    tuple(row[:length]), tuple(attention_mask[:length]),
+                    row_mask_index
+                ))
+        self.assertEqual(rows, expected_rows)
+
+    def test_max_batch_tokens(self):
+        """Test that batches fit into the token budget."""
+        results = []
+        for max_batch_tokens in [8, 24, 8192]:
+            scorer = BertScorerCorrection(
+                self.model, self.tokenizer,
+                max_batch_tokens=max_batch_tokens
+            )
+            scores, batches = self.score(scorer)
+            for batch in batches:
+                if len(batch['answers']) > 1:
+                    self.assertLessEqual(
+                        batch['input_ids'].numel(), max_batch_tokens
+                    )
+            # every row is longer than the smallest budget
+            if max_batch_tokens == 8:
+                self.assertEqual(len(batches), 3)
+            if max_batch_tokens == 8192:
+                self.assertEqual(len(batches), 1)
+            results.append([
+                x for candidate in scores[0] for x in candidate
+            ])
+
+        for scores in results[1:]:
+            for x, y in zip(scores, results[0]):
+                self.assertAlmostEqual(x, y, delta=1e-5)
+
+    def test_mask_only_head(self):
+        """Test that prediction head is applied only at [MASK] tokens."""
+        model_input = self.tokenizer(
+            [self.sentence, 'the [MASK] is big.'],
+            padding=True, return_tensors='pt'
+        )
+        mask_indexes = (
+            model_input['input_ids'] == self.tokenizer.mask_token_id
+        ).nonzero()[:, 1]
+
+        head_shapes = []
+        hook = self.model.cls.register_forward_pre_hook(
+            lambda module, inputs: head_shapes.append(inputs[0].shape)
+        )
+        try:
+            with torch.no_grad():
+                logits = masked_lm_logits(
+                    self.model, model_input, mask_indexes,
+                    mask_only_head=True
+                )
+                full_logits = masked_lm_logits(
+                    self.model, model_input, mask_indexes,
+                    mask_only_head=False
+                )
+        finally:
+            hook.remove()
+
+        hidden_size = self.model.config.hidden_size
+        self.assertEqual(head_shapes, [
+            (2, hidden_size),
+            (*model_input['input_ids'].shape, hidden_size)
+        ])
+        self.assertEqual(logits.shape, (2, self.model.config.vocab_size))
+        self.assertTrue(torch.allclose(logits, full_logits, atol=1e-5))
+
+    def test_row_cache(self):
+        """Test that scored rows are taken from the cache."""
+        cache = ScoreCache()
+        scorer = BertScorerCorrection(
+            self.model, self.tokenizer, cache=cache
+        )
+        scores, _ = self.score(scorer)
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+        cached_scores, batches = self.score(scorer)
+        self.assertEqual(batches, [])
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertEqual(cached_scores, scores)
+
+    def test_score_tokenized(self):
+        """Test that scoring of token ids gives scores of the text."""
+        scorer = BertScorerCorrection(self.model, self.tokenizer)
+        input_ids = self.tokenizer(
+            self.sentence, add_special_tokens=False
+        )['input_ids']
+        gap_index = input_ids.index(self.tokenizer.mask_token_id)
+        candidates = self.tokenizer(
+            self.candidates, add_special_tokens=False
+        )['input_ids']
+        self.assertEqual(
+            scorer.score_tokenized([input_ids], [gap_index], [candidates]),
+            scorer([self.sentence], [self.candidates])
+        )
+
+
+class SchedulerTests(APITestCase):
+    """Test case to test splitting of rows into batches."""
+    lengths = [5, 17, 3, 9, 9, 40, 1, 12, 12, 7]
+
+    def test_token_budget(self):
+        """Test that each row is batched once within the budget."""
+        for max_batch_tokens in [8, 32, 64, 1024]:
+            scheduler = TokenBudgetScheduler(max_batch_tokens)
+            batches = scheduler(self.lengths)
+            self.assertEqual(
+                sorted(x for batch in batches for x in batch),
+                list(range(len(self.lengths)))
+            )
+            for batch in batches:
+                padded_size = len(batch) * max(
+                    self.lengths[x] for x in batch
+                )
+                # only row longer than the budget may exceed it
+                if padded_size > max_batch_tokens:
+                    self.assertEqual(len(batch), 1)
+
+    def test_close_lengths(self):
+        """Test that rows of close lengths are batched together."""
+        scheduler = TokenBudgetScheduler(32)
+        self.assertEqual(scheduler([3, 16, 4, 15]), [[0, 2], [3, 1]])
+
+    def test_max_batch_size(self):
+        """Test that batches are limited by the number of rows."""
+        scheduler = TokenBudgetScheduler(1024, max_batch_size=3)
+        batches = scheduler(self.lengths)
+        self.assertEqual([len(x) for x in batches], [3, 3, 3, 1])
+
+    def test_shape_buckets(self):
+        """Test that sizes are rounded up to the nearest bucket."""
+        buckets = ShapeBuckets.powers_of_two(100, min_size=16)
+        self.assertEqual(buckets.sizes, [16, 32, 64, 100])
+        self.assertEqual(
+            [buckets(x) for x in [1, 16, 17, 65, 100, 101]],
+            [16, 16, 32, 100, 100, 101]
+        )
+        self.assertEqual(buckets(40, limit=50), 40)
+
+    def test_priorities(self):
+        """Test that rows of higher priority are batched first."""
+        scheduler = TokenBudgetScheduler(32)
+        batches = scheduler([3, 16, 4, 15], priorities=[1, 0, 1, 0])
+        self.assertEqual(batches, [[3, 1], [0, 2]])
+
+
+class ScoreCacheTests(APITestCase):
+    """Test case to test LRU cache of scored rows."""
+
+    def test_answers(self):
+        """Test that row is taken only if all answers are cached."""
+        cache = ScoreCache()
+        self.assertIsNone(cache.get(1, [10, 20]))
+        cache.put(1, [10, 20], [-1.0, -2.0])
+        self.assertEqual(cache.get(1, [20, 10]), [-2.0, -1.0])
+        self.assertIsNone(cache.get(1, [10, 30]))
+
+        cache.put(1, [30], [-3.0])
+        self.assertEqual(cache.get(1, [10, 30]), [-1.0, -3.0])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_eviction(self):
+        """Test that least recently used rows are evicted."""
+        entry_size = ScoreCache.entry_overhead + ScoreCache.answer_size + 8
+        cache = ScoreCache(max_memory=2 * entry_size)
+        cache.put(1, [10], [-1.0])
+        cache.put(2, [10], [-2.0])
+        cache.get(1, [10])
+        cache.put(3, [10], [-3.0])
+
+        self.assertIsNone(cache.get(2, [10]))
+        self.assertEqual(cache.get(1, [10]), [-1.0])
+        self.assertEqual(cache.get(3, [10]), [-3.0])
+        stats = cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['memory'], 2 * entry_size)
+
+        cache.clear()
+        self.assertEqual(cache.stats()['memory'], 0)
+
+
+class GPTScorerSentenceTests(APITestCase):
+    """Test case to test batching and caching of GPT scorer."""
+
+    def setUp(self):
+        """Take model and tokenizer."""
+        self.model = registry.gpt_model
+        self.tokenizer = registry.gpt_tokenizer
+
+    def test_windows(self):
+        """Test that long sentence is split into overlapping windows."""
+        scorer = GPTScorerSentence(
+            self.model, self.tokenizer, max_length=64, stride=32
+        )
+        windows = scorer._create_windows([list(range(70)), list(range(20))])
+        self.assertEqual(
+            [
+                (x['sentence'], x['begin'], x['end'], x['target_length'])
+                for x in windows
+            ],
+            [(0, 0, 32, 32), (0, 0, 64, 32), (0, 32, 70, 6), (1, 0, 20, 20)]
+        )
+
+    def test_max_batch_tokens(self):
+        """Test that windows of all sentences are batched by budget."""
+        sentences = [
+            ' '.join(['The quick brown fox jumps over the lazy dog.'] * n)
+            for n in [1, 2, 4]
+        ]
+        input_ids = self.tokenizer(sentences)['input_ids']
+
+        results = []
+        for max_batch_tokens in [16, 128, 2048]:
+            scorer = GPTScorerSentence(
+                self.model, self.tokenizer, max_length=32, stride=16,
+                max_batch_tokens=max_batch_tokens
+            )
+            batches = []
+            score_batch = scorer._score_batch
+
+            def record_batch(batch_input_ids, windows):
+                batches.append(windows)
+                return score_batch(batch_input_ids, windows)
+
+            with mock.patch.object(scorer, '_score_batch', record_batch):
+                results.append(scorer(sentences))
+
+            self.assertEqual(
+                sum(len(x) for x in batches),
+                len(scorer._create_windows(input_ids))
+            )
+            for windows in batches:
+                padded_size = len(windows) * max(
+                    x['end'] - x['begin'] for x in windows
+                )
+                if len(windows) > 1:
+                    self.assertLessEqual(padded_size, max_batch_tokens)
+            if max_batch_tokens == 2048:
+                self.assertEqual(len(batches), 1)
+
+        # batching doesn't change perplexity of a sentence
+        results.append([scorer([x])[0] for x in sentences])
+        for perplexities in results[1:]:
+            for x, y in zip(perplexities, results[0]):
+                self.assertAlmostEqual(x / y, 1, delta=1e-5)
+
+    def test_prefix_cache(self):
+        """Test that prefix of the gap is processed once."""
+        prefix = list(range(100, 140))
+        continuations = [
+            list(range(200 + 10 * i, 205 + 10 * i)) for i in range(3)
+        ]
+
+        results = []
+        counts = []
+        for prefix_cache in [False, True]:
+            scorer = GPTScorerSentence(
+                self.model, self.tokenizer, prefix_cache=prefix_cache
+            )
+            tokens = []
+            hook = self.model.transformer.wte.register_forward_pre_hook(
+                lambda module, inputs: tokens.append(inputs[0].numel())
+            )
+            try:
+                results.append(
+                    scorer._score_gaps([prefix], [continuations])[0]
+                )
+            finally:
+                hook.remove()
+            counts.append(sum(tokens))
+
+        self.assertEqual(counts[0], 3 * (len(prefix) + 5))
+        self.assertLessEqual(counts[1], len(prefix) + 3 * 5)
+        for x, y in zip(*results):
+            self.assertAlmostEqual(x / y, 1, delta=1e-5)
+
+    def test_candidate_trie(self):
+        """Test that tokens shared by candidates are processed once."""
+        prefix = list(range(100, 110))
+        continuations = [
+            [10, 11, 12, 20, 21], [10, 11, 13, 20, 21], [10, 14, 20, 21]
+        ]
+
+        results = []
+        counts = []
+        for candidate_trie in [False, True]:
+            scorer = GPTScorerSentence(
+                self.model, self.tokenizer, candidate_trie=candidate_trie
+            )
+            lengths = []
+            extend_state = scorer._extend_state
+
+            def record_state(state, sequences, use_cache):
+                lengths.extend(len(x) for x in sequences)
+                return extend_state(state, sequences, use_cache)
+
+            with mock.patch.object(scorer, '_extend_state', record_state):
+                results.append(
+                    scorer._score_gaps([prefix], [continuations])[0]
+                )
+            counts.append(sum(lengths))
+
+        # prefix and then either whole continuations or [10], [11]
+        # and the rest of each continuation
+        self.assertEqual(counts, [10 + 14, 10 + 1 + 1 + 3 + 3 + 3])
+        for x, y in zip(*results):
+            self.assertAlmostEqual(x / y, 1, delta=1e-5)
+
+    def test_target_only_head(self):
+        """Test that output projection is applied only where needed."""
+        input_ids = torch.tensor([[10, 11, 12, 13, 14], [20, 21, 22, 0, 0]])
+        attention_mask = torch.tensor([[1, 1, 1, 1, 1], [1, 1, 1, 0, 0]])
+        targets = torch.roll(input_ids, -1, dims=1)
+        target_mask = torch.tensor(
+            [[0, 1, 1, 1, 0], [1, 1, 0, 0, 0]], dtype=torch.bool
+        )
+        last_positions = torch.tensor([4, 2])
+
+        outputs = []
+        head_rows = []
+        hook = self.model.lm_head.register_forward_pre_hook(
+            lambda module, inputs: head_rows.append(
+                inputs[0].shape[:-1].numel()
+            )
+        )
+        try:
+            for target_only_head in [False, True]:
+                with torch.no_grad():
+                    outputs.append(causal_lm_log_probs(
+                        self.model, input_ids, attention_mask, targets,
+                        target_mask, last_positions=last_positions,
+                        target_only_head=target_only_head
+                    ))
+        finally:
+            hook.remove()
+
+        # all positions, then target positions and last positions
+        self.assertEqual(head_rows, [10, 5, 2])
+        for x, y in zip(outputs[0][:2], outputs[1][:2]):
+            self.assertTrue(torch.allclose(x, y, atol=1e-5))
+
+    def test_score_tokenized(self):
+        """Test that scoring of token ids gives perplexity of the text."""
+        prefix, suffix = 'Paris is the', ' of France.'
+        candidates = [' capital', ' big city']
+        prefix_ids = self.tokenizer(prefix)['input_ids']
+        input_ids = (
+            prefix_ids + [self.tokenizer.unk_token_id]
+            + self.tokenizer(suffix)['input_ids']
+        )
+        candidates_ids = self.tokenizer(candidates)['input_ids']
+
+        scorer = GPTScorerSentence(self.model, self.tokenizer)
+        perplexities = scorer.score_tokenized(
+            [input_ids], [len(prefix_ids)], [candidates_ids]
+        )[0]
+        expected = scorer([prefix + x + suffix for x in candidates])
+        for x, y in zip(perplexities, expected):
+            self.assertAlmostEqual(x / y, 1, delta=1e-5)
+
+    def test_prefix_cache_long_sentence(self):
+        """Test that hypotheses longer than stride keep window loss."""
+        input_ids = self.tokenizer(
+            ' '.join(['The quick brown fox jumps over the lazy dog.'] * 6)
+        )['input_ids'][:60]
+        gap_index = 20
+        input_ids[gap_index] = self.tokenizer.unk_token_id
+        candidates = [
+            self.tokenizer(x)['input_ids'] for x in [' cat', ' big red dog']
+        ]
+
+        results = []
+        for prefix_cache in [True, False]:
+            scorer = GPTScorerSentence(
+                self.model, self.tokenizer, max_length=64, stride=32,
+                prefix_cache=prefix_cache
+            )
+            results.append(scorer.score_tokenized(
+                [input_ids], [gap_index], [candidates]
+            )[0])
+        for x, y in zip(*results):
+            self.assertAlmostEqual(x / y, 1, delta=1e-5)
+
+
+class TokenizationMemoTests(APITestCase):
+    """Test case to test memoized tokenization."""
+    texts = [
+        'capital', 'big city', 'capital',
+        'Paris is the capital of France and a very big city.'
+    ]
+
+    def setUp(self):
+        """Take tokenizer and wrap it to count calls."""
+        self.tokenizer = mock.Mock(wraps=registry.bert_tokenizer)
+
+    def test_token_ids(self):
+        """Test that each string is tokenized once by one call."""
+        expected = self.tokenizer(
+            self.texts, add_special_tokens=False
+        )['input_ids']
+        self.tokenizer.reset_mock()
+
+        memo = TokenizationMemo(self.tokenizer)
+        self.assertEqual(memo(self.texts), expected)
+        self.assertEqual(self.tokenizer.call_count, 1)
+        self.assertEqual(
+            self.tokenizer.call_args[0][0],
+            ['capital', 'big city', self.texts[3]]
+        )
+
+    def test_scope(self):
+        """Test that strings are remembered within the scope."""
+        memo = TokenizationMemo(self.tokenizer, max_entries=0)
+        with memo.scope():
+            input_ids = memo(self.texts)
+            self.assertEqual(memo(self.texts[::-1]), input_ids[::-1])
+            self.assertEqual(self.tokenizer.call_count, 1)
+            self.assertEqual((memo.hits, memo.misses), (4, 4))
+        memo(self.texts)
+        self.assertEqual(self.tokenizer.call_count, 2)
+
+    def test_shared_lru(self):
+        """Test that short strings are kept in the bounded LRU."""
+        memo = TokenizationMemo(
+            self.tokenizer, max_entries=1, max_cached_length=10
+        )
+        memo(['capital', self.texts[3]])
+        memo(['capital'])
+        self.assertEqual(self.tokenizer.call_count, 1)
+        self.assertEqual(memo.stats()['entries'], 1)
+
+        memo(['big city'])
+        memo(['capital'])
+        self.assertEqual(self.tokenizer.call_count, 3)
+        self.assertEqual(memo.stats()['entries'], 1)
+
+
+def mapped_ranges(path: str) -> List[Tuple[int, int]]:
+    """Find address ranges of the process, where the file is mapped.
+
+    :param path: path to the file
+
+    :returns: start and end address of each range
+    """
+    path = os.path.realpath(path)
+    ranges = []
+    with open('/proc/self/maps') as inf:
+        for line in inf:
+            fields = line.split(maxsplit=5)
+            if len(fields) == 6 and fields[5].strip() == path:
+                start, end = fields[0].split('-')
+                ranges.append((int(start, 16), int(end, 16)))
+    return ranges
+
+
+class MmapWeightsTests(APITestCase):
+    """Test case to test models built on memory-mapped weights."""
+    models = [
+        (BertForMaskedLM, ChooseWordConfig.bert_path),
+        (GPT2LMHeadModel, ChooseWordConfig.gpt_path)
+    ]
+    input_ids = torch.tensor([[10, 11, 12, 13]])
+
+    def test_mapped_parameters(self):
+        """Test that parameters are backed by the mapped file."""
+        for model_class, model_path in self.models:
+            with self.subTest(model=model_class.__name__):
+                model = model_class.from_pretrained(model_path)
+                with tempfile.TemporaryDirectory() as path:
+                    save_mmap_weights(model, path)
+                    model.config.save_pretrained(path)
+                    self.assertTrue(has_mmap_weights(path))
+                    mmap_model = build_mmap_model(model_class, path)
+                    ranges = mapped_ranges(
+                        os.path.join(path, 'weights.mmap')
+                    )
+
+                self.assertGreater(len(ranges), 0)
+                for name, param in mmap_model.named_parameters():
+                    self.assertTrue(any(
+                        start <= param.data_ptr() < end
+                        for start, end in ranges
+                    ), name)
+                # tied weights stay one parameter
+                self.assertIs(
+                    mmap_model.get_output_embeddings().weight,
+                    mmap_model.get_input_embeddings().weight
+                )
+
+                with torch.no_grad():
+                    expected = model(self.input_ids)[0]
+                    logits = mmap_model(self.input_ids)[0]
+                self.assertTrue(torch.allclose(logits, expected, atol=1e-6))
+
+    def test_missing_weights(self):
+        """Test that model isn't built with uninitialized parameters."""
+        with tempfile.TemporaryDirectory() as path:
+            model = GPT2LMHeadModel.from_pretrained(ChooseWordConfig.gpt_path)
+            save_mmap_weights(model, path)
+            model.config.save_pretrained(path)
+            index_path = os.path.join(path, 'weights.json')
+            with open(index_path) as inf:
+                index = json.load(inf)
+            index['tensors'].pop('transformer.ln_f.weight')
+            with open(index_path, 'w') as outf:
+                json.dump(index, outf)
+
+            with self.assertRaises(ValueError):
+                build_mmap_model(GPT2LMHeadModel, path)
+
+    def load_registry_model(self, precision: str):
+        """Build scorer of the registry on mapped weights of GPT model.
+
+        :param precision: precision mode of inference
+
+        :returns: model of the scorer and mapped ranges of weights
+        """
+        model = GPT2LMHeadModel.from_pretrained(ChooseWordConfig.gpt_path)
+        tokenizer = registry.gpt_tokenizer
+        with tempfile.TemporaryDirectory() as path:
+            save_mmap_weights(model, path)
+            model.save_pretrained(path)
+            with mock.patch.dict(registry._objects, clear=True), \
+                    mock.patch.dict(registry.precision, gpt=precision), \
+                    mock.patch.dict(registry.backend, gpt='eager'), \
+                    mock.patch.object(ChooseWordConfig, 'gpt_path', path):
+                registry._objects['gpt_tokenizer'] = tokenizer
+                scorer = registry.gpt_scorer_sentence
+                ranges = mapped_ranges(os.path.join(path, 'weights.mmap'))
+        return scorer.model, ranges
+
+    @override_settings(CHOOSE_WORD_MMAP_WEIGHTS=True)
+    def test_registry_model(self):
+        """Test that parameters stay mapped after setup of registry."""
+        model, ranges = self.load_registry_model('fp32')
+        self.assertGreater(len(ranges), 0)
+        for name, param in model.named_parameters():
+            self.assertTrue(any(
+                start <= param.data_ptr() < end for start, end in ranges
+            ), name)
+
+    @override_settings(CHOOSE_WORD_MMAP_WEIGHTS=True)
+    def test_registry_precision(self):
+        """Test that mapped weights are skipped for converted models."""
+        with self.assertWarns(UserWarning):
+            model, ranges = self.load_registry_model('int8')
+        self.assertEqual(ranges, [])
+
+
+class PrecisionTests(APITestCase):
+    """Test case to test conversion of models to lower precision."""
+    models = [
+        (BertForMaskedLM, ChooseWordConfig.bert_path),
+        (GPT2LMHeadModel, ChooseWordConfig.gpt_path)
+    ]
+    input_ids = torch.tensor([[10, 11, 12, 13]])
+
+    def log_probs(self, model) -> torch.Tensor:
+        """Calculate log probabilities of tokens at each position."""
+        with torch.no_grad():
+            return torch.log_softmax(model(self.input_ids)[0].float(), -1)
+
+    def test_int8(self):
+        """Test that linear layers are replaced by quantized ones."""
+        for model_class, model_path in self.models:
+            with self.subTest(model=model_class.__name__):
+                expected = self.log_probs(
+                    model_class.from_pretrained(model_path)
+                )
+                model = apply_precision(
+                    model_class.from_pretrained(model_path), 'int8'
+                )
+                layers = [
+                    x for x in model.modules()
+                    if isinstance(x, (torch.nn.Linear, Conv1D))
+                ]
+                self.assertEqual(layers, [])
+                self.assertTrue(any(
+                    'quantized' in type(x).__module__
+                    for x in model.modules()
+                ))
+                # quantization error is small compared to log probabilities
+                diff = (self.log_probs(model) - expected).abs().mean()
+                self.assertLess(diff.item(), 0.1)
+
+    def test_conv1d_to_linear(self):
+        """Test that Linear layers reuse weights of Conv1D layers."""
+        model = GPT2LMHeadModel.from_pretrained(ChooseWordConfig.gpt_path)
+        expected = self.log_probs(model)
+        weights = {
+            name: (x.weight.data_ptr(), x.bias.data_ptr())
+            for name, x in model.named_modules() if isinstance(x, Conv1D)
+        }
+        with mock.patch.object(torch.nn.Linear, 'reset_parameters') as init:
+            _conv1d_to_linear(model)
+        init.assert_not_called()
+
+        self.assertGreater(len(weights), 0)
+        modules = dict(model.named_modules())
+        for name, pointers in weights.items():
+            linear = modules[name]
+            self.assertIsInstance(linear, torch.nn.Linear)
+            self.assertEqual(
+                (linear.weight.data_ptr(), linear.bias.data_ptr()), pointers
+            )
+        self.assertTrue(torch.allclose(self.log_probs(model), expected))
+
+    def test_bf16(self):
+        """Test that model is cast to bf16 only if CPU supports it."""
+        model = GPT2LMHeadModel.from_pretrained(ChooseWordConfig.gpt_path)
+        if bf16_supported():
+            model = apply_precision(model, 'bf16')
+            dtype = torch.bfloat16
+        else:
+            with self.assertWarns(UserWarning):
+                model = apply_precision(model, 'bf16')
+            dtype = torch.float32
+        self.assertEqual({x.dtype for x in model.parameters()}, {dtype})
+
+    def test_unknown_mode(self):
+        """Test that unknown mode isn't accepted."""
+        model = GPT2LMHeadModel.from_pretrained(ChooseWordConfig.gpt_path)
+        with self.assertRaises(ValueError):
+            apply_precision(model, 'fp16')
+
+
+class BackendTests(APITestCase):
+    """Test case to test compiled backends of scorers."""
+
+    def setUp(self):
+        """Take models."""
+        self.bert_model = registry.bert_model
+        self.gpt_model = registry.gpt_model
+
+    @staticmethod
+    def inputs(batch_size: int, length: int):
+        """Create token ids and attention mask with padding."""
+        input_ids = torch.arange(batch_size * length).view(
+            batch_size, length
+        ) % 500 + 100
+        attention_mask = torch.ones_like(input_ids)
+        attention_mask[0, length // 2:] = 0
+        return input_ids, attention_mask
+
+    def assertMaskedLMBackend(self, backend, shapes):
+        """Check that backend gives hidden states of eager modules."""
+        eager_backend = EagerMaskedLMBackend(self.bert_model)
+        for batch_size, length in shapes:
+            input_ids, attention_mask = self.inputs(batch_size, length)
+            with torch.no_grad():
+                hidden_states = backend(input_ids, attention_mask)
+                expected = eager_backend(input_ids, attention_mask)
+            self.assertEqual(hidden_states.shape, expected.shape)
+            self.assertTrue(
+                torch.allclose(hidden_states, expected, atol=1e-4)
+            )
+
+    def assertCausalLMBackend(self, backend):
+        """Check that backend gives hidden states and cache of eager."""
+        eager_backend = EagerCausalLMBackend(self.gpt_model)
+        input_ids, attention_mask = self.inputs(2, 5)
+        next_input_ids, next_attention_mask = self.inputs(2, 3)
+        next_attention_mask = torch.cat(
+            [attention_mask, next_attention_mask], dim=1
+        )
+        with torch.no_grad():
+            hidden_states, past = backend(
+                input_ids, attention_mask, use_cache=True
+            )
+            expected, expected_past = eager_backend(
+                input_ids, attention_mask, use_cache=True
+            )
+            next_hidden_states, _ = backend(
+                next_input_ids, next_attention_mask, past_key_values=past
+            )
+            next_expected, _ = eager_backend(
+                next_input_ids, next_attention_mask,
+                past_key_values=expected_past
+            )
+        self.assertTrue(torch.allclose(hidden_states, expected, atol=1e-4))
+        for layer, expected_layer in zip(past, expected_past):
+            for x, y in zip(layer, expected_layer):
+                self.assertTrue(torch.allclose(x, y, atol=1e-4))
+        self.assertTrue(
+            torch.allclose(next_hidden_states, next_expected, atol=1e-4)
+        )
+
+    def test_torchscript_graphs(self):
+        """Test that one graph is traced for each bucket of shapes."""
+        backend = create_masked_lm_backend(
+            self.bert_model, 'torchscript', max_length=64, max_batch_size=8,
+            max_graphs=2
+        )
+        # first two shapes share the bucket of 2 x 16
+        self.assertMaskedLMBackend(backend, [(2, 5), (2, 9)])
+        self.assertEqual(len(backend._graphs), 1)
+        self.assertMaskedLMBackend(backend, [(3, 20), (1, 40)])
+        self.assertEqual(
+            [key[0] for key in backend._graphs], [(4, 32), (1, 64)]
+        )
+
+        self.assertCausalLMBackend(create_causal_lm_backend(
+            self.gpt_model, 'torchscript', max_length=64
+        ))
+
+    def test_onnx(self):
+        """Test that exported graphs give results of eager modules."""
+        if onnxruntime is None:
+            self.skipTest('onnxruntime is not installed')
+        with tempfile.TemporaryDirectory() as path:
+            backend = create_masked_lm_backend(
+                self.bert_model, 'onnx',
+                export_path=os.path.join(path, 'bert.onnx'), max_length=64
+            )
+            self.assertMaskedLMBackend(backend, [(2, 5), (3, 20)])
+            self.assertCausalLMBackend(create_causal_lm_backend(
+                self.gpt_model, 'onnx', export_dir=path, max_length=64
+            ))
+
+    def test_onnx_threads(self):
+        """Test that sessions inherit the number of threads of torch."""
+        if onnxruntime is None:
+            self.skipTest('onnxruntime is not installed')
+        with tempfile.TemporaryDirectory() as path:
+            export_path = os.path.join(path, 'bert.onnx')
+            for num_threads, expected in [
+                    (0, torch.get_num_threads()), (1, 1)
+            ]:
+                backend = create_masked_lm_backend(
+                    self.bert_model, 'onnx', export_path=export_path,
+                    max_length=64, num_threads=num_threads
+                )
+                options = backend.session.get_session_options()
+                self.assertEqual(options.intra_op_num_threads, expected)
+
+
+class GPTTasksTests(APITestCase):
+    """Test case to test hypotheses created for GPT algorithm."""
+    text_parts = [
+        '', 'is the capital of France. Paris is a', 'city and a', 'of art.'
+    ]
+    candidates = [
+        ['Paris', 'London'], ['big', 'very big'], ['centre', 'museum']
+    ]
+
+    def test_decoded_hypotheses(self):
+        """Test that hypotheses are token ids of the decoded sentences."""
+        input_ids, gap_indexes, candidates = prepare_text_gpt(
+            self.text_parts, self.candidates
+        )
+        hypotheses = [
+            context[:gap_index] + candidate + context[gap_index + 1:]
+            for context, gap_index, gap_candidates in zip(
+                input_ids, gap_indexes, candidates
+            )
+            for candidate in gap_candidates
+        ]
+
+        # candidate is inserted at the gap, then the sentence is decoded
+        # and tokenized again
+        tokenizer = registry.gpt_tokenizer
+        text = f' {tokenizer.unk_token} '.join(self.text_parts)
+        sentences, _ = split_sentences(
+            text, tokenizer.unk_token, self.candidates
+        )
+        expected = []
+        gap_idx = 0
+        for sentence in sentences:
+            sentence_ids = tokenizer(sentence)['input_ids']
+            for i, token_id in enumerate(sentence_ids):
+                if token_id != tokenizer.unk_token_id:
+                    continue
+                for candidate in self.candidates[gap_idx]:
+                    decoded = tokenizer.decode(
+                        sentence_ids[:i] + tokenizer(candidate)['input_ids']
+                        + sentence_ids[i + 1:]
+                    )
+                    expected.append(tokenizer(decoded)['input_ids'])
+                gap_idx += 1
+        self.assertEqual(hypotheses, expected)
+
+
+class PipelineTests(APITestCase):
+    """Test case to test scoring of gaps prepared from text."""
+
+    def test_gpt(self):
+        """Test that percents follow perplexities of filled sentences."""
+        text_parts = ['Paris is the', 'of France. It is a', 'city.']
+        candidates = [['capital', 'big city'], ['big', 'small']]
+        percents = process_text_gpt(text_parts, candidates)
+
+        # each candidate is put into the text of its sentence
+        scorer = GPTScorerSentence(registry.gpt_model, registry.gpt_tokenizer)
+        sentences = ['Paris is the {} of France.', 'It is a {} city.']
+        for gap_percents, sentence, gap_candidates in zip(
+                percents, sentences, candidates
+        ):
+            perplexities = scorer([sentence.format(x) for x in gap_candidates])
+            expected = normalize_scores_gpt([perplexities])[0]
+            for x, y in zip(gap_percents, expected):
+                self.assertAlmostEqual(x, y, delta=1e-4)
+
+
+class InferenceCoresTests(APITestCase):
+    """Test case to test running of inference on the given cores."""
+
+    def test_threads(self):
+        """Test that torch and ONNX Runtime use the share of cores."""
+        if onnxruntime is None:
+            self.skipTest('onnxruntime is not installed')
+        if not hasattr(os, 'sched_getaffinity'):
+            self.skipTest('affinity of threads is not supported')
+        cores = sorted(os.sched_getaffinity(0))
+        initial_backend = registry.backend['bert']
+        try:
+            registry.set_backend('bert', 'onnx')
+            registry.set_inference_cores(cores)
+            session = registry.bert_backend.session
+            registry.set_inference_cores(cores[:1])
+
+            executor = registry.inference_executor
+            self.assertEqual(executor.run(os.sched_getaffinity, 0), {cores[0]})
+            self.assertEqual(executor.run(torch.get_num_threads), 1)
+            # session is created again with the new number of threads
+            self.assertIsNot(registry.bert_backend.session, session)
+            options = registry.bert_backend.session.get_session_options()
+            self.assertEqual(options.intra_op_num_threads, 1)
+            self.assertEqual(options.inter_op_num_threads, 1)
+        finally:
+            registry.set_backend('bert', initial_backend)
+            registry.set_inference_cores(cores)
+
+
+class MicroBatcherTests(APITestCase):
+    """Test case to test merging of concurrent scoring calls."""
+    # two calls with one gap, the second one is broken
+    calls = [
+        ([[1, 2, 3]], [1], [[[4], [5]]]),
+        ([[-1, 2, 3]], [1], [[[4], [5]]])
+    ]
+
+    def create_batcher(self, error=None):
+        """Create batcher, that fails to score sentences with -1."""
+        score_calls = []
+
+        def score_fn(input_ids, gap_indexes, candidates):
+            score_calls.append(len(input_ids))
+            if error is not None:
+                raise error
+            if any(-1 in x for x in input_ids):
+                raise ValueError('Broken sentence!')
+            return [sum(x) for x in input_ids]
+
+        # long wait, so both calls are merged
+        batcher = MicroBatcher(score_fn, max_wait=0.1)
+        return batcher, score_calls
+
+    def test_input_error(self):
+        """Test that only the call with broken input fails."""
+        batcher, score_calls = self.create_batcher()
+        futures = [batcher.submit(*x) for x in self.calls]
+        self.assertEqual(futures[0].result(), [6])
+        with self.assertRaises(ValueError):
+            futures[1].result()
+        # merged call and then each call separately
+        self.assertEqual(score_calls, [2, 1, 1])
+
+    def test_busy_error(self):
+        """Test that error, that doesn't depend on input, fails all calls."""
+        batcher, score_calls = self.create_batcher(ExecutorBusyError())
+        futures = [batcher.submit(*x) for x in self.calls]
+        for future in futures:
+            with self.assertRaises(ExecutorBusyError):
+                future.result()
+        self.assertEqual(score_calls, [2])
+
+    def test_dispatcher(self):
+        """Test that all flushes are done by one thread."""
+        batcher, score_calls = self.create_batcher()
+        batcher.max_wait = 0.001
+        dispatcher = None
+        for _ in range(3):
+            self.assertEqual(batcher(*self.calls[0]), [6])
+            if dispatcher is None:
+                dispatcher = batcher._dispatcher
+            self.assertIs(batcher._dispatcher, dispatcher)
+        self.assertTrue(dispatcher.is_alive())
+        self.assertEqual(score_calls, [1, 1, 1])
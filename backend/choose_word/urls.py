@@ -1,10 +1,57 @@
 from django.urls import path
 
-from .views import ChooseWordBertView, ChooseWordGPTView, BenchmarkView
+from . import async_views, bulk_views, stream_views
+from .views import (
+    ChooseWordBertView, ChooseWordGPTView, BenchmarkView, StatsView,
+    ReadyView, JobsView, JobView, JobResultView, ProfilesView, ProfileView
+)
 
 
 urlpatterns = [
     path('bert/', ChooseWordBertView.as_view(), name='choose_word_bert'),
     path('gpt/', ChooseWordGPTView.as_view(), name='choose_word_gpt'),
-    path('benchmark/', BenchmarkView.as_view(), name='choose_word_benchmark')
+    path('benchmark/', BenchmarkView.as_view(), name='choose_word_benchmark'),
+    path('stats/', StatsView.as_view(), name='choose_word_stats'),
+    path('ready/', ReadyView.as_view(), name='choose_word_ready'),
+    path('jobs/', JobsView.as_view(), name='choose_word_jobs'),
+    path('jobs/<uuid:job_id>/', JobView.as_view(), name='choose_word_job'),
+    path(
+        'jobs/<uuid:job_id>/result/', JobResultView.as_view(),
+        name='choose_word_job_result'
+    ),
+    path(
+        'profiles/', ProfilesView.as_view(), name='choose_word_profiles'
+    ),
+    path(
+        'profiles/<str:name>/', ProfileView.as_view(),
+        name='choose_word_profile'
+    ),
+    path(
+        'async/bert/', async_views.choose_word_bert,
+        name='choose_word_bert_async'
+    ),
+    path(
+        'async/gpt/', async_views.choose_word_gpt,
+        name='choose_word_gpt_async'
+    ),
+    path(
+        'async/benchmark/', async_views.benchmark,
+        name='choose_word_benchmark_async'
+    ),
+    path(
+        'bulk/bert/', bulk_views.choose_word_bert,
+        name='choose_word_bert_bulk'
+    ),
+    path(
+        'bulk/gpt/', bulk_views.choose_word_gpt,
+        name='choose_word_gpt_bulk'
+    ),
+    path(
+        'stream/bert/', stream_views.choose_word_bert,
+        name='choose_word_bert_stream'
+    ),
+    path(
+        'stream/gpt/', stream_views.choose_word_gpt,
+        name='choose_word_gpt_stream'
+    )
 ]
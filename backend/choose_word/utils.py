@@ -1,15 +1,15 @@
-from typing import List, Tuple
-from copy import copy
+import json
+import time
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 
-from nltk import download
-from nltk import sent_tokenize
+from src.Profiling import current_profile
+from src.Timing import timed_stage
 
 from .apps import ChooseWordConfig
-
-
-download('punkt')
+from .registry import registry
 
 
 def process_text_bert(
@@ -22,113 +22,201 @@ def process_text_bert(
 
     :returns: percent of each candidate in each gap
     """
+    tasks = prepare_text_bert(text_parts, candidates)
+    return process_tasks_bert(tasks)
+
+
+def process_tasks_bert(tasks: Tuple) -> List[List[float]]:
+    """Score prepared tasks of BERT algorithm.
+
+    :param tasks: token ids of contexts, indexes of gaps
+        and token ids of candidates, result of prepare_text_bert
+
+    :returns: percent of each candidate in each gap
+    """
+    # run algorithm for all sentences together with concurrent requests,
+    # profiled request is scored alone to trace only its work
+    is_profiled = current_profile() is not None
+    with timed_stage('inference'):
+        scores = registry.bert_batcher(*tasks, alone=is_profiled)
+    with timed_stage('normalize'):
+        return normalize_scores_bert(scores)
+
+
+def prepare_text_bert(
+        text_parts: List[str], candidates: List[List[str]]
+) -> Tuple[List[List[int]], List[int], List[List[List[int]]]]:
+    """Create tasks for all gaps with candidates for BERT algorithm.
+
+    :param text_parts: pieces of texts between gaps, length: n+1
+    :param candidates: list of candidates for each gap, length: n
+
+    :returns: token ids of context, index of the gap in the context
+        and token ids of candidates for each gap
+    """
     # check input on correctness
     if len(text_parts) != len(candidates) + 1:
         raise ValueError('Wrong lengths of input!')
 
     # divide task by sentences
     # replace each gap by [UNK]-token and join all pieces of text
-    unk_token = ChooseWordConfig.bert_tokenizer.unk_token
+    unk_token = registry.bert_tokenizer.unk_token
     text = f' {unk_token} '.join(text_parts)
     # check if there is no redundant [UNK]-tokens
     # TODO: add escaping [UNK]-tokens and [MASK]-tokens (very unrealistic case)
     if text.count(unk_token) != len(candidates):
         raise ValueError('There should not be [UNK] tokens in the text!')
     # split text by sentences
-    sentences = sent_tokenize(text)
+    sentences, sentences_candidates = split_sentences(
+        text, unk_token, candidates
+    )
+
+    # tokenize all sentences and candidates once
+    tokenization_memo = registry.bert_tokenization_memo
+    with timed_stage('tokenize'):
+        tokenized_sentences = tokenization_memo(sentences)
+        tokenized_candidates = tokenize_candidates(
+            tokenization_memo, candidates
+        )
+    mask_token_id = tokenization_memo.tokenizer.mask_token_id
+    for tokenized_sentence in tokenized_sentences:
+        if tokenized_sentence.count(mask_token_id):
+            raise ValueError(
+                'There should not be [MASK] tokens in the text!'
+            )
+
+    # gather input data from all sentences
+    input_ids = []
+    gap_indexes = []
+    input_candidates = []
+    cur_cnt = 0
+    for tokenized_sentence, sentence_candidates in zip(
+            tokenized_sentences, sentences_candidates
+    ):
+        cnt = len(sentence_candidates)
+        new_input_ids, new_gap_indexes, new_candidates = (
+            create_tasks_sentence_bert(
+                tokenized_sentence, tokenized_candidates[cur_cnt:cur_cnt+cnt]
+            )
+        )
+        input_ids += new_input_ids
+        gap_indexes += new_gap_indexes
+        input_candidates += new_candidates
+        cur_cnt += cnt
+
+    return input_ids, gap_indexes, input_candidates
+
+
+def split_sentences(
+        text: str, unk_token: str, candidates: List[List[str]]
+) -> Tuple[List[str], List[List[List[str]]]]:
+    """Split text into sentences and assign gaps to them.
+
+    :param text: text with unk token in place of each gap
+    :param unk_token: token, that marks gap
+    :param candidates: list of candidates for each gap
+
+    :returns: sentences and candidates of gaps of each sentence
+    """
+    with timed_stage('split'):
+        sentences = registry.sentence_splitter(text)
     sentences_candidates = []
     cur_cnt = 0
     for sentence in sentences:
         cnt = sentence.count(unk_token)
         sentences_candidates.append(candidates[cur_cnt:cur_cnt+cnt])
         cur_cnt += cnt
+    # each gap should be inside exactly one sentence
+    if cur_cnt != len(candidates):
+        raise ValueError('Gaps are broken by splitting into sentences!')
+    return sentences, sentences_candidates
 
-    # gather input data from all sentences
-    input_sentences = []
-    input_candidates = []
-    for sentence, sentence_candidates in zip(sentences, sentences_candidates):
-        new_sentences, new_candidates = create_tasks_sentence_bert(
-            sentence, sentence_candidates
-        )
-        input_sentences += new_sentences
-        input_candidates += new_candidates
 
-    # run algorithm for all sentences
-    try:
-        scores = ChooseWordConfig.bert_scorer_correction(
-            input_sentences, input_candidates
-        )
-        normalized_scores = np.exp([
-            [np.mean(scores_candidate) for scores_candidate in scores_sentence]
-            for scores_sentence in scores
-        ])
-        normalization = np.sum(normalized_scores, axis=-1)[:, np.newaxis]
-        percents = normalized_scores / normalization
-        results = percents.tolist()
-    except ValueError as e:
-        if str(e).startswith('There should be exactly one [MASK]'):
-            raise ValueError(
-                'There should not be [MASK] tokens in the text!'
-            )
-        else:
-            raise e
+def normalize_scores_bert(
+        scores: List[List[List[float]]]
+) -> List[List[float]]:
+    """Turn log probabilities of candidates tokens into percents.
+
+    :param scores: log probabilities of tokens of each candidate
+        in each gap
+
+    :returns: percent of each candidate in each gap
+    """
+    normalized_scores = np.exp([
+        [np.mean(scores_candidate) for scores_candidate in scores_sentence]
+        for scores_sentence in scores
+    ])
+    normalization = np.sum(normalized_scores, axis=-1)[:, np.newaxis]
+    percents = normalized_scores / normalization
+    results = percents.tolist()
 
     return results
 
 
 def create_tasks_sentence_bert(
-        sentence: str, candidates: List[List[str]]
-) -> Tuple[List[str], List[List[str]]]:
+        tokenized_sentence: List[int], candidates: List[List[List[int]]]
+) -> Tuple[List[List[int]], List[int], List[List[List[int]]]]:
     """Create tasks for all gaps within sentence for BERT algorithm.
 
-    :param sentence: sentence to process
-    :param candidates: list of candidates for each gap
+    :param tokenized_sentence: token ids of sentence to process
+    :param candidates: token ids of candidates for each gap
 
-    :returns: percent of each candidate in each gap
+    :returns: token ids of context, index of the gap in the context
+        and candidates for each gap
     """
     # TODO: add processing of bigger context (few sentences)
-    # tokenize sentence and candidates
-    tokenizer = ChooseWordConfig.bert_tokenizer
-    tokenized_sentence = tokenizer(
-        sentence,
-        add_special_tokens=False,
-        padding=False,
-        truncation='do_not_truncate',
-    )['input_ids']
-
-    input_sentences = []
+    tokenizer = registry.bert_tokenizer
+
+    input_ids = []
+    gap_indexes = []
     input_candidates = []
     # process each gap separately
     gap_idx = 0
     for i, token_id in enumerate(tokenized_sentence):
         if token_id != tokenizer.unk_token_id:
             continue
-        current_tokenized_sentence = copy(tokenized_sentence)
-        current_tokenized_sentence[i] = tokenizer.mask_token_id
 
         # find maximum length of candidate in each gap
-        tokenized_candidates = tokenizer(
-            candidates[gap_idx],
-            add_special_tokens=False,
-            padding=False,
-            truncation='do_not_truncate',
-        )['input_ids']
-        max_len = max([len(x) for x in tokenized_candidates])
+        max_len = max([len(x) for x in candidates[gap_idx]])
 
         # limit sentence to fit in maximum size
         # -2 added for compensation of rounding, -5 is arbitrary
         radius = ChooseWordConfig.max_bert_size // 2 - max_len // 2 - 2 - 5
         start_idx = max(0, i-radius)
-        end_idx = min(len(current_tokenized_sentence), i+radius)
-        current_tokenized_sentence = current_tokenized_sentence[
-                                     start_idx:end_idx
-                                     ]
-        current_sentence = tokenizer.decode(current_tokenized_sentence)
-        input_sentences.append(current_sentence)
+        end_idx = min(len(tokenized_sentence), i+radius)
+        input_ids.append(tokenized_sentence[start_idx:end_idx])
+        gap_indexes.append(i - start_idx)
         input_candidates.append(candidates[gap_idx])
         gap_idx += 1
 
-    return input_sentences, input_candidates
+    return input_ids, gap_indexes, input_candidates
+
+
+def tokenize_candidates(
+        tokenization_memo, candidates: List[List[str]]
+) -> List[List[List[int]]]:
+    """Tokenize candidates of all gaps at once.
+
+    :param tokenization_memo: memoized tokenizer to use
+    :param candidates: list of candidates for each gap
+
+    :returns: token ids of candidates for each gap
+    """
+    flat_candidates = [
+        candidate for gap_candidates in candidates
+        for candidate in gap_candidates
+    ]
+    tokenized_flat_candidates = tokenization_memo(flat_candidates)
+
+    tokenized_candidates = []
+    cur_cnt = 0
+    for gap_candidates in candidates:
+        cnt = len(gap_candidates)
+        tokenized_candidates.append(
+            tokenized_flat_candidates[cur_cnt:cur_cnt+cnt]
+        )
+        cur_cnt += cnt
+    return tokenized_candidates
 
 
 def process_text_gpt(
@@ -141,87 +229,247 @@ def process_text_gpt(
 
     :returns: percent of each candidate in each gap
     """
+    tasks = prepare_text_gpt(text_parts, candidates)
+    return process_tasks_gpt(tasks)
+
+
+def process_tasks_gpt(tasks: Tuple) -> List[List[float]]:
+    """Score prepared tasks of GPT algorithm.
+
+    :param tasks: token ids of contexts, indexes of gaps
+        and token ids of candidates, result of prepare_text_gpt
+
+    :returns: percent of each candidate in each gap
+    """
+    # run algorithm for all gaps together with concurrent requests,
+    # profiled request is scored alone to trace only its work
+    is_profiled = current_profile() is not None
+    with timed_stage('inference'):
+        perplexities = registry.gpt_batcher(*tasks, alone=is_profiled)
+    with timed_stage('normalize'):
+        return normalize_scores_gpt(perplexities)
+
+
+def prepare_text_gpt(
+        text_parts: List[str], candidates: List[List[str]]
+) -> Tuple[List[List[int]], List[int], List[List[List[int]]]]:
+    """Create tasks for all gaps with candidates for GPT algorithm.
+
+    :param text_parts: pieces of texts between gaps, length: n+1
+    :param candidates: list of candidates for each gap, length: n
+
+    :returns: token ids of sentence, index of the gap in the sentence
+        and token ids of candidates for each gap
+    """
     # check input on correctness
     if len(text_parts) != len(candidates) + 1:
         raise ValueError('Wrong lengths of input!')
 
     # divide task by sentences
     # replace each gap by [UNK]-token and join all pieces of text
-    unk_token = ChooseWordConfig.gpt_tokenizer.unk_token
+    unk_token = registry.gpt_tokenizer.unk_token
     text = f' {unk_token} '.join(text_parts)
     # check if there is no redundant [UNK]-tokens
     # TODO: add escaping [UNK] tokens (very unrealistic case)
     if text.count(unk_token) != len(candidates):
         raise ValueError('There should not be [UNK] tokens in the text!')
     # split text by sentences
-    sentences = sent_tokenize(text)
-    sentences_candidates = []
-    cur_cnt = 0
-    for sentence in sentences:
-        cnt = sentence.count(unk_token)
-        sentences_candidates.append(candidates[cur_cnt:cur_cnt+cnt])
-        cur_cnt += cnt
-    # process each sentence separately
+    sentences, sentences_candidates = split_sentences(
+        text, unk_token, candidates
+    )
+
+    # tokenize all sentences once
+    tokenization_memo = registry.gpt_tokenization_memo
+    with timed_stage('tokenize'):
+        tokenized_sentences = tokenization_memo(sentences)
+
+    # gather tasks from all sentences
+    input_ids = []
+    gap_indexes = []
+    input_candidates = []
+    for tokenized_sentence, sentence_candidates in zip(
+            tokenized_sentences, sentences_candidates
+    ):
+        new_input_ids, new_gap_indexes, new_candidates = (
+            create_tasks_sentence_gpt(tokenized_sentence, sentence_candidates)
+        )
+        input_ids += new_input_ids
+        gap_indexes += new_gap_indexes
+        input_candidates += new_candidates
+
+    # tokenize candidates of all gaps once
+    with timed_stage('tokenize'):
+        input_candidates = tokenize_candidates(
+            tokenization_memo, input_candidates
+        )
+
+    return input_ids, gap_indexes, input_candidates
+
+
+def normalize_scores_gpt(perplexities: List[List[float]]) -> List[List[float]]:
+    """Turn perplexities of candidates into percents.
+
+    :param perplexities: perplexity of each candidate in each gap
+
+    :returns: percent of each candidate in each gap
+    """
+    # normalize scores within each gap
     results = []
-    for sentence, sentence_candidates in zip(sentences, sentences_candidates):
-        results += process_sentence_gpt(sentence, sentence_candidates)
+    for gap_perplexities in perplexities:
+        scores = 1 / np.array(gap_perplexities)
+        percents = scores / np.sum(scores)
+        results.append(percents.tolist())
 
-    # return results
     return results
 
 
-def process_sentence_gpt(
-        sentence: str, candidates: List[List[str]]
-) -> List[List[float]]:
-    """Process all gaps with candidates within sentence using GPT algorithm.
+def create_tasks_sentence_gpt(
+        tokenized_sentence: List[int], candidates: List[List[str]]
+) -> Tuple[List[List[int]], List[int], List[List[str]]]:
+    """Create tasks for all gaps within sentence for GPT algorithm.
 
-    :param sentence: sentence to process
+    :param tokenized_sentence: token ids of sentence to process
     :param candidates: list of candidates for each gap
 
-    :returns: percent of each candidate in each gap
+    :returns: token ids of context, index of the gap in the context
+        and candidates to tokenize for each gap
     """
     # TODO: add processing of bigger context (few sentences)
-    # tokenize sentence and candidates
-    tokenizer = ChooseWordConfig.gpt_tokenizer
-    tokenized_sentence = tokenizer(
-        sentence,
-        add_special_tokens=False,
-        truncation='do_not_truncate',
-    )['input_ids']
+    tokenizer = registry.gpt_tokenizer
+    space_ids = tokenizer(' ', add_special_tokens=False)['input_ids']
 
-    results = []
+    input_ids = []
+    gap_indexes = []
+    input_candidates = []
     # process each gap separately
     gap_idx = 0
     for i, token_id in enumerate(tokenized_sentence):
         if token_id != tokenizer.unk_token_id:
             continue
 
-        # tokenize candidates
-        tokenized_candidates = tokenizer(
-            candidates[gap_idx],
-            add_special_tokens=False,
-            truncation='do_not_truncate',
-        )['input_ids']
-
-        # try to insert each candidate in sentence
-        sentences_to_check = []
-        for tokenized_candidate in tokenized_candidates:
-            current_tokenized_sentence = copy(tokenized_sentence)
-            current_tokenized_sentence = (
-                current_tokenized_sentence[:i]
-                + tokenized_candidate
-                + current_tokenized_sentence[i+1:]
-            )
-            sentences_to_check.append(
-                tokenizer.decode(current_tokenized_sentence)
+        # space before the gap is a separate token, it is moved
+        # to candidates, so they are tokenized as words of the sentence
+        gap_candidates = candidates[gap_idx]
+        context = tokenized_sentence
+        gap_index = i
+        if tokenized_sentence[i - len(space_ids):i] == space_ids:
+            context = (
+                tokenized_sentence[:i - len(space_ids)]
+                + tokenized_sentence[i:]
             )
+            gap_index = i - len(space_ids)
+            gap_candidates = [' ' + x for x in gap_candidates]
 
-        scores = 1 / np.array(
-            ChooseWordConfig.gpt_scorer_sentence(sentences_to_check)
-        )
-        percents = scores / np.sum(scores)
-        results.append(percents)
+        # each candidate is inserted in the whole sentence
+        input_ids.append(context)
+        gap_indexes.append(gap_index)
+        input_candidates.append(gap_candidates)
 
         gap_idx += 1
 
+    return input_ids, gap_indexes, input_candidates
+
+
+def run_benchmark(
+        processor: Callable, data: List[Dict],
+        on_progress: Optional[Callable] = None
+) -> Dict:
+    """Run processor on benchmark tasks and measure its quality and speed.
+
+    :param processor: function to process text parts with candidates
+    :param data: blocks of tasks in sdamgia format
+    :param on_progress: function to call with fraction of processed
+        blocks after each block
+
+    :returns: accuracy, time, rps and grid of accuracy by confidence
+    """
+    results = {}
+    num_tasks = 0
+    wall_time = 0
+    confidences = []
+    is_correct = []
+    for block_idx, task_block in enumerate(data):
+        num_tasks += len(task_block['gaps'])
+        # prepare data for running algorithms
+        text_parts = task_block['text'].split('_____')
+        candidates = [gap['choices'] for gap in task_block['gaps']]
+        correct_answers = [gap['answer'] for gap in task_block['gaps']]
+
+        # validate model
+        start_time = time.time()
+        results_task = processor(text_parts, candidates)
+        end_time = time.time()
+        wall_time += end_time - start_time
+        confidences += [
+            max(gap_answers) for gap_answers in results_task
+        ]
+        is_correct += [
+            np.argmax(gap_answers) + 1 == correct_answers[i]
+            for i, gap_answers in enumerate(results_task)
+        ]
+        if on_progress is not None:
+            on_progress((block_idx + 1) / len(data))
+
+    # make a grid with confidences
+    confidences = np.array(confidences)
+    is_correct = np.array(is_correct)
+    grid_start = int(np.floor(np.min(confidences*100)/5)*5)
+
+    grid_results = []
+    for confidence_percent in range(grid_start, 100, 5):
+        confidence = confidence_percent / 100
+        indicator = (confidences >= confidence)
+        fraction = float(np.mean(indicator))
+        if fraction == 0:
+            accuracy = grid_results[-1]['accuracy']
+        else:
+            accuracy = float(np.mean(is_correct[indicator]))
+        grid_results.append({
+            'confidence': confidence,
+            'fraction': fraction,
+            'accuracy': accuracy
+        })
+
+    # save results
+    results['grid_results'] = grid_results
+    results['accuracy'] = float(np.mean(is_correct))
+    results['time'] = wall_time
+    results['rps'] = num_tasks/wall_time
+    return results
+
+
+@lru_cache(maxsize=1)
+def load_benchmark_data() -> List[Dict]:
+    """Load sdamgia tasks once, they should not be modified.
+
+    :returns: blocks of tasks in sdamgia format
+    """
+    with open(ChooseWordConfig.benchmark_data_path, 'r') as inf:
+        return json.load(inf)
+
+
+def run_benchmarks(on_progress: Optional[Callable] = None) -> Dict[str, Dict]:
+    """Run benchmark on sdamgia data for all algorithms.
+
+    :param on_progress: function to call with fraction of processed
+        blocks of all algorithms after each block
+
+    :returns: results of benchmark for each algorithm
+    """
+    data = load_benchmark_data()
+
+    # get results
+    results = {}
+    processors = {
+        'bert': process_text_bert,
+        'gpt': process_text_gpt
+    }
+    for i, processor_name in enumerate(processors):
+        processor_progress = None
+        if on_progress is not None:
+            def processor_progress(fraction, i=i):
+                on_progress((i + fraction) / len(processors))
+        results[processor_name] = run_benchmark(
+            processors[processor_name], data, processor_progress
+        )
     return results
@@ -1,14 +1,79 @@
-import json
-import time
+import os
 
-import numpy as np
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from rest_framework.exceptions import APIException
 from rest_framework.parsers import JSONParser
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .serializers import BertTestItemSerializer, GPTTestItemSerializer
-from .utils import process_text_bert, process_text_gpt
-from .apps import ChooseWordConfig
+from src.Metrics import metrics
+from src.Profiling import list_profiles
+from src.Scheduler import ExecutorBusyError, count_tokens
+
+from .jobs import job_queue
+from .models import Job
+from .profiling import CanProfile
+from .serializers import (
+    BertTestItemSerializer, GPTTestItemSerializer,
+    JobSerializer, JobCreateSerializer
+)
+from .utils import (
+    prepare_text_bert, process_tasks_bert,
+    prepare_text_gpt, process_tasks_gpt
+)
+from .registry import registry
+
+
+class InferenceBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many requests are waiting for inference!'
+    default_code = 'inference_busy'
+
+
+def run_processor(processor, *args):
+    """Run processor and report overloaded inference executor.
+
+    :param processor: function to run
+    :param args: arguments of function
+
+    :returns: result of function
+    """
+    try:
+        return processor(*args)
+    except ExecutorBusyError:
+        raise InferenceBusy()
+
+
+def is_oversized(tasks) -> bool:
+    """Check that test item is too big to be solved during request.
+
+    It is turned off by default: clients of solving endpoints
+    should poll the job instead of reading results, when it is enabled.
+
+    :param tasks: prepared tasks of test item
+
+    :returns: True if test item should be solved by background job
+    """
+    max_tokens = settings.CHOOSE_WORD_MAX_SYNC_TOKENS
+    input_ids, _, candidates = tasks
+    return max_tokens > 0 and count_tokens(input_ids, candidates) > max_tokens
+
+
+def job_accepted(job: Job) -> Response:
+    """Make response for job put into queue.
+
+    :param job: created job
+
+    :returns: response with state of job and link to poll it
+    """
+    return Response(
+        data=JobSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+        headers={'Location': reverse('choose_word_job', args=[job.id])}
+    )
 
 
 class ChooseWordBertView(APIView):
@@ -17,13 +82,25 @@ class ChooseWordBertView(APIView):
     parser_classes = [JSONParser]
 
     def post(self, request):
-        serializer = BertTestItemSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        data = serializer.data
-
-        text_parts = data['text_parts']
-        candidates = data['candidates']
-        results = process_text_bert(text_parts, candidates)
+        # share tokenization between validation and processing
+        with registry.bert_tokenization_memo.scope():
+            serializer = BertTestItemSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            data = serializer.data
+
+            try:
+                tasks = prepare_text_bert(
+                    data['text_parts'], data['candidates']
+                )
+            except ValueError as e:
+                return Response(
+                    data={'detail': str(e)},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            # big test item would hold request until proxy timeout
+            if is_oversized(tasks):
+                return job_accepted(job_queue.submit(Job.KIND_BERT, data))
+            results = run_processor(process_tasks_bert, tasks)
         return Response(data=results)
 
 
@@ -33,82 +110,140 @@ class ChooseWordGPTView(APIView):
     parser_classes = [JSONParser]
 
     def post(self, request):
-        serializer = GPTTestItemSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        data = serializer.data
-
-        text_parts = data['text_parts']
-        candidates = data['candidates']
-        results = process_text_gpt(text_parts, candidates)
+        # share tokenization between validation and processing
+        with registry.gpt_tokenization_memo.scope():
+            serializer = GPTTestItemSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            data = serializer.data
+
+            try:
+                tasks = prepare_text_gpt(
+                    data['text_parts'], data['candidates']
+                )
+            except ValueError as e:
+                return Response(
+                    data={'detail': str(e)},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            # big test item would hold request until proxy timeout
+            if is_oversized(tasks):
+                return job_accepted(job_queue.submit(Job.KIND_GPT, data))
+            results = run_processor(process_tasks_gpt, tasks)
         return Response(data=results)
 
 
 class BenchmarkView(APIView):
-    """Controller for running benchmark for algorithms."""
+    """Controller for running benchmark for algorithms in background."""
 
     def get(self, request):
-        # load data
-        with open(ChooseWordConfig.benchmark_data_path, 'r') as inf:
-            data = json.load(inf)
-
-        # get results
-        results = {}
-        processors = {
-            'bert': process_text_bert,
-            # 'gpt': process_text_gpt
-        }
-        for processor_name in processors:
-            results_processor = {}
-            num_tasks = 0
-            wall_time = 0
-            confidences = []
-            is_correct = []
-            for task_block in data:
-                num_tasks += len(task_block['gaps'])
-                # prepare data for running algorithms
-                text_parts = task_block['text'].split('_____')
-                candidates = [gap['choices'] for gap in task_block['gaps']]
-                correct_answers = [gap['answer'] for gap in task_block['gaps']]
-
-                # validate model
-                start_time = time.time()
-                results_task = processors[processor_name](
-                    text_parts, candidates
-                )
-                end_time = time.time()
-                wall_time += end_time - start_time
-                confidences += [
-                    max(gap_answers) for gap_answers in results_task
-                ]
-                is_correct += [
-                    np.argmax(gap_answers) + 1 == correct_answers[i]
-                    for i, gap_answers in enumerate(results_task)
-                ]
-
-            # make a grid with confidences
-            confidences = np.array(confidences)
-            is_correct = np.array(is_correct)
-            grid_start = int(np.floor(np.min(confidences*100)/5)*5)
-
-            grid_results = []
-            for confidence_percent in range(grid_start, 100, 5):
-                confidence = confidence_percent / 100
-                indicator = (confidences >= confidence)
-                fraction = np.mean(indicator)
-                if fraction == 0:
-                    accuracy = grid_results[-1]['accuracy']
-                else:
-                    accuracy = np.mean(is_correct[indicator])
-                grid_results.append({
-                    'confidence': confidence,
-                    'fraction': fraction,
-                    'accuracy': accuracy
-                })
-
-            # save results
-            results_processor['grid_results'] = grid_results
-            results_processor['time'] = wall_time
-            results_processor['rps'] = num_tasks/wall_time
-            results[processor_name] = results_processor
+        return job_accepted(job_queue.submit(Job.KIND_BENCHMARK))
+
+
+class JobsView(APIView):
+    """Controller for putting jobs into queue."""
+
+    parser_classes = [JSONParser]
 
+    def post(self, request):
+        serializer = JobCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        return job_accepted(job_queue.submit(data['kind'], data['payload']))
+
+
+class JobView(APIView):
+    """Controller for polling state of job."""
+
+    def get(self, request, job_id):
+        # queued jobs are picked up after restart of process
+        job_queue.ensure_started()
+        job = get_object_or_404(Job, id=job_id)
+        return Response(data=JobSerializer(job).data)
+
+
+class JobResultView(APIView):
+    """Controller for getting result of finished job."""
+
+    def get(self, request, job_id):
+        job = get_object_or_404(Job, id=job_id)
+        if job.status == Job.STATUS_FAILED:
+            return Response(
+                data={'status': job.status, 'detail': job.error},
+                status=status.HTTP_409_CONFLICT
+            )
+        if job.status != Job.STATUS_DONE:
+            return Response(
+                data={
+                    'status': job.status,
+                    'detail': 'Job is not finished yet!'
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(data=job.result)
+
+
+class StatsView(APIView):
+    """Controller for getting counters of caches and inference executor."""
+
+    def get(self, request):
+        results = {
+            'bert_tokenization': (
+                registry.bert_tokenization_memo.stats()
+            ),
+            'gpt_tokenization': registry.gpt_tokenization_memo.stats(),
+            'inference_executor': registry.inference_executor.stats(),
+            'bert_batcher': registry.bert_batcher.stats(),
+            'gpt_batcher': registry.gpt_batcher.stats(),
+            'jobs': job_queue.stats()
+        }
+        if registry.bert_score_cache is not None:
+            results['bert_cache'] = registry.bert_score_cache.stats()
         return Response(data=results)
+
+
+class ReadyView(APIView):
+    """Controller for checking that models are loaded and warmed up."""
+
+    def get(self, request):
+        if not registry.is_ready():
+            return Response(
+                data={'ready': False},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        return Response(data={'ready': True})
+
+
+class MetricsView(APIView):
+    """Controller for exporting metrics in Prometheus text format."""
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+
+class ProfilesView(APIView):
+    """Controller for listing files of profiled requests."""
+
+    permission_classes = [CanProfile]
+
+    def get(self, request):
+        files = list_profiles(settings.CHOOSE_WORD_PROFILE_DIR)
+        for x in files:
+            x['url'] = request.build_absolute_uri(
+                reverse('choose_word_profile', args=[x['name']])
+            )
+        return Response(data=files)
+
+
+class ProfileView(APIView):
+    """Controller for downloading file of profiled request."""
+
+    permission_classes = [CanProfile]
+
+    def get(self, request, name):
+        path = os.path.join(settings.CHOOSE_WORD_PROFILE_DIR, name)
+        if name.startswith('.') or not os.path.isfile(path):
+            raise Http404()
+        return FileResponse(open(path, 'rb'), as_attachment=True)
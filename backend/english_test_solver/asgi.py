@@ -14,3 +14,14 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'english_test_solver.settings')
 
 application = get_asgi_application()
+
+# load models before the first request instead of during it
+from django.conf import settings  # noqa: E402
+if settings.CHOOSE_WORD_WARMUP:
+    from choose_word.registry import registry  # noqa: E402
+    registry.warmup()
+
+# run jobs left in queue, gunicorn starts them in each forked worker instead
+if settings.CHOOSE_WORD_JOB_START_ON_LOAD:
+    from choose_word.jobs import job_queue  # noqa: E402
+    job_queue.ensure_started()
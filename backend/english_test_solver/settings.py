@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'choose_word.middleware.server_timing_middleware',
+    'choose_word.middleware.profiling_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -136,3 +138,83 @@ CORS_ORIGIN_WHITELIST = [
     'http://localhost:8080', 'http://127.0.0.1:8080',
     'http://localhost:8000', 'http://127.0.0.1:8000'
 ]
+
+
+# Settings of choose_word app
+# approximate memory in bytes for cache of BERT scores, 0 disables it
+CHOOSE_WORD_BERT_CACHE_MEMORY = int(
+    os.environ.get('CHOOSE_WORD_BERT_CACHE_MEMORY', 64 * 2 ** 20)
+)
+# maximum number of short strings in cross-request tokenization caches
+CHOOSE_WORD_TOKENIZATION_CACHE_ENTRIES = int(
+    os.environ.get('CHOOSE_WORD_TOKENIZATION_CACHE_ENTRIES', 65536)
+)
+# load models and run warmup pass when WSGI/ASGI application starts
+CHOOSE_WORD_WARMUP = os.environ.get('CHOOSE_WORD_WARMUP', '1') == '1'
+# use memory-mapped weights made by convert_weights_mmap command if present,
+# they are used only by models running in fp32 precision
+CHOOSE_WORD_MMAP_WEIGHTS = (
+    os.environ.get('CHOOSE_WORD_MMAP_WEIGHTS', '1') == '1'
+)
+# precision of inference for each model: fp32, int8 or bf16
+CHOOSE_WORD_BERT_PRECISION = os.environ.get(
+    'CHOOSE_WORD_BERT_PRECISION', 'fp32'
+)
+CHOOSE_WORD_GPT_PRECISION = os.environ.get(
+    'CHOOSE_WORD_GPT_PRECISION', 'fp32'
+)
+# backend of inference for each model: eager, torchscript or onnx
+# (onnx requires onnxruntime, graphs are exported once into models
+# directory and should be removed after weights are changed)
+CHOOSE_WORD_BERT_BACKEND = os.environ.get('CHOOSE_WORD_BERT_BACKEND', 'eager')
+CHOOSE_WORD_GPT_BACKEND = os.environ.get('CHOOSE_WORD_GPT_BACKEND', 'eager')
+# number of concurrent forward passes, cores are split between them
+CHOOSE_WORD_INFERENCE_WORKERS = int(
+    os.environ.get('CHOOSE_WORD_INFERENCE_WORKERS', 1)
+)
+# maximum number of requests waiting for inference, 0 means no limit
+CHOOSE_WORD_INFERENCE_MAX_QUEUE = int(
+    os.environ.get('CHOOSE_WORD_INFERENCE_MAX_QUEUE', 64)
+)
+# micro-batching of concurrent requests: number of tokens to flush
+# collected requests at once and maximum wait in seconds for other requests
+CHOOSE_WORD_MICRO_BATCH_TOKENS = int(
+    os.environ.get('CHOOSE_WORD_MICRO_BATCH_TOKENS', 16384)
+)
+CHOOSE_WORD_MICRO_BATCH_WAIT = float(
+    os.environ.get('CHOOSE_WORD_MICRO_BATCH_WAIT', 0.005)
+)
+# number of chunks of bulk request scored at once, each chunk has
+# the micro-batching number of tokens
+CHOOSE_WORD_BULK_MAX_CHUNKS = int(
+    os.environ.get('CHOOSE_WORD_BULK_MAX_CHUNKS', 2)
+)
+# background jobs: number of worker threads in each process (0 disables
+# workers of the process) and seconds between checks of the queue
+CHOOSE_WORD_JOB_WORKERS = int(os.environ.get('CHOOSE_WORD_JOB_WORKERS', 1))
+CHOOSE_WORD_JOB_POLL_INTERVAL = float(
+    os.environ.get('CHOOSE_WORD_JOB_POLL_INTERVAL', 1.0)
+)
+# start job workers when WSGI/ASGI application is loaded, gunicorn.conf.py
+# disables it to start them in forked workers instead of the master
+CHOOSE_WORD_JOB_START_ON_LOAD = (
+    os.environ.get('CHOOSE_WORD_JOB_START_ON_LOAD', '1') == '1'
+)
+# test items with more tokens to score are solved by background job and
+# answered by 202 with Location of the job, clients should poll it,
+# 0 (default) means that all test items are solved during request
+CHOOSE_WORD_MAX_SYNC_TOKENS = int(
+    os.environ.get('CHOOSE_WORD_MAX_SYNC_TOKENS', 0)
+)
+# token to profile request by X-Profile header or profile query parameter
+# and to list profiles, empty token disables profiling
+CHOOSE_WORD_PROFILE_TOKEN = os.environ.get('CHOOSE_WORD_PROFILE_TOKEN', '')
+# directory for files of cProfile and torch.profiler of profiled requests
+CHOOSE_WORD_PROFILE_DIR = os.environ.get(
+    'CHOOSE_WORD_PROFILE_DIR', str(BASE_DIR / 'profiles')
+)
+# splitter of text into sentences: punkt (model saved by download_punkt
+# command) or rules (faster, based on punctuation)
+CHOOSE_WORD_SENTENCE_SPLITTER = os.environ.get(
+    'CHOOSE_WORD_SENTENCE_SPLITTER', 'punkt'
+)
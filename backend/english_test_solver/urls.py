@@ -15,8 +15,12 @@ Including another URLconf
 """
 from django.urls import path, include
 
+from choose_word.views import MetricsView
+
 urlpatterns = [
     path('api/choose_word/', include('choose_word.urls')),
+    # Prometheus scrapes path without trailing slash
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
 
 handler500 = 'rest_framework.exceptions.server_error'
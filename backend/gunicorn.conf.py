@@ -0,0 +1,87 @@
+"""
+Gunicorn config for production serving of english_test_solver project.
+
+Models are loaded and warmed up once in the master process (preload_app)
+and forked workers share their weights copy-on-write. Each worker gets
+its own share of cores, the number of workers is derived from the number
+of cores available to the container.
+
+Run: gunicorn -c gunicorn.conf.py english_test_solver.wsgi
+"""
+
+import gc
+import os
+
+import torch
+
+
+def available_cores():
+    """Get ids of cores available to the process."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+# torch threads of each worker process
+threads_per_worker = int(os.environ.get('GUNICORN_THREADS_PER_WORKER', 2))
+cores = available_cores()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get(
+    'GUNICORN_WORKERS', max(1, len(cores) // threads_per_worker)
+))
+# request threads of each worker, they wait for the inference executor
+# and let micro-batcher merge concurrent requests
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+preload_app = True
+# loading of models in the master may take a while
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+
+# tokenizers can't use their thread pool after fork
+os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+# threads of job workers don't survive fork, they are started in post_fork
+os.environ['CHOOSE_WORD_JOB_START_ON_LOAD'] = '0'
+
+
+def on_starting(server):
+    """Don't start intra-op threads in the master, they don't survive fork."""
+    torch.set_num_threads(1)
+
+
+def when_ready(server):
+    """Move objects of loaded app out of the GC to keep pages shared."""
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    """Assign free share of cores to the worker before it is forked."""
+    used_slots = {
+        getattr(other, 'core_slot', None) for other in server.WORKERS.values()
+    }
+    slot = 0
+    while slot in used_slots:
+        slot += 1
+    worker.core_slot = slot
+
+
+def post_fork(server, worker):
+    """Pin the worker to its share of cores, set its torch threads
+    and start its job workers."""
+    num_slots = max(1, len(cores) // threads_per_worker)
+    slot = worker.core_slot % num_slots
+    worker_cores = cores[
+        slot * threads_per_worker:(slot + 1) * threads_per_worker
+    ] or cores
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, worker_cores)
+    torch.set_num_threads(len(worker_cores))
+    server.log.info(
+        f'Worker {worker.pid} uses cores {worker_cores}'
+    )
+
+    # connections of the master can't be shared with the worker
+    from django.db import connections
+    from choose_word.jobs import job_queue
+    connections.close_all()
+    job_queue.ensure_started()
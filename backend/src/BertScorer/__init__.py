@@ -1,2 +1,8 @@
 from .bert_scorer_correction import BertScorerCorrection
 from .bert_scorer_sentence import BertScorerSentence
+from .masked_lm_head import masked_lm_logits
+from .masked_lm_backend import (
+    EagerMaskedLMBackend, TorchScriptMaskedLMBackend, OnnxMaskedLMBackend,
+    create_masked_lm_backend
+)
+from .score_cache import ScoreCache
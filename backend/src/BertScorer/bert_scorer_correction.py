@@ -1,10 +1,17 @@
-from typing import List, Tuple, Dict
+from array import array
+from typing import Callable, List, Tuple, Dict, Optional
 
 import torch
 import torch.nn.functional as F
 from transformers.tokenization_utils import PreTrainedTokenizer, BatchEncoding
 from transformers import BertForMaskedLM
 
+from src.Metrics import observe_batch, scorer_rows
+from src.Scheduler import TokenBudgetScheduler
+from src.Timing import timed_stage
+from .masked_lm_head import masked_lm_logits
+from .score_cache import ScoreCache
+
 
 class BertScorerCorrection:
     """Class for scoring all candidates for correction by BERT model."""
@@ -14,7 +21,11 @@ class BertScorerCorrection:
             model: BertForMaskedLM,
             tokenizer: PreTrainedTokenizer,
             max_length: int = 512,
-            batch_size: int = 16,
+            batch_size: Optional[int] = None,
+            max_batch_tokens: int = 8192,
+            mask_only_head: bool = True,
+            cache: Optional[ScoreCache] = None,
+            backend: Optional[Callable] = None,
             device: int = -1
     ):
         """Init object.
@@ -22,12 +33,24 @@ class BertScorerCorrection:
         :param model: Bert model for MLM from transformers library
         :param tokenizer: tokenizer for Bert model
         :param max_length: maximum number of tokens to process
-        :param batch_size: size of batch
+        :param batch_size: maximum number of rows in batch,
+            no limit if None
+        :param max_batch_tokens: maximum number of tokens in padded batch
+        :param mask_only_head: apply prediction head only at [MASK] tokens
+        :param cache: cache of already scored rows, no caching if None
+        :param backend: backend to run encoder, eager modules if None
         :param device: id of device
         """
         self.device = torch.device('cpu' if device < 0 else f'cuda:{device}')
         self.model = model.to(device=self.device)
         self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.mask_only_head = mask_only_head
+        self.cache = cache
+        self.backend = backend
+        self.scheduler = TokenBudgetScheduler(
+            max_batch_tokens=max_batch_tokens, max_batch_size=batch_size
+        )
         self.tokenizer = tokenizer
         self.max_length = max_length
 
@@ -43,210 +66,352 @@ class BertScorerCorrection:
 
         :returns: scoring results for each candidate for each sentence
         """
+        # leave place for special tokens
         tokenized_sentences = self.tokenizer(
             sentences,
-            add_special_tokens=True,
-            padding=True,
-            max_length=self.max_length,
+            add_special_tokens=False,
+            padding=False,
+            max_length=self.max_length - 2,
             truncation='longest_first',
-        )
+        )['input_ids']
         # check, that there is one mask in each sentence
-        for sublist in tokenized_sentences['input_ids']:
+        for sublist in tokenized_sentences:
             if sublist.count(self.tokenizer.mask_token_id) != 1:
                 raise ValueError(
                     'There should be exactly one [MASK] token in the text.'
                 )
 
         # find mask index for each sentence
-        mask_indexes = [
+        gap_indexes = [
             x.index(self.tokenizer.mask_token_id)
-            for x in tokenized_sentences['input_ids']
+            for x in tokenized_sentences
+        ]
+
+        tokenized_candidates = [
+            self.tokenizer(
+                sentence_candidates,
+                add_special_tokens=False,
+                padding=False,
+                truncation='do_not_truncate',
+            )['input_ids']
+            for sentence_candidates in candidates
         ]
 
+        return self.score_tokenized(
+            tokenized_sentences, gap_indexes, tokenized_candidates
+        )
+
+    def score_tokenized(
+            self, input_ids: List[List[int]], gap_indexes: List[int],
+            candidates: List[List[List[int]]],
+            priorities: Optional[List[int]] = None,
+            on_gap_scored: Optional[Callable] = None
+    ) -> List[List[List[float]]]:
+        """Make scoring for tokenized candidates for every sentence.
+
+        :param input_ids: token ids of sentences without special tokens
+        :param gap_indexes: index of the gap token in each sentence,
+            that should be replaced by candidates
+        :param candidates: token ids of candidates to score
+            for each sentence
+        :param priorities: priority of each sentence, rows of sentences
+            with lower priority are scored earlier, order by length if None
+        :param on_gap_scored: function to call with index of sentence
+            and its results as soon as all its rows are scored
+
+        :returns: scoring results for each candidate for each sentence
+        """
+        # add special tokens and place [MASK] token into the gap
+        sentences_input_ids = []
+        mask_indexes = []
+        for sentence_input_ids, gap_index in zip(input_ids, gap_indexes):
+            if len(sentence_input_ids) + 2 > self.max_length:
+                raise ValueError('Too long sentence to process.')
+            sentence_input_ids = (
+                [self.tokenizer.cls_token_id]
+                + sentence_input_ids
+                + [self.tokenizer.sep_token_id]
+            )
+            sentence_input_ids[gap_index + 1] = self.tokenizer.mask_token_id
+            sentences_input_ids.append(sentence_input_ids)
+            mask_indexes.append(gap_index + 1)
+
         # group candidates for batching
         candidates_info = self._group_candidates(candidates)
 
+        # lay out all rows to score
+        rows = self._plan_rows(
+            sentences_input_ids, mask_indexes, candidates_info
+        )
+
         # make scoring
         score_results = [
             [[] for _ in sentence_candidates]
             for sentence_candidates in candidates
         ]
-        current_batch = {'input_ids': [], 'attention_mask': [], 'answers': []}
-        indices_to_process = []
-        for i in range(len(sentences)):
-            mask_index = mask_indexes[i]
-            sentence_candidates_info = candidates_info[i]
-            # add each group of candidates with the same tokens to the batch
-            for j in range(len(sentence_candidates_info['input_ids'])):
-                # generate input_ids to score
-                current_batch['input_ids'].append(
-                    torch.tensor(
-                        tokenized_sentences['input_ids'][i][:mask_index]
-                        + sentence_candidates_info['input_ids'][j]
-                        + tokenized_sentences['input_ids'][i][mask_index + 1:],
-                        dtype=torch.long, device=self.device
-                    )
-                )
-                # generate attention_mask to score
-                # ignore all tokens except for [MASK]
-                current_batch['attention_mask'].append(
-                    torch.tensor(
-                        tokenized_sentences['attention_mask'][i][:mask_index]
-                        + [int(x == self.tokenizer.mask_token_id)
-                           for x in sentence_candidates_info['input_ids'][j]]
-                        + tokenized_sentences['attention_mask'][i][
-                            mask_index + 1:
-                          ],
-                        dtype=torch.long, device=self.device
+        # take already scored rows from cache
+        rows_to_score = list(range(len(rows['answers'])))
+        if self.cache is not None:
+            row_keys = self._row_keys(sentences_input_ids, rows)
+            rows_to_score = []
+            cached_results = []
+            cached_indices = []
+            for idx, key in enumerate(row_keys):
+                log_probs = self.cache.get(key, rows['answers'][idx])
+                if log_probs is None:
+                    rows_to_score.append(idx)
+                else:
+                    cached_results.append(log_probs)
+                    cached_indices.append(rows['indices'][idx])
+            self._update_results(score_results, cached_results,
+                                 cached_indices)
+
+        scorer_rows.observe(len(rows['answers']), model='bert')
+        # count rows left to score for each sentence
+        row_sentences = rows['sentences'].tolist()
+        rows_left = [0] * len(candidates)
+        for idx in rows_to_score:
+            rows_left[row_sentences[idx]] += 1
+        if on_gap_scored is not None:
+            for sentence_idx, cnt in enumerate(rows_left):
+                if cnt == 0:
+                    on_gap_scored(sentence_idx, score_results[sentence_idx])
+
+        # rows of close lengths are batched together
+        lengths = rows['row_lengths'][rows_to_score].tolist()
+        row_priorities = None
+        if priorities is not None:
+            row_priorities = [
+                priorities[row_sentences[idx]] for idx in rows_to_score
+            ]
+        for batch_positions in self.scheduler(lengths, row_priorities):
+            batch_indices = [rows_to_score[pos] for pos in batch_positions]
+            with timed_stage('assemble'):
+                batch = self._assemble_batch(rows, batch_indices)
+            with timed_stage('forward'):
+                results_update = self._score_batch(batch)
+            observe_batch(
+                'bert', len(batch_indices), batch['input_ids'].numel(),
+                int(rows['row_lengths'][batch_indices].sum())
+            )
+            self._update_results(
+                score_results, results_update,
+                [rows['indices'][idx] for idx in batch_indices]
+            )
+            if self.cache is not None:
+                for idx, log_probs in zip(batch_indices, results_update):
+                    self.cache.put(
+                        row_keys[idx], rows['answers'][idx], log_probs
                     )
-                )
-                # generate answers to score
-                current_batch['answers'].append(
-                    sentence_candidates_info['answers'][j]
-                )
-                # save indices to further aggregation
-                indices_to_process.append(
-                    sentence_candidates_info['indices'][j]
-                )
-
-                # check do we need to start scoring
-                if len(current_batch['input_ids']) > self.batch_size:
-                    results_update = self._score_batch(current_batch)
-                    current_batch = {
-                        'input_ids': [], 'attention_mask': [], 'answers': []
-                    }
-                    self._update_results(score_results, results_update,
-                                         indices_to_process)
-                    indices_to_process = []
-
-        # score remain candidates and process them
-        if len(current_batch['input_ids']) > 0:
-            results_update = self._score_batch(current_batch)
-            self._update_results(score_results, results_update,
-                                 indices_to_process)
+            for idx in batch_indices:
+                sentence_idx = row_sentences[idx]
+                rows_left[sentence_idx] -= 1
+                if rows_left[sentence_idx] == 0 and on_gap_scored is not None:
+                    on_gap_scored(sentence_idx, score_results[sentence_idx])
 
         return score_results
 
-    def _group_candidates(self, candidates: List[List[str]]) -> List[Dict]:
+    def _group_candidates(
+            self, candidates: List[List[List[int]]]
+    ) -> List[Dict]:
         """Create list of grouped candidates to batch.
 
-        :param candidates: list of lists of candidates to score
+        Candidate of length `n` scored at its token `k` is represented
+        by [UNK] tokens with [MASK] token at position `k`, so such pattern
+        is fully described by `(n, k)` pair and candidates with the same
+        pair share one row.
+
+        :param candidates: token ids of candidates to score
             for each sentence
         :return: grouped candidates info
         """
-        tokenized_candidates_input_ids = []
-        for sentence_candidates in candidates:
-            tokenized_sentence_candidates = self.tokenizer(
-                sentence_candidates,
-                add_special_tokens=False,
-                padding=False,
-                truncation='do_not_truncate',
-            )
-            tokenized_candidates_input_ids.append(
-                tokenized_sentence_candidates['input_ids']
-            )
-
-        # make candidates with moved [MASK] token
-        candidates_info = []
-        for i, tokenized_sentence_candidates in enumerate(
-                tokenized_candidates_input_ids
-        ):
-            cur_list_input_ids = []
-            cur_list_indices = []
-            cur_list_answers = []
-            for j, tokenized_candidate in enumerate(
-                    tokenized_sentence_candidates
-            ):
-                for k in range(len(tokenized_candidate)):
-                    # make substitution for [MASK] token in tokenized candidate
-                    # for others keep [UNK] token (it has won't have attention)
-                    cur_candidate = [self.tokenizer.unk_token_id] * len(
-                        tokenized_candidate
-                    )
-                    cur_candidate[k] = self.tokenizer.mask_token_id
-                    cur_list_input_ids.append(cur_candidate)
-                    cur_list_indices.append((i, j))
-                    cur_list_answers.append(tokenized_candidate[k])
-            candidates_info.append({
-                # input ids of tokenized candidate
-                'input_ids': cur_list_input_ids,
-                # indices of sentence and candidate in input lists
-                'indices': cur_list_indices,
-                # token ids of answers on MASK
-                'answers': cur_list_answers
-            })
-
-        # group similar candidates for each sentence
         grouped_candidates_info = []
-        for sentence_info in candidates_info:
-            input_ids_with_sorting_indices = sorted(
-                enumerate(sentence_info['input_ids']), key=lambda x: x[1]
-            )
-            sort_indices = [x[0] for x in input_ids_with_sorting_indices]
-
-            sentence_grouped_input_ids = []
+        for i, tokenized_sentence_candidates in enumerate(candidates):
+            groups = {}
+            sentence_grouped_lengths = []
+            sentence_grouped_positions = []
             sentence_grouped_indices = []
             sentence_grouped_answers = []
-
-            cur_list_indices = []
-            cur_list_answers = []
-            # not to treat first element
-            prev_element = sentence_info['input_ids'][sort_indices[0]]
-            for idx in sort_indices:
-                cur_element = sentence_info['input_ids'][idx]
-                if cur_element != prev_element:
-                    sentence_grouped_input_ids.append(prev_element)
-                    sentence_grouped_indices.append(cur_list_indices)
-                    sentence_grouped_answers.append(cur_list_answers)
-                    prev_element = cur_element
-                    cur_list_indices = []
-                    cur_list_answers = []
-                cur_list_indices.append(sentence_info['indices'][idx])
-                cur_list_answers.append(sentence_info['answers'][idx])
-
-            # process remain lists
-            sentence_grouped_input_ids.append(prev_element)
-            sentence_grouped_indices.append(cur_list_indices)
-            sentence_grouped_answers.append(cur_list_answers)
+            for j, tokenized_candidate in enumerate(
+                    tokenized_sentence_candidates
+            ):
+                candidate_length = len(tokenized_candidate)
+                for k, answer in enumerate(tokenized_candidate):
+                    key = (candidate_length, k)
+                    group_idx = groups.get(key)
+                    if group_idx is None:
+                        group_idx = len(groups)
+                        groups[key] = group_idx
+                        sentence_grouped_lengths.append(candidate_length)
+                        sentence_grouped_positions.append(k)
+                        sentence_grouped_indices.append([])
+                        sentence_grouped_answers.append([])
+                    sentence_grouped_indices[group_idx].append((i, j))
+                    sentence_grouped_answers[group_idx].append(answer)
 
             grouped_candidates_info.append({
-                'input_ids': sentence_grouped_input_ids,
+                # number of tokens in candidates of the group
+                'lengths': sentence_grouped_lengths,
+                # position of [MASK] token inside candidates of the group
+                'positions': sentence_grouped_positions,
+                # indices of sentence and candidate in input lists
                 'indices': sentence_grouped_indices,
+                # token ids of answers on MASK
                 'answers': sentence_grouped_answers
             })
 
         return grouped_candidates_info
 
-    def _score_batch(self, batch: Dict[str, List]) -> List[List[float]]:
-        """Scoring a batch of candidates.
+    def _plan_rows(
+            self, input_ids: List[List[int]], mask_indexes: List[int],
+            candidates_info: List[Dict]
+    ) -> Dict:
+        """Lay out all rows to score as flat arrays.
 
-        :param batch: dict with input_ids, attentions_masks, answers
+        :param input_ids: tokenized sentences with exactly one [MASK] token
+        :param mask_indexes: index of [MASK] token in each sentence
+        :param candidates_info: grouped candidates for each sentence
 
-        :returns: list of results
+        :returns: dict with flat buffer of sentences tokens and
+            description of each row to build from it
         """
-        # find mask indexes
-        mask_indexes = [
-            torch.nonzero(x == self.tokenizer.mask_token_id).item()
-            for x in batch['input_ids']
+        sentence_offsets = []
+        offset = 0
+        for sentence_input_ids in input_ids:
+            sentence_offsets.append(offset)
+            offset += len(sentence_input_ids)
+
+        row_sentences = []
+        row_lengths = []
+        row_positions = []
+        indices = []
+        answers = []
+        for i, sentence_info in enumerate(candidates_info):
+            row_sentences += [i] * len(sentence_info['lengths'])
+            row_lengths += sentence_info['lengths']
+            row_positions += sentence_info['positions']
+            indices += sentence_info['indices']
+            answers += sentence_info['answers']
+
+        row_sentences = torch.tensor(row_sentences, dtype=torch.long)
+        sentence_lengths = torch.tensor(
+            [len(x) for x in input_ids], dtype=torch.long
+        )[row_sentences]
+        candidate_lengths = torch.tensor(row_lengths, dtype=torch.long)
+        return {
+            # index of the row sentence
+            'sentences': row_sentences,
+            # tokens of all sentences one after another
+            'tokens': torch.tensor(
+                [token for x in input_ids for token in x], dtype=torch.long
+            ),
+            # start of the row sentence in tokens buffer
+            'offsets': torch.tensor(
+                sentence_offsets, dtype=torch.long
+            )[row_sentences],
+            # number of tokens in the row sentence
+            'sentence_lengths': sentence_lengths,
+            # position of the gap in the row sentence
+            'mask_indexes': torch.tensor(
+                mask_indexes, dtype=torch.long
+            )[row_sentences],
+            # number of tokens placed into the gap
+            'candidate_lengths': candidate_lengths,
+            # number of tokens in the row, gap is replaced by candidate
+            'row_lengths': sentence_lengths + candidate_lengths - 1,
+            # position of [MASK] token among tokens placed into the gap
+            'candidate_positions': torch.tensor(
+                row_positions, dtype=torch.long
+            ),
+            'indices': indices,
+            'answers': answers
+        }
+
+    def _row_keys(
+            self, input_ids: List[List[int]], rows: Dict
+    ) -> List[Tuple]:
+        """Create keys of rows for caching.
+
+        Row is defined by tokens of its sentence, index of the gap,
+        number of tokens placed into the gap and position of [MASK] token
+        among them. It gives both input_ids and attention_mask of the row.
+
+        :param input_ids: tokenized sentences with exactly one [MASK] token
+        :param rows: planned rows
+
+        :returns: key for each row
+        """
+        sentence_keys = [array('i', x).tobytes() for x in input_ids]
+        return [
+            (sentence_keys[sentence_idx], mask_index, length, position)
+            for sentence_idx, mask_index, length, position in zip(
+                rows['sentences'].tolist(), rows['mask_indexes'].tolist(),
+                rows['candidate_lengths'].tolist(),
+                rows['candidate_positions'].tolist()
+            )
         ]
 
-        # create a valid BatchEncoding object to run model
-        max_len = max([len(x) for x in batch['input_ids']])
+    def _assemble_batch(self, rows: Dict, batch_indices: List[int]) -> Dict:
+        """Fill padded buffers for the given rows.
 
-        # pad all input_ids with [PAD] token id to max length
-        input_ids_list = [
-            F.pad(x, (0, max_len - len(x)), 'constant',
-                  self.tokenizer.pad_token_id)
-            for x in batch['input_ids']
-        ]
-        input_ids = torch.stack(input_ids_list, dim=0)
+        :param rows: planned rows
+        :param batch_indices: indices of rows to put into the batch
 
-        # pad all attention_mask with 0 to max length
-        attention_mask_list = [
-            F.pad(x, (0, max_len - len(x)), 'constant', 0)
-            for x in batch['attention_mask']
+        :returns: dict with input_ids, attention_mask, mask_indexes, answers
+        """
+        selection = torch.tensor(batch_indices, dtype=torch.long)
+        offsets = rows['offsets'][selection, None]
+        gap_indexes = rows['mask_indexes'][selection, None]
+        candidate_lengths = rows['candidate_lengths'][selection, None]
+        candidate_positions = rows['candidate_positions'][selection, None]
+        row_lengths = rows['row_lengths'][selection, None]
+
+        max_len = int(row_lengths.max())
+        positions = torch.arange(max_len, dtype=torch.long)[None, :]
+        in_prefix = positions < gap_indexes
+        in_suffix = (
+            (positions >= gap_indexes + candidate_lengths)
+            & (positions < row_lengths)
+        )
+        in_sentence = in_prefix | in_suffix
+        # position of the token in its source sentence
+        source = torch.where(
+            in_prefix, positions, positions - candidate_lengths + 1
+        )
+        row_mask_indexes = gap_indexes + candidate_positions
+
+        input_ids = torch.full(
+            (len(batch_indices), max_len), self.tokenizer.pad_token_id,
+            dtype=torch.long
+        )
+        input_ids[in_sentence] = rows['tokens'][
+            (offsets + source)[in_sentence]
         ]
-        attention_mask = torch.stack(attention_mask_list, dim=0)
+        # candidate tokens except for [MASK] are [UNK] without attention
+        input_ids[~in_sentence & (positions < row_lengths)] = (
+            self.tokenizer.unk_token_id
+        )
+        input_ids.scatter_(1, row_mask_indexes, self.tokenizer.mask_token_id)
+
+        attention_mask = in_sentence.long()
+        attention_mask.scatter_(1, row_mask_indexes, 1)
+
+        return {
+            'input_ids': input_ids.to(self.device),
+            'attention_mask': attention_mask.to(self.device),
+            'mask_indexes': row_mask_indexes.squeeze(1).to(self.device),
+            'answers': [rows['answers'][idx] for idx in batch_indices]
+        }
+
+    def _score_batch(self, batch: Dict) -> List[List[float]]:
+        """Scoring a batch of candidates.
+
+        :param batch: dict with input_ids, attention_mask, mask_indexes,
+            answers
+
+        :returns: list of results
+        """
+        input_ids = batch['input_ids']
 
         # create token_type_ids filled with 0
         token_type_ids = torch.zeros_like(
@@ -255,20 +420,21 @@ class BertScorerCorrection:
 
         model_input = BatchEncoding({
             'input_ids': input_ids,
-            'attention_mask': attention_mask,
+            'attention_mask': batch['attention_mask'],
             'token_type_ids': token_type_ids
         })
 
         with torch.no_grad():
             # run model
-            model_output = self.model(**model_input)[0].cpu().detach()
-            log_probs = F.log_softmax(model_output, dim=-1)
+            mask_output = masked_lm_logits(
+                self.model, model_input, batch['mask_indexes'],
+                mask_only_head=self.mask_only_head, backend=self.backend
+            ).cpu().float()
+            log_probs = F.log_softmax(mask_output, dim=-1)
 
             results = []
             for i, sentence_answers in enumerate(batch['answers']):
-                results.append(
-                    log_probs[i][mask_indexes[i]][sentence_answers].tolist()
-                )
+                results.append(log_probs[i][sentence_answers].tolist())
 
         return results
 
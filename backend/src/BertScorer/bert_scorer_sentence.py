@@ -1,10 +1,12 @@
-from typing import List, Callable
+from typing import List, Callable, Optional
 
 import numpy as np
 import torch
 from transformers.tokenization_utils import PreTrainedTokenizer, BatchEncoding
 from transformers import BertForMaskedLM
 
+from .masked_lm_head import masked_lm_logits
+
 
 class BertScorerSentence:
     """Class for scoring all sentences in MLM."""
@@ -13,17 +15,23 @@ class BertScorerSentence:
             self,
             model: BertForMaskedLM,
             tokenizer: PreTrainedTokenizer,
+            mask_only_head: bool = True,
+            backend: Optional[Callable] = None,
             device: int = -1
     ):
         """Init object.
 
         :param model: Bert model for MLM from transformers library
         :param tokenizer: tokenizer for Bert model
+        :param mask_only_head: apply prediction head only at [MASK] tokens
+        :param backend: backend to run encoder, eager modules if None
         :param device: id of device
         """
         self.device = torch.device('cpu' if device < 0 else f'cuda:{device}')
         self.model = model.to(device=self.device)
         self.tokenizer = tokenizer
+        self.mask_only_head = mask_only_head
+        self.backend = backend
 
     def __call__(self, sentences: List[str],
                  batch_size: int = 64,
@@ -125,9 +133,16 @@ class BertScorerSentence:
         :returns: results of scoring
         """
         with torch.no_grad():
-            model_output = self.model(**model_input)[0]
+            mask_indexes = torch.full(
+                (len(candidates),), mask_index,
+                dtype=torch.long, device=self.device
+            )
+            model_output = masked_lm_logits(
+                self.model, model_input, mask_indexes,
+                mask_only_head=self.mask_only_head, backend=self.backend
+            )
             log_probs = torch.nn.functional.log_softmax(
-                model_output[:, mask_index, :], dim=-1
+                model_output.float(), dim=-1
             )
             scores = log_probs[torch.arange(len(candidates)), candidates]
         return scores.tolist()
@@ -0,0 +1,242 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import torch
+from transformers import BertForMaskedLM
+
+from src.Compilation import export_onnx, create_onnx_session
+from src.Scheduler import ShapeBuckets
+
+
+# names of available backends
+BACKENDS = ('eager', 'torchscript', 'onnx')
+
+
+class EagerMaskedLMBackend:
+    """Class for running encoder of MLM by eager modules.
+
+    It is the reference implementation for compiled backends.
+    """
+
+    def __init__(self, model: BertForMaskedLM):
+        """Init object.
+
+        :param model: Bert model for MLM from transformers library
+        """
+        self.model = model
+
+    def __call__(
+            self,
+            input_ids: torch.Tensor,
+            attention_mask: torch.Tensor,
+            token_type_ids: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """Calculate hidden states of the last layer.
+
+        :param input_ids: token ids of the batch
+        :param attention_mask: attention mask of the batch
+        :param token_type_ids: token type ids of the batch
+
+        :returns: hidden states of shape batch_size x length x hidden_size
+        """
+        return self.model.bert(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids
+        )[0]
+
+
+class _MaskedLMEncoder(torch.nn.Module):
+    """Module with plain tensor inputs and outputs for compilation."""
+
+    def __init__(self, model: BertForMaskedLM):
+        super().__init__()
+        self.bert = model.bert
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.bert(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+            return_dict=False
+        )[0]
+
+
+class BucketedMaskedLMBackend(EagerMaskedLMBackend):
+    """Base class for compiled backends with inputs padded to buckets."""
+
+    def __init__(
+            self,
+            model: BertForMaskedLM,
+            max_length: int = 512,
+            max_batch_size: int = 128
+    ):
+        """Init object.
+
+        :param model: Bert model for MLM from transformers library
+        :param max_length: maximum length of input
+        :param max_batch_size: maximum size of bucket of rows
+        """
+        super().__init__(model)
+        self.length_buckets = ShapeBuckets.powers_of_two(
+            max_length, min_size=16
+        )
+        self.batch_buckets = ShapeBuckets.powers_of_two(
+            max_batch_size, min_size=1
+        )
+        self.pad_token_id = model.config.pad_token_id or 0
+        self._encoder = _MaskedLMEncoder(model).eval()
+
+    def __call__(
+            self,
+            input_ids: torch.Tensor,
+            attention_mask: torch.Tensor,
+            token_type_ids: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+
+        # pad batch to the sizes of buckets
+        batch_size, length = input_ids.shape
+        padded_shape = (
+            self.batch_buckets(batch_size), self.length_buckets(length)
+        )
+        padded_inputs = []
+        for tensor, value in [
+            (input_ids, self.pad_token_id),
+            (attention_mask, 0),
+            (token_type_ids, 0)
+        ]:
+            padded_tensor = tensor.new_full(padded_shape, value)
+            padded_tensor[:batch_size, :length] = tensor
+            padded_inputs.append(padded_tensor)
+
+        hidden_states = self._run(*padded_inputs)
+        return hidden_states[:batch_size, :length]
+
+    def _run(
+            self,
+            input_ids: torch.Tensor,
+            attention_mask: torch.Tensor,
+            token_type_ids: torch.Tensor
+    ) -> torch.Tensor:
+        """Run compiled graph on padded batch."""
+        raise NotImplementedError
+
+
+class TorchScriptMaskedLMBackend(BucketedMaskedLMBackend):
+    """Class for running encoder of MLM by frozen TorchScript graphs.
+
+    Graph is traced once for each shape of bucket.
+    """
+
+    def __init__(
+            self,
+            model: BertForMaskedLM,
+            max_length: int = 512,
+            max_batch_size: int = 128,
+            max_graphs: int = 16
+    ):
+        """Init object.
+
+        :param model: Bert model for MLM from transformers library
+        :param max_length: maximum length of input
+        :param max_batch_size: maximum size of bucket of rows
+        :param max_graphs: maximum number of kept traced graphs
+        """
+        super().__init__(model, max_length, max_batch_size)
+        self.max_graphs = max_graphs
+        self._graphs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _run(self, input_ids, attention_mask, token_type_ids):
+        inputs = (input_ids, attention_mask, token_type_ids)
+        key = (tuple(input_ids.shape), str(input_ids.device))
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is None:
+                with torch.no_grad():
+                    graph = torch.jit.freeze(torch.jit.trace(
+                        self._encoder, inputs, check_trace=False
+                    ))
+                self._graphs[key] = graph
+                while len(self._graphs) > self.max_graphs:
+                    self._graphs.popitem(last=False)
+            else:
+                self._graphs.move_to_end(key)
+        return graph(*inputs)
+
+
+class OnnxMaskedLMBackend(BucketedMaskedLMBackend):
+    """Class for running encoder of MLM by ONNX Runtime.
+
+    Graph is exported once with dynamic shapes and is reused afterwards.
+    """
+
+    input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+
+    def __init__(
+            self,
+            model: BertForMaskedLM,
+            export_path: str,
+            max_length: int = 512,
+            max_batch_size: int = 128,
+            num_threads: int = 0
+    ):
+        """Init object.
+
+        :param model: Bert model for MLM from transformers library
+        :param export_path: path to ONNX graph, it is exported if absent
+        :param max_length: maximum length of input
+        :param max_batch_size: maximum size of bucket of rows
+        :param num_threads: number of threads of ONNX Runtime,
+            0 means the number of threads of torch
+        """
+        super().__init__(model, max_length, max_batch_size)
+        if not os.path.exists(export_path):
+            example = tuple(
+                torch.ones((1, 16), dtype=torch.long)
+                for _ in self.input_names
+            )
+            export_onnx(
+                self._encoder, example, export_path,
+                input_names=self.input_names,
+                output_names=['hidden_states'],
+                dynamic_axes={
+                    name: {0: 'batch', 1: 'length'}
+                    for name in self.input_names + ['hidden_states']
+                }
+            )
+        self.session = create_onnx_session(export_path, num_threads)
+
+    def _run(self, input_ids, attention_mask, token_type_ids):
+        inputs = (input_ids, attention_mask, token_type_ids)
+        outputs = self.session.run(['hidden_states'], {
+            name: tensor.cpu().numpy()
+            for name, tensor in zip(self.input_names, inputs)
+        })
+        return torch.from_numpy(outputs[0]).to(input_ids.device)
+
+
+def create_masked_lm_backend(
+        model: BertForMaskedLM, backend: str = 'eager', **kwargs
+) -> EagerMaskedLMBackend:
+    """Create backend to run encoder of MLM.
+
+    :param model: Bert model for MLM from transformers library
+    :param backend: one of 'eager', 'torchscript' and 'onnx'
+    :param kwargs: arguments of backend class
+
+    :returns: created backend
+    """
+    if backend == 'eager':
+        return EagerMaskedLMBackend(model)
+    if backend == 'torchscript':
+        return TorchScriptMaskedLMBackend(model, **kwargs)
+    if backend == 'onnx':
+        return OnnxMaskedLMBackend(model, **kwargs)
+    raise ValueError(
+        f'Unknown backend: {backend}, use one of {", ".join(BACKENDS)}'
+    )
@@ -0,0 +1,41 @@
+from typing import Callable, Optional
+
+import torch
+from transformers.tokenization_utils import BatchEncoding
+from transformers import BertForMaskedLM
+
+from .masked_lm_backend import EagerMaskedLMBackend
+
+
+def masked_lm_logits(
+        model: BertForMaskedLM,
+        model_input: BatchEncoding,
+        mask_indexes: torch.Tensor,
+        mask_only_head: bool = True,
+        backend: Optional[Callable] = None
+) -> torch.Tensor:
+    """Calculate logits of MLM at one position of each row.
+
+    :param model: Bert model for MLM from transformers library
+    :param model_input: batch to run model on
+    :param mask_indexes: index of position to score for each row
+    :param mask_only_head: apply prediction head only at the given
+        positions instead of all positions of the batch
+    :param backend: backend to calculate hidden states of encoder,
+        eager modules are used if None
+
+    :returns: logits of shape batch_size x vocab_size
+    """
+    if backend is None:
+        backend = EagerMaskedLMBackend(model)
+    hidden_states = backend(
+        model_input['input_ids'], model_input['attention_mask'],
+        model_input.get('token_type_ids')
+    )
+
+    rows = torch.arange(mask_indexes.size(0), device=mask_indexes.device)
+    if mask_only_head:
+        # prediction head works with each position independently,
+        # so it is enough to apply it to the hidden states at masks
+        return model.cls(hidden_states[rows, mask_indexes])
+    return model.cls(hidden_states)[rows, mask_indexes]
@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+
+class ScoreCache:
+    """Class for LRU caching of answers log probabilities of scored rows."""
+
+    # approximate number of bytes taken by an entry without its key
+    entry_overhead = 256
+    # approximate number of bytes taken by one cached answer
+    answer_size = 96
+
+    def __init__(self, max_memory: int = 64 * 2 ** 20):
+        """Init object.
+
+        :param max_memory: approximate bound of memory in bytes
+            taken by the cache
+        """
+        self.max_memory = max_memory
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+            self, key: Hashable, answers: List[int]
+    ) -> Optional[List[float]]:
+        """Get log probabilities of answers for the row.
+
+        :param key: key of the row
+        :param answers: token ids of answers to get log probabilities for
+
+        :returns: log probabilities of answers if all of them are cached,
+            None otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or any(x not in entry['scores'] for x in answers):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return [entry['scores'][x] for x in answers]
+
+    def put(
+            self, key: Hashable, answers: List[int], log_probs: List[float]
+    ):
+        """Save log probabilities of answers for the row.
+
+        :param key: key of the row
+        :param answers: token ids of answers
+        :param log_probs: log probabilities of answers
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                entry = {'scores': {}, 'size': self._key_size(key)}
+                entry['size'] += self.entry_overhead
+                self.memory += entry['size']
+            for answer, log_prob in zip(answers, log_probs):
+                if answer not in entry['scores']:
+                    entry['size'] += self.answer_size
+                    self.memory += self.answer_size
+                entry['scores'][answer] = log_prob
+            self._entries[key] = entry
+
+            # evict least recently used entries
+            while self.memory > self.max_memory and self._entries:
+                _, evicted_entry = self._entries.popitem(last=False)
+                self.memory -= evicted_entry['size']
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self.memory = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Get counters of the cache.
+
+        :returns: dict with counters
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'memory': self.memory,
+                'max_memory': self.max_memory,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    @staticmethod
+    def _key_size(key: Hashable) -> int:
+        """Estimate memory taken by the key."""
+        if isinstance(key, tuple):
+            return sum(
+                len(x) if isinstance(x, bytes) else 8 for x in key
+            )
+        return len(key) if isinstance(key, bytes) else 8
@@ -0,0 +1 @@
+from .onnx_runtime import export_onnx, create_onnx_session
@@ -0,0 +1,83 @@
+import inspect
+import os
+import tempfile
+from typing import Dict, List, Tuple
+
+import torch
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+def export_onnx(
+        module: torch.nn.Module,
+        args: Tuple,
+        path: str,
+        input_names: List[str],
+        output_names: List[str],
+        dynamic_axes: Dict[str, Dict[int, str]],
+        opset_version: int = 12
+):
+    """Export module to ONNX graph atomically.
+
+    Graph is written into temporary file and moved to the path, so other
+    processes never see partially written graph.
+
+    :param module: module to export
+    :param args: example inputs of module
+    :param path: path to save graph to
+    :param input_names: names of inputs
+    :param output_names: names of outputs
+    :param dynamic_axes: dynamic axes of inputs and outputs
+    :param opset_version: version of ONNX operator set
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    kwargs = {}
+    # newer versions of torch export by dynamo by default
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.onnx', dir=directory)
+    os.close(fd)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                module, args, tmp_path,
+                input_names=input_names,
+                output_names=output_names,
+                dynamic_axes=dynamic_axes,
+                opset_version=opset_version,
+                **kwargs
+            )
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def create_onnx_session(path: str, num_threads: int = 0):
+    """Create ONNX Runtime session on CPU.
+
+    :param path: path to ONNX graph
+    :param num_threads: number of intra-op and inter-op threads,
+        0 means the number of intra-op threads of torch
+
+    :returns: inference session
+    """
+    if onnxruntime is None:
+        raise ImportError(
+            'onnxruntime should be installed to use ONNX backend!'
+        )
+    # default of ONNX Runtime is all cores of the machine, which
+    # oversubscribes CPU, when several workers run inference
+    if num_threads == 0:
+        num_threads = torch.get_num_threads()
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = num_threads
+    options.inter_op_num_threads = num_threads
+    return onnxruntime.InferenceSession(
+        path, options, providers=['CPUExecutionProvider']
+    )
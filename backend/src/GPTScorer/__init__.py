@@ -1 +1,6 @@
 from .gpt_scorer_sentence import GPTScorerSentence
+from .causal_lm_head import causal_lm_log_probs
+from .causal_lm_backend import (
+    EagerCausalLMBackend, TorchScriptCausalLMBackend, OnnxCausalLMBackend,
+    create_causal_lm_backend
+)
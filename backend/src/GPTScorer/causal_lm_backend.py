@@ -0,0 +1,384 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import torch
+from transformers import GPT2LMHeadModel
+
+from src.Compilation import export_onnx, create_onnx_session
+from src.Scheduler import ShapeBuckets
+
+
+# names of available backends
+BACKENDS = ('eager', 'torchscript', 'onnx')
+
+
+class EagerCausalLMBackend:
+    """Class for running transformer of causal LM by eager modules.
+
+    It is the reference implementation for compiled backends.
+    """
+
+    def __init__(self, model: GPT2LMHeadModel):
+        """Init object.
+
+        :param model: GPT2 model for LM from transformers library
+        """
+        self.model = model
+
+    def __call__(
+            self,
+            input_ids: torch.Tensor,
+            attention_mask: torch.Tensor,
+            past_key_values: Optional[Tuple] = None,
+            use_cache: bool = False
+    ) -> Tuple[torch.Tensor, Optional[Tuple]]:
+        """Calculate hidden states of the last layer.
+
+        :param input_ids: token ids of the batch
+        :param attention_mask: attention mask of the batch
+            including cached tokens
+        :param past_key_values: cached keys and values of previous tokens
+        :param use_cache: return keys and values of all tokens
+
+        :returns: hidden states of shape batch_size x length x hidden_size
+            and cached keys and values if use_cache is True
+        """
+        outputs = self.model.transformer(
+            input_ids,
+            past_key_values=past_key_values,
+            attention_mask=attention_mask,
+            use_cache=use_cache,
+            return_dict=False
+        )
+        return outputs[0], outputs[1] if use_cache else None
+
+
+class _CausalLMEncoder(torch.nn.Module):
+    """Module with plain tensor inputs and outputs for compilation.
+
+    Keys and values are passed as flat list of tensors.
+    """
+
+    def __init__(self, model: GPT2LMHeadModel, use_cache: bool):
+        super().__init__()
+        self.transformer = model.transformer
+        self.use_cache = use_cache
+
+    def forward(self, input_ids, attention_mask, position_ids, *past):
+        past_key_values = None
+        if len(past) > 0:
+            past_key_values = tuple(
+                (past[i], past[i + 1]) for i in range(0, len(past), 2)
+            )
+        outputs = self.transformer(
+            input_ids,
+            past_key_values=past_key_values,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=self.use_cache,
+            return_dict=False
+        )
+        if not self.use_cache:
+            return outputs[0]
+        presents = tuple(x for layer in outputs[1] for x in layer)
+        return (outputs[0],) + presents
+
+
+class BucketedCausalLMBackend(EagerCausalLMBackend):
+    """Base class for compiled backends with inputs padded to buckets.
+
+    Cached tokens are padded too, so positions are passed explicitly
+    and padded keys and values are removed from the results.
+    """
+
+    def __init__(
+            self,
+            model: GPT2LMHeadModel,
+            max_length: int = 1024,
+            max_batch_size: int = 128
+    ):
+        """Init object.
+
+        :param model: GPT2 model for LM from transformers library
+        :param max_length: maximum length of input
+        :param max_batch_size: maximum size of bucket of rows
+        """
+        super().__init__(model)
+        self.max_positions = model.config.n_positions
+        self.length_buckets = ShapeBuckets.powers_of_two(
+            min(max_length, self.max_positions), min_size=16
+        )
+        self.batch_buckets = ShapeBuckets.powers_of_two(
+            max_batch_size, min_size=1
+        )
+        self.pad_token_id = model.config.eos_token_id or 0
+        self._encoders = {
+            use_cache: _CausalLMEncoder(model, use_cache).eval()
+            for use_cache in [False, True]
+        }
+
+    def __call__(
+            self,
+            input_ids: torch.Tensor,
+            attention_mask: torch.Tensor,
+            past_key_values: Optional[Tuple] = None,
+            use_cache: bool = False
+    ) -> Tuple[torch.Tensor, Optional[Tuple]]:
+        batch_size, length = input_ids.shape
+        past_length = 0
+        if past_key_values is not None:
+            past_length = past_key_values[0][0].size(2)
+
+        # find sizes of buckets, total length is limited by positions
+        padded_batch_size = self.batch_buckets(batch_size)
+        padded_past_length = (
+            self.length_buckets(past_length) if past_length > 0 else 0
+        )
+        padded_length = self.length_buckets(length)
+        if padded_past_length + padded_length > self.max_positions:
+            padded_past_length = past_length
+            padded_length = length
+
+        # pad tokens, cached tokens and attention mask
+        padded_input_ids = input_ids.new_full(
+            (padded_batch_size, padded_length), self.pad_token_id
+        )
+        padded_input_ids[:batch_size, :length] = input_ids
+        padded_attention_mask = attention_mask.new_zeros(
+            (padded_batch_size, padded_past_length + padded_length)
+        )
+        padded_attention_mask[:batch_size, :past_length] = (
+            attention_mask[:, :past_length]
+        )
+        padded_attention_mask[
+            :batch_size, padded_past_length:padded_past_length + length
+        ] = attention_mask[:, past_length:]
+        position_ids = torch.arange(
+            past_length, past_length + padded_length,
+            dtype=torch.long, device=input_ids.device
+        ).clamp(max=self.max_positions - 1)
+        position_ids = position_ids.unsqueeze(0).expand(
+            padded_batch_size, -1
+        )
+        padded_past = []
+        if past_key_values is not None:
+            for layer in past_key_values:
+                for tensor in layer:
+                    padded_tensor = tensor.new_zeros((
+                        padded_batch_size, tensor.size(1),
+                        padded_past_length, tensor.size(3)
+                    ))
+                    padded_tensor[:batch_size, :, :past_length] = tensor
+                    padded_past.append(padded_tensor)
+
+        outputs = self._run(
+            (
+                padded_input_ids, padded_attention_mask, position_ids,
+                *padded_past
+            ),
+            use_cache
+        )
+        hidden_states = outputs[0][:batch_size, :length]
+        if not use_cache:
+            return hidden_states, None
+
+        # remove padded tokens from keys and values
+        presents = []
+        for i in range(1, len(outputs), 2):
+            presents.append(tuple(
+                torch.cat([
+                    tensor[:batch_size, :, :past_length],
+                    tensor[
+                        :batch_size, :,
+                        padded_past_length:padded_past_length + length
+                    ]
+                ], dim=2)
+                for tensor in outputs[i:i + 2]
+            ))
+        return hidden_states, tuple(presents)
+
+    def _run(self, inputs: Tuple, use_cache: bool) -> Tuple:
+        """Run compiled graph on padded batch.
+
+        :param inputs: token ids, attention mask, positions
+            and flat list of cached keys and values
+        :param use_cache: return keys and values of all tokens
+
+        :returns: hidden states and flat list of keys and values
+        """
+        raise NotImplementedError
+
+
+class TorchScriptCausalLMBackend(BucketedCausalLMBackend):
+    """Class for running transformer of causal LM by frozen TorchScript.
+
+    Graph is traced once for each shape of bucket.
+    """
+
+    def __init__(
+            self,
+            model: GPT2LMHeadModel,
+            max_length: int = 1024,
+            max_batch_size: int = 128,
+            max_graphs: int = 32
+    ):
+        """Init object.
+
+        :param model: GPT2 model for LM from transformers library
+        :param max_length: maximum length of input
+        :param max_batch_size: maximum size of bucket of rows
+        :param max_graphs: maximum number of kept traced graphs
+        """
+        super().__init__(model, max_length, max_batch_size)
+        self.max_graphs = max_graphs
+        self._graphs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _run(self, inputs, use_cache):
+        key = (
+            tuple(inputs[0].shape), tuple(inputs[1].shape),
+            len(inputs), use_cache, str(inputs[0].device)
+        )
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is None:
+                with torch.no_grad():
+                    graph = torch.jit.freeze(torch.jit.trace(
+                        self._encoders[use_cache], inputs, check_trace=False
+                    ))
+                self._graphs[key] = graph
+                while len(self._graphs) > self.max_graphs:
+                    self._graphs.popitem(last=False)
+            else:
+                self._graphs.move_to_end(key)
+        outputs = graph(*inputs)
+        return outputs if use_cache else (outputs,)
+
+
+class OnnxCausalLMBackend(BucketedCausalLMBackend):
+    """Class for running transformer of causal LM by ONNX Runtime.
+
+    One graph with dynamic shapes is exported for each combination
+    of presence of cached tokens and returning of keys and values.
+    """
+
+    def __init__(
+            self,
+            model: GPT2LMHeadModel,
+            export_dir: str,
+            max_length: int = 1024,
+            max_batch_size: int = 128,
+            num_threads: int = 0
+    ):
+        """Init object.
+
+        :param model: GPT2 model for LM from transformers library
+        :param export_dir: directory of ONNX graphs, they are exported
+            if absent
+        :param max_length: maximum length of input
+        :param max_batch_size: maximum size of bucket of rows
+        :param num_threads: number of threads of ONNX Runtime,
+            0 means the number of threads of torch
+        """
+        super().__init__(model, max_length, max_batch_size)
+        self.export_dir = export_dir
+        self.num_threads = num_threads
+        self.num_layers = model.config.n_layer
+        self.num_heads = model.config.n_head
+        self.head_size = model.config.n_embd // model.config.n_head
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _get_session(self, has_past: bool, use_cache: bool):
+        """Get session of graph, export graph if it doesn't exist."""
+        key = (has_past, use_cache)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                return session
+
+            path = os.path.join(
+                self.export_dir,
+                f'causal_lm_past{int(has_past)}_cache{int(use_cache)}.onnx'
+            )
+            if not os.path.exists(path):
+                self._export(path, has_past, use_cache)
+            session = create_onnx_session(path, self.num_threads)
+            self._sessions[key] = session
+            return session
+
+    def _names(self, has_past: bool, use_cache: bool):
+        """Get names of inputs and outputs of graph."""
+        input_names = ['input_ids', 'attention_mask', 'position_ids']
+        output_names = ['hidden_states']
+        for i in range(self.num_layers):
+            if has_past:
+                input_names += [f'past_key_{i}', f'past_value_{i}']
+            if use_cache:
+                output_names += [f'present_key_{i}', f'present_value_{i}']
+        return input_names, output_names
+
+    def _export(self, path: str, has_past: bool, use_cache: bool):
+        """Export graph with dynamic shapes."""
+        input_names, output_names = self._names(has_past, use_cache)
+        past_length = 4 if has_past else 0
+        example = [
+            torch.ones((1, 8), dtype=torch.long),
+            torch.ones((1, past_length + 8), dtype=torch.long),
+            torch.arange(past_length, past_length + 8).unsqueeze(0)
+        ]
+        example += [
+            torch.zeros((1, self.num_heads, past_length, self.head_size))
+            for _ in input_names[3:]
+        ]
+
+        dynamic_axes = {
+            'input_ids': {0: 'batch', 1: 'length'},
+            'attention_mask': {0: 'batch', 1: 'total_length'},
+            'position_ids': {0: 'batch', 1: 'length'},
+            'hidden_states': {0: 'batch', 1: 'length'}
+        }
+        for name in input_names[3:]:
+            dynamic_axes[name] = {0: 'batch', 2: 'past_length'}
+        for name in output_names[1:]:
+            dynamic_axes[name] = {0: 'batch', 2: 'total_length'}
+        export_onnx(
+            self._encoders[use_cache], tuple(example), path,
+            input_names=input_names, output_names=output_names,
+            dynamic_axes=dynamic_axes
+        )
+
+    def _run(self, inputs, use_cache):
+        has_past = len(inputs) > 3
+        session = self._get_session(has_past, use_cache)
+        input_names, output_names = self._names(has_past, use_cache)
+        outputs = session.run(output_names, {
+            name: tensor.cpu().contiguous().numpy()
+            for name, tensor in zip(input_names, inputs)
+        })
+        device = inputs[0].device
+        return tuple(torch.from_numpy(x).to(device) for x in outputs)
+
+
+def create_causal_lm_backend(
+        model: GPT2LMHeadModel, backend: str = 'eager', **kwargs
+) -> EagerCausalLMBackend:
+    """Create backend to run transformer of causal LM.
+
+    :param model: GPT2 model for LM from transformers library
+    :param backend: one of 'eager', 'torchscript' and 'onnx'
+    :param kwargs: arguments of backend class
+
+    :returns: created backend
+    """
+    if backend == 'eager':
+        return EagerCausalLMBackend(model)
+    if backend == 'torchscript':
+        return TorchScriptCausalLMBackend(model, **kwargs)
+    if backend == 'onnx':
+        return OnnxCausalLMBackend(model, **kwargs)
+    raise ValueError(
+        f'Unknown backend: {backend}, use one of {", ".join(BACKENDS)}'
+    )
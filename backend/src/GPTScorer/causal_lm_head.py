@@ -0,0 +1,85 @@
+from typing import Callable, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from transformers import GPT2LMHeadModel
+
+from .causal_lm_backend import EagerCausalLMBackend
+
+
+def causal_lm_log_probs(
+        model: GPT2LMHeadModel,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        targets: torch.Tensor,
+        target_mask: torch.Tensor,
+        last_positions: Optional[torch.Tensor] = None,
+        past_key_values: Optional[Tuple] = None,
+        use_cache: bool = False,
+        target_only_head: bool = True,
+        chunk_size: int = 256,
+        backend: Optional[Callable] = None
+) -> Tuple[torch.Tensor, Optional[torch.Tensor], Optional[Tuple]]:
+    """Calculate log probabilities of target tokens of causal LM.
+
+    :param model: GPT2 model for LM from transformers library
+    :param input_ids: token ids of the batch
+    :param attention_mask: attention mask of the batch
+        including cached tokens
+    :param targets: token, that should be predicted at each position
+    :param target_mask: positions, where targets should be scored
+    :param last_positions: position of each row to return full
+        distribution of the next token for, no distribution if None
+    :param past_key_values: cached keys and values of previous tokens
+    :param use_cache: return keys and values of all tokens
+    :param target_only_head: apply output projection only at the target
+        and last positions instead of all positions of the batch
+    :param chunk_size: number of positions to project at once
+    :param backend: backend to calculate hidden states of transformer,
+        eager modules are used if None
+
+    :returns: log probabilities of targets with zeros at other positions,
+        log probabilities of the next token at last positions
+        and cached keys and values if use_cache is True
+    """
+    if backend is None:
+        backend = EagerCausalLMBackend(model)
+    hidden_states, past = backend(
+        input_ids, attention_mask,
+        past_key_values=past_key_values, use_cache=use_cache
+    )
+    if target_only_head:
+        head = model.lm_head
+    else:
+        # project all positions at once
+        hidden_states = model.lm_head(hidden_states)
+        head = torch.nn.Identity()
+
+    # project only selected positions by chunks to limit memory
+    target_mask = target_mask.to(hidden_states.device)
+    selected_states = hidden_states[target_mask]
+    selected_targets = targets.to(hidden_states.device)[target_mask]
+    selected_log_probs = []
+    for start_idx in range(0, selected_states.size(0), chunk_size):
+        end_idx = start_idx + chunk_size
+        log_probs = F.log_softmax(
+            head(selected_states[start_idx:end_idx]).float(), dim=-1
+        )
+        selected_log_probs.append(log_probs.gather(
+            -1, selected_targets[start_idx:end_idx, None]
+        ).squeeze(-1))
+    token_log_probs = torch.zeros(target_mask.shape, dtype=torch.float)
+    if len(selected_log_probs) > 0:
+        token_log_probs[target_mask.cpu()] = torch.cat(
+            selected_log_probs
+        ).cpu()
+
+    last_log_probs = None
+    if last_positions is not None:
+        rows = torch.arange(input_ids.size(0), device=hidden_states.device)
+        last_log_probs = F.log_softmax(
+            head(hidden_states[rows, last_positions.to(rows.device)]).float(),
+            dim=-1
+        ).cpu()
+
+    return token_log_probs, last_log_probs, past
@@ -1,9 +1,14 @@
-from typing import List
+from typing import Callable, List, Dict, Optional
 
 import torch
 from transformers.tokenization_utils import PreTrainedTokenizer
 from transformers import GPT2LMHeadModel
 
+from src.Metrics import observe_batch, scorer_rows
+from src.Scheduler import TokenBudgetScheduler
+from src.Timing import timed_stage
+from .causal_lm_head import causal_lm_log_probs
+
 
 class GPTScorerSentence:
     """Class for scoring all candidates for correction by GPT2 model."""
@@ -13,19 +18,43 @@ class GPTScorerSentence:
             model: GPT2LMHeadModel,
             tokenizer: PreTrainedTokenizer,
             max_length: int = 1024,
+            stride: int = 512,
+            max_batch_tokens: int = 2048,
+            prefix_cache: bool = True,
+            candidate_trie: bool = True,
+            target_only_head: bool = True,
+            backend: Optional[Callable] = None,
             device: int = -1
     ):
         """Init object.
 
-        :param model: Bert model for MLM from transformers library
-        :param tokenizer: tokenizer for Bert model
+        :param model: GPT2 model for LM from transformers library
+        :param tokenizer: tokenizer for GPT2 model
         :param max_length: maximum number of tokens to process
+        :param stride: step of sliding window for long sentences
+        :param max_batch_tokens: maximum number of tokens in padded batch
+        :param prefix_cache: encode tokens before the gap once and reuse
+            their keys and values for all candidates of the gap
+        :param candidate_trie: process tokens shared by several candidates
+            once, works only with prefix cache
+        :param target_only_head: apply output projection only at positions,
+            where tokens are scored
+        :param backend: backend to run transformer, eager modules if None
         :param device: id of device
         """
         self.device = torch.device('cpu' if device < 0 else f'cuda:{device}')
         self.model = model.to(device=self.device)
         self.tokenizer = tokenizer
         self.max_length = max_length
+        self.stride = stride
+        self.max_batch_tokens = max_batch_tokens
+        self.prefix_cache = prefix_cache
+        self.candidate_trie = candidate_trie
+        self.target_only_head = target_only_head
+        self.backend = backend
+        self.scheduler = TokenBudgetScheduler(
+            max_batch_tokens=max_batch_tokens
+        )
 
     def __call__(
             self, sentences: List[str]
@@ -36,42 +65,434 @@ class GPTScorerSentence:
 
         :returns: scores for each sentence
         """
-        results = []
-        for sentence in sentences:
-            results.append(self._score_sentence(sentence))
+        input_ids = self.tokenizer(
+            sentences,
+            add_special_tokens=True,
+            truncation='do_not_truncate',
+        )['input_ids']
+        return self._score_input_ids(input_ids)
+
+    def score_tokenized(
+            self, input_ids: List[List[int]], gap_indexes: List[int],
+            candidates: List[List[List[int]]],
+            priorities: Optional[List[int]] = None,
+            on_gap_scored: Optional[Callable] = None
+    ) -> List[List[float]]:
+        """Make scoring for tokenized candidates for every sentence.
+
+        :param input_ids: token ids of sentences
+        :param gap_indexes: index of the gap token in each sentence,
+            that should be replaced by candidates
+        :param candidates: token ids of candidates to score
+            for each sentence
+        :param priorities: priority of each sentence, sentences with
+            lower priority are scored earlier, order by length if None
+        :param on_gap_scored: function to call with index of sentence
+            and its results as soon as all its candidates are scored
+
+        :returns: perplexity of the sentence with each candidate
+            for each sentence
+        """
+        scorer_rows.observe(sum(len(x) for x in candidates), model='gpt')
+        prefixes = []
+        continuations = []
+        for sentence_input_ids, gap_index, sentence_candidates in zip(
+                input_ids, gap_indexes, candidates
+        ):
+            prefixes.append(sentence_input_ids[:gap_index])
+            continuations.append([
+                candidate + sentence_input_ids[gap_index + 1:]
+                for candidate in sentence_candidates
+            ])
+        return self._score_gaps(
+            prefixes, continuations, priorities, on_gap_scored
+        )
+
+    def _score_gaps(
+            self, prefixes: List[List[int]],
+            continuations: List[List[List[int]]],
+            priorities: Optional[List[int]] = None,
+            on_gap_scored: Optional[Callable] = None
+    ) -> List[List[float]]:
+        """Make scoring for all candidates of all gaps.
+
+        Hypothesis for each candidate is the prefix of its gap followed
+        by the continuation, that is tokens of the candidate and tokens
+        after the gap.
+
+        :param prefixes: token ids before each gap
+        :param continuations: token ids after the prefix
+            for each candidate of each gap
+        :param priorities: priority of each gap, lower is scored earlier
+        :param on_gap_scored: function to call with index of gap
+            and its results as soon as they are ready
+
+        :returns: perplexity of each hypothesis for each gap
+        """
+        results = [[0.0] * len(x) for x in continuations]
+
+        # prefix can be reused only if hypotheses fit in the first window,
+        # longer ones are scored by sliding windows with their loss weights
+        max_cached_length = min(self.stride, self.max_length)
+        cached_gaps = []
+        window_hypotheses = []
+        for gap_idx, (prefix, gap_continuations) in enumerate(
+                zip(prefixes, continuations)
+        ):
+            is_cached = self.prefix_cache and len(prefix) > 0 and all(
+                len(prefix) + len(x) <= max_cached_length
+                for x in gap_continuations
+            )
+            if is_cached:
+                cached_gaps.append(gap_idx)
+                continue
+            for candidate_idx, continuation in enumerate(gap_continuations):
+                window_hypotheses.append(
+                    (gap_idx, candidate_idx, prefix + continuation)
+                )
+
+        # windows of all too long hypotheses are scored together
+        if len(window_hypotheses) > 0:
+            perplexities = self._score_input_ids(
+                [x[2] for x in window_hypotheses]
+            )
+            for (gap_idx, candidate_idx, _), perplexity in zip(
+                    window_hypotheses, perplexities
+            ):
+                results[gap_idx][candidate_idx] = perplexity
+        if on_gap_scored is not None:
+            cached_gaps_set = set(cached_gaps)
+            for gap_idx in range(len(continuations)):
+                if gap_idx not in cached_gaps_set:
+                    on_gap_scored(gap_idx, results[gap_idx])
+
+        if len(cached_gaps) > 0:
+            self._score_cached_gaps(
+                prefixes, continuations, cached_gaps, results,
+                priorities, on_gap_scored
+            )
 
         return results
 
-    def _score_sentence(self, sentence: str, stride=512) -> float:
-        """Calculate perplexity for each sentence.
+    def _score_input_ids(self, input_ids: List[List[int]]) -> List[float]:
+        """Calculate perplexity for tokenized sentences.
 
-        :param sentence: sentence to check
+        :param input_ids: tokenized sentences
 
-        :returns: perplexity of the sentence
+        :returns: perplexity of each sentence
         """
-        model_input = self.tokenizer(
-            sentence,
-            add_special_tokens=True,
-            truncation='do_not_truncate',
-            return_tensors='pt'
+        # split sentences into windows and score all of them together
+        windows = self._create_windows(input_ids)
+        nlls = [0.0] * len(input_ids)
+        lengths = [x['end'] - x['begin'] for x in windows]
+        for batch_indices in self.scheduler(lengths):
+            batch_windows = [windows[idx] for idx in batch_indices]
+            batch_nlls = self._score_batch(input_ids, batch_windows)
+            for window, nll in zip(batch_windows, batch_nlls):
+                nlls[window['sentence']] += nll
+
+        # calculate perplexity for each sentence
+        return [
+            torch.exp(torch.tensor(nll) / len(sentence_input_ids)).item()
+            for nll, sentence_input_ids in zip(nlls, input_ids)
+        ]
+
+    def _create_windows(self, input_ids: List[List[int]]) -> List[Dict]:
+        """Split each sentence into sliding windows.
+
+        Each window has the context of maximum length and scores only
+        tokens, that weren't scored by the previous window.
+
+        :param input_ids: tokenized sentences
+
+        :returns: list of windows for all sentences
+        """
+        windows = []
+        for sentence_idx, sentence_input_ids in enumerate(input_ids):
+            for i in range(0, len(sentence_input_ids), self.stride):
+                begin_loc = max(i + self.stride - self.max_length, 0)
+                end_loc = min(i + self.stride, len(sentence_input_ids))
+                windows.append({
+                    'sentence': sentence_idx,
+                    'begin': begin_loc,
+                    'end': end_loc,
+                    # may be different from stride on last loop
+                    'target_length': end_loc - i
+                })
+        return windows
+
+    def _score_batch(
+            self, input_ids: List[List[int]], windows: List[Dict]
+    ) -> List[float]:
+        """Calculate negative log likelihood of windows.
+
+        For each window mean loss over its target tokens is multiplied
+        by the number of target tokens.
+
+        :param input_ids: tokenized sentences
+        :param windows: windows to score
+
+        :returns: negative log likelihood of each window
+        """
+        lengths = torch.tensor(
+            [x['end'] - x['begin'] for x in windows], dtype=torch.long
+        )
+        target_lengths = torch.tensor(
+            [x['target_length'] for x in windows], dtype=torch.long
         )
+        max_len = int(lengths.max())
 
-        lls = []
-        for i in range(0, model_input['input_ids'].size(1), stride):
-            begin_loc = max(i + stride - self.max_length, 0)
-            end_loc = min(i + stride, model_input['input_ids'].size(1))
-            trg_len = end_loc - i  # may be different from stride on last loop
-            input_ids = model_input['input_ids'][:, begin_loc:end_loc].to(
-                self.device
+        # pad windows from the right, so positions of tokens don't change
+        batch_input_ids = torch.full(
+            (len(windows), max_len), self.tokenizer.eos_token_id,
+            dtype=torch.long
+        )
+        for i, window in enumerate(windows):
+            batch_input_ids[i, :lengths[i]] = torch.tensor(
+                input_ids[window['sentence']][window['begin']:window['end']],
+                dtype=torch.long
+            )
+        positions = torch.arange(max_len, dtype=torch.long)[None, :]
+        attention_mask = (positions < lengths[:, None]).long()
+
+        # each position predicts the next token,
+        # only target tokens give loss
+        targets = torch.roll(batch_input_ids, -1, dims=1)
+        target_mask = (
+            (positions + 1 >= (lengths - target_lengths)[:, None])
+            & (positions + 1 < lengths[:, None])
+        )
+
+        with torch.no_grad(), timed_stage('forward'):
+            token_log_probs, _, _ = causal_lm_log_probs(
+                self.model,
+                batch_input_ids.to(self.device),
+                attention_mask.to(self.device),
+                targets, target_mask,
+                target_only_head=self.target_only_head,
+                backend=self.backend
+            )
+        observe_batch(
+            'gpt', len(windows), batch_input_ids.numel(), int(lengths.sum())
+        )
+
+        nlls = -token_log_probs.sum(dim=-1)
+        mean_nlls = nlls / target_mask.sum(dim=-1).clamp(min=1)
+        return (mean_nlls * target_lengths).tolist()
+
+    def _score_cached_gaps(
+            self, prefixes: List[List[int]],
+            continuations: List[List[List[int]]],
+            gaps: List[int], results: List[List[float]],
+            priorities: Optional[List[int]] = None,
+            on_gap_scored: Optional[Callable] = None
+    ):
+        """Calculate perplexity of hypotheses reusing encoded prefixes.
+
+        Negative log likelihood of hypothesis is a sum of likelihood of
+        the prefix, which is calculated once per gap, and likelihood of
+        the continuation given the prefix.
+
+        :param prefixes: token ids before each gap
+        :param continuations: token ids after the prefix
+            for each candidate of each gap
+        :param gaps: indices of gaps to process
+        :param results: perplexities to fill for processed gaps
+        :param priorities: priority of each gap, lower is scored earlier
+        :param on_gap_scored: function to call with index of gap
+            and its results as soon as they are ready
+        """
+        prefix_lengths = [len(prefixes[gap_idx]) for gap_idx in gaps]
+        gap_priorities = None
+        if priorities is not None:
+            gap_priorities = [priorities[gap_idx] for gap_idx in gaps]
+        for batch_positions in self.scheduler(prefix_lengths, gap_priorities):
+            batch_gaps = [gaps[pos] for pos in batch_positions]
+            prefix_states = self._extend_state(
+                self._empty_state(),
+                [prefixes[gap_idx] for gap_idx in batch_gaps],
+                use_cache=True
+            )
+            for gap_idx, prefix_state in zip(batch_gaps, prefix_states):
+                gap_continuations = continuations[gap_idx]
+                nlls = [0.0] * len(gap_continuations)
+                self._score_branch(
+                    prefix_state, gap_continuations,
+                    list(range(len(gap_continuations))), 0, nlls
+                )
+                for idx, nll in enumerate(nlls):
+                    # the first token of hypothesis isn't predicted
+                    num_targets = max(
+                        prefix_state['length'] + len(gap_continuations[idx])
+                        - 1, 1
+                    )
+                    results[gap_idx][idx] = torch.exp(
+                        torch.tensor(nll) / num_targets
+                    ).item()
+                if on_gap_scored is not None:
+                    on_gap_scored(gap_idx, results[gap_idx])
+
+    def _score_branch(
+            self, state: Dict, sequences: List[List[int]],
+            indices: List[int], offset: int, nlls: List[float]
+    ):
+        """Calculate negative log likelihood of sequences from the state.
+
+        Sequences are walked as a trie: tokens shared by several sequences
+        are processed once and their keys and values are reused,
+        so the model runs separately only where the sequences diverge.
+
+        :param state: state after the shared tokens of the sequences
+        :param sequences: all token sequences of the gap
+        :param indices: indices of sequences, that share first
+            `offset` tokens
+        :param offset: number of tokens already processed
+        :param nlls: negative log likelihood to fill for each sequence
+        """
+        # group sequences by their next token
+        groups = {}
+        for idx in indices:
+            if len(sequences[idx]) == offset:
+                # nothing left to process
+                nlls[idx] = state['nll']
+            else:
+                groups.setdefault(sequences[idx][offset], []).append(idx)
+
+        leaves = []
+        branches = []
+        for group in groups.values():
+            if len(group) == 1 or not self.candidate_trie:
+                leaves += group
+                continue
+            # find tokens shared by all sequences of the group
+            shared_length = 1
+            max_shared_length = min(len(sequences[idx]) for idx in group)
+            while shared_length < max_shared_length and len(set(
+                    sequences[idx][offset + shared_length] for idx in group
+            )) == 1:
+                shared_length += 1
+            branches.append((group, shared_length))
+
+        # process rest of each single sequence without keeping cache
+        lengths = [
+            state['length'] + len(sequences[idx]) - offset for idx in leaves
+        ]
+        for batch_positions in self.scheduler(lengths):
+            batch_leaves = [leaves[pos] for pos in batch_positions]
+            new_states = self._extend_state(
+                state,
+                [sequences[idx][offset:] for idx in batch_leaves],
+                use_cache=False
             )
-            target_ids = input_ids.clone()
-            target_ids[:, :-trg_len] = -100
+            for idx, new_state in zip(batch_leaves, new_states):
+                nlls[idx] = new_state['nll']
+
+        # process shared tokens of each branch once and go deeper
+        lengths = [
+            state['length'] + shared_length for _, shared_length in branches
+        ]
+        for batch_positions in self.scheduler(lengths):
+            batch_branches = [branches[pos] for pos in batch_positions]
+            new_states = self._extend_state(
+                state,
+                [sequences[group[0]][offset:offset + shared_length]
+                 for group, shared_length in batch_branches],
+                use_cache=True
+            )
+            for (group, shared_length), new_state in zip(
+                    batch_branches, new_states
+            ):
+                self._score_branch(
+                    new_state, sequences, group, offset + shared_length, nlls
+                )
+
+    @staticmethod
+    def _empty_state() -> Dict:
+        """Create state before the first token."""
+        return {'past': None, 'length': 0, 'log_probs': None, 'nll': 0.0}
+
+    def _extend_state(
+            self, state: Dict, sequences: List[List[int]], use_cache: bool
+    ) -> List[Dict]:
+        """Run model on token sequences continuing the state.
+
+        State keeps cached keys and values of processed tokens,
+        number of these tokens, log probabilities of the next token and
+        negative log likelihood of processed tokens.
 
-            with torch.no_grad():
-                outputs = self.model(input_ids, labels=target_ids)
-                log_likelihood = outputs[0] * trg_len
+        :param state: state to continue
+        :param sequences: non-empty token ids to process
+        :param use_cache: keep keys and values and distribution
+            of the next token in the new states
 
-            lls.append(log_likelihood)
+        :returns: state after each sequence
+        """
+        past_length = state['length']
+        lengths = torch.tensor([len(x) for x in sequences], dtype=torch.long)
+        max_len = int(lengths.max())
+        input_ids = torch.full(
+            (len(sequences), max_len), self.tokenizer.eos_token_id,
+            dtype=torch.long
+        )
+        for i, sequence in enumerate(sequences):
+            input_ids[i, :lengths[i]] = torch.tensor(
+                sequence, dtype=torch.long
+            )
+        positions = torch.arange(max_len, dtype=torch.long)[None, :]
+        attention_mask = torch.cat([
+            torch.ones((len(sequences), past_length), dtype=torch.long),
+            (positions < lengths[:, None]).long()
+        ], dim=1)
+
+        past = None
+        if state['past'] is not None:
+            # the same keys and values are shared without copying
+            past = tuple(
+                (layer_past[0].expand(len(sequences), -1, -1, -1),
+                 layer_past[1].expand(len(sequences), -1, -1, -1))
+                for layer_past in state['past']
+            )
+
+        # each position predicts the next token of the sequence,
+        # distribution after the sequence is needed only to continue it
+        targets = torch.roll(input_ids, -1, dims=1)
+        target_mask = positions + 1 < lengths[:, None]
+        with torch.no_grad(), timed_stage('forward'):
+            token_log_probs, last_log_probs, new_past = causal_lm_log_probs(
+                self.model,
+                input_ids.to(self.device),
+                attention_mask.to(self.device),
+                targets, target_mask,
+                last_positions=lengths - 1 if use_cache else None,
+                past_key_values=past,
+                use_cache=use_cache,
+                target_only_head=self.target_only_head,
+                backend=self.backend
+            )
+        observe_batch(
+            'gpt', len(sequences), input_ids.numel(), int(lengths.sum())
+        )
+        nlls = -token_log_probs.sum(dim=-1)
 
-        ppl = torch.exp(torch.stack(lls).sum() / end_loc).item()
-        return ppl
+        new_states = []
+        for i in range(len(sequences)):
+            nll = state['nll'] + nlls[i].item()
+            # the first token is predicted by the state
+            if state['log_probs'] is not None:
+                nll -= state['log_probs'][input_ids[i, 0]].item()
+            new_state = {
+                'past': None,
+                'length': past_length + int(lengths[i]),
+                'log_probs': None,
+                'nll': nll
+            }
+            if use_cache:
+                new_state['log_probs'] = last_log_probs[i]
+                # drop padding from keys and values
+                new_state['past'] = tuple(
+                    (layer_past[0][i:i+1, :, :new_state['length']],
+                     layer_past[1][i:i+1, :, :new_state['length']])
+                    for layer_past in new_past
+                )
+            new_states.append(new_state)
+        return new_states
@@ -0,0 +1,5 @@
+from .metrics import Counter, Histogram, MetricsRegistry
+from .pipeline_metrics import (
+    metrics, stage_seconds, scorer_rows, batch_rows, batch_padded_tokens,
+    batch_tokens, micro_batch_calls, solve_requests, observe_batch
+)
@@ -0,0 +1,200 @@
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+class _Metric:
+    """Base class for metric with values for each set of labels."""
+
+    type_name = ''
+
+    def __init__(
+            self, name: str, documentation: str,
+            labelnames: Sequence[str] = ()
+    ):
+        """Init object.
+
+        :param name: name of metric
+        :param documentation: description of metric
+        :param labelnames: names of labels of metric
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        """Get values of labels in order of their names."""
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(
+            self, key: Tuple, const_labels: Sequence[Tuple] = (),
+            extra: Optional[Tuple] = None
+    ) -> str:
+        """Format labels of sample in text exposition format."""
+        pairs = list(const_labels) + list(zip(self.labelnames, key))
+        if extra is not None:
+            pairs.append(extra)
+        if len(pairs) == 0:
+            return ''
+        return '{' + ','.join(
+            f'{name}="{value}"' for name, value in pairs
+        ) + '}'
+
+    def samples(self, const_labels: Sequence[Tuple] = ()) -> List[str]:
+        """Get lines of samples in text exposition format.
+
+        :param const_labels: names and values of labels of all samples
+        """
+        raise NotImplementedError
+
+    def render(self, const_labels: Sequence[Tuple] = ()) -> str:
+        """Get metric in text exposition format.
+
+        :param const_labels: names and values of labels of all samples
+        """
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type_name}'
+        ]
+        return '\n'.join(lines + self.samples(const_labels))
+
+
+class Counter(_Metric):
+    """Metric, that only grows."""
+
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        """Increase counter.
+
+        :param amount: value to add
+        :param labels: values of labels
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self, const_labels: Sequence[Tuple] = ()) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f'{self.name}{self._format_labels(key, const_labels)} {value}'
+            for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    """Metric, that counts observations falling into buckets."""
+
+    type_name = 'histogram'
+
+    def __init__(
+            self, name: str, documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = (
+                0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+            )
+    ):
+        """Init object.
+
+        :param name: name of metric
+        :param documentation: description of metric
+        :param labelnames: names of labels of metric
+        :param buckets: upper bounds of buckets, +Inf is added
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = sorted(buckets) + [math.inf]
+
+    def observe(self, value: float, **labels):
+        """Add observation.
+
+        :param value: observed value
+        :param labels: values of labels
+        """
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * len(self.buckets), 0.0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+
+    def samples(self, const_labels: Sequence[Tuple] = ()) -> List[str]:
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            )
+        lines = []
+        for key, (counts, total) in values:
+            labels = self._format_labels(key, const_labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bound_label = '+Inf' if math.isinf(bound) else f'{bound}'
+                bucket_labels = self._format_labels(
+                    key, const_labels, ('le', bound_label)
+                )
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """Class for collecting metrics of the process.
+
+    Values are kept in memory of the process, so each forked worker
+    exports only its own values. With process_label every sample gets
+    label with id of the process, and series of workers don't mix.
+    """
+
+    def __init__(self, process_label: Optional[str] = None):
+        """Init object.
+
+        :param process_label: name of label with id of the process,
+            no such label if None
+        """
+        self.process_label = process_label
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def counter(
+            self, name: str, documentation: str,
+            labelnames: Sequence[str] = ()
+    ) -> Counter:
+        """Create and register counter."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+            self, name: str, documentation: str,
+            labelnames: Sequence[str] = (), **kwargs
+    ) -> Histogram:
+        """Create and register histogram."""
+        return self._register(
+            Histogram(name, documentation, labelnames, **kwargs)
+        )
+
+    def _register(self, metric: _Metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Get all metrics in Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        const_labels = []
+        if self.process_label is not None:
+            # id is taken on render, because metrics are created before fork
+            const_labels.append((self.process_label, str(os.getpid())))
+        return '\n'.join(
+            metric.render(const_labels) for metric in metrics
+        ) + '\n'
@@ -0,0 +1,61 @@
+from .metrics import MetricsRegistry
+
+# each gunicorn worker exports its own series labeled by pid
+metrics = MetricsRegistry(process_label='pid')
+
+stage_seconds = metrics.histogram(
+    'choose_word_stage_seconds',
+    'Time spent in stage of solving pipeline.',
+    ['stage'],
+    buckets=(
+        0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+        0.1, 0.25, 0.5, 1, 2.5, 5, 10
+    )
+)
+scorer_rows = metrics.histogram(
+    'choose_word_scorer_rows',
+    'Number of rows scored by one call of scorer.',
+    ['model'],
+    buckets=(1, 4, 16, 64, 256, 1024, 4096)
+)
+batch_rows = metrics.histogram(
+    'choose_word_batch_rows',
+    'Number of rows in one forward pass.',
+    ['model'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+batch_padded_tokens = metrics.histogram(
+    'choose_word_batch_padded_tokens',
+    'Number of tokens in one forward pass including padding.',
+    ['model'],
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+)
+batch_tokens = metrics.counter(
+    'choose_word_batch_tokens_total',
+    'Number of tokens passed through model by kind: real or padding.',
+    ['model', 'kind']
+)
+micro_batch_calls = metrics.histogram(
+    'choose_word_micro_batch_calls',
+    'Number of calls merged into one flush of micro-batcher.',
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+solve_requests = metrics.counter(
+    'choose_word_requests_total',
+    'Number of requests to solving endpoints by name of url and status.',
+    ['view', 'status']
+)
+
+
+def observe_batch(model: str, rows: int, padded_tokens: int, tokens: int):
+    """Record shape of forward pass.
+
+    :param model: name of model
+    :param rows: number of rows in batch
+    :param padded_tokens: number of tokens including padding
+    :param tokens: number of real tokens
+    """
+    batch_rows.observe(rows, model=model)
+    batch_padded_tokens.observe(padded_tokens, model=model)
+    batch_tokens.inc(tokens, model=model, kind='real')
+    batch_tokens.inc(padded_tokens - tokens, model=model, kind='padding')
@@ -0,0 +1,3 @@
+from .mmap_weights import (
+    save_mmap_weights, has_mmap_weights, load_mmap_weights, build_mmap_model
+)
@@ -0,0 +1,155 @@
+import json
+import os
+from contextlib import contextmanager
+from typing import Dict
+
+import numpy as np
+import torch
+from transformers import PreTrainedModel
+
+
+# names of files with flat weights and their index
+DATA_FILE_NAME = 'weights.mmap'
+INDEX_FILE_NAME = 'weights.json'
+# alignment of each tensor in bytes
+ALIGNMENT = 64
+
+
+def save_mmap_weights(model: PreTrainedModel, path: str):
+    """Save weights of model into flat memory-mappable file.
+
+    Tensors sharing the same memory (tied weights) are saved once.
+
+    :param model: model to save weights of
+    :param path: directory to save files to
+    """
+    tensors = {}
+    aliases = {}
+    seen = {}
+    offset = 0
+    data_path = os.path.join(path, DATA_FILE_NAME)
+    with open(data_path, 'wb') as outf:
+        for name, tensor in model.state_dict().items():
+            key = (
+                tensor.data_ptr(), tuple(tensor.shape),
+                tuple(tensor.stride()), str(tensor.dtype)
+            )
+            if tensor.numel() > 0 and key in seen:
+                aliases[name] = seen[key]
+                continue
+            seen[key] = name
+
+            array = tensor.detach().cpu().contiguous().numpy()
+            padding = -offset % ALIGNMENT
+            outf.write(b'\0' * padding)
+            offset += padding
+            tensors[name] = {
+                'dtype': array.dtype.str,
+                'shape': list(array.shape),
+                'offset': offset
+            }
+            outf.write(array.tobytes())
+            offset += array.nbytes
+
+    index = {'tensors': tensors, 'aliases': aliases}
+    with open(os.path.join(path, INDEX_FILE_NAME), 'w') as outf:
+        json.dump(index, outf, indent=2)
+
+
+def has_mmap_weights(path: str) -> bool:
+    """Check that weights in directory are converted to flat file.
+
+    :param path: directory with model
+
+    :returns: whether both files of weights exist
+    """
+    return (
+        os.path.exists(os.path.join(path, DATA_FILE_NAME))
+        and os.path.exists(os.path.join(path, INDEX_FILE_NAME))
+    )
+
+
+def load_mmap_weights(path: str) -> Dict[str, torch.Tensor]:
+    """Load weights from flat file without copying them into memory.
+
+    Tensors share pages of the file with other processes until they
+    are modified (copy-on-write).
+
+    :param path: directory with files of weights
+
+    :returns: state dict of model
+    """
+    with open(os.path.join(path, INDEX_FILE_NAME), 'r') as inf:
+        index = json.load(inf)
+    buffer = np.memmap(
+        os.path.join(path, DATA_FILE_NAME), dtype=np.uint8, mode='c'
+    )
+
+    state_dict = {}
+    for name, info in index['tensors'].items():
+        dtype = np.dtype(info['dtype'])
+        nbytes = int(np.prod(info['shape'])) * dtype.itemsize
+        array = buffer[info['offset']:info['offset'] + nbytes].view(dtype)
+        state_dict[name] = torch.from_numpy(array.reshape(info['shape']))
+    for name, target in index['aliases'].items():
+        state_dict[name] = state_dict[target]
+    return state_dict
+
+
+@contextmanager
+def _skip_init(model_class):
+    """Skip random initialization of weights, that are replaced anyway."""
+    init_names = [
+        'normal_', 'uniform_', 'kaiming_uniform_', 'ones_', 'zeros_'
+    ]
+    saved_init = {name: getattr(torch.nn.init, name) for name in init_names}
+    saved_init_weights = model_class._init_weights
+    try:
+        for name in init_names:
+            setattr(torch.nn.init, name, lambda tensor, *_, **__: tensor)
+        model_class._init_weights = lambda self, module: None
+        yield
+    finally:
+        for name, function in saved_init.items():
+            setattr(torch.nn.init, name, function)
+        model_class._init_weights = saved_init_weights
+
+
+def build_mmap_model(model_class, path: str) -> PreTrainedModel:
+    """Build model on top of memory-mapped weights.
+
+    :param model_class: class of model from transformers library
+    :param path: directory with config and files of weights
+
+    :returns: model in evaluation mode
+    """
+    config = model_class.config_class.from_pretrained(path)
+    with _skip_init(model_class):
+        model = model_class(config)
+    state_dict = load_mmap_weights(path)
+
+    # one parameter per tensor keeps tied weights shared
+    modules = dict(model.named_modules())
+    parameters = {}
+    for name, tensor in state_dict.items():
+        module_name, _, attr = name.rpartition('.')
+        module = modules[module_name]
+        if attr in module._parameters:
+            if id(tensor) not in parameters:
+                parameters[id(tensor)] = torch.nn.Parameter(
+                    tensor, requires_grad=False
+                )
+            module._parameters[attr] = parameters[id(tensor)]
+        elif attr in module._buffers:
+            module._buffers[attr] = tensor
+
+    # check that all parameters are taken from the file
+    pointers = {tensor.data_ptr() for tensor in state_dict.values()}
+    missing = [
+        name for name, param in model.named_parameters()
+        if param.numel() > 0 and param.data_ptr() not in pointers
+    ]
+    if len(missing) > 0:
+        raise ValueError(f'Missing weights: {", ".join(missing)}')
+
+    return model.eval()
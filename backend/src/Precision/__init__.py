@@ -0,0 +1 @@
+from .precision import PRECISION_MODES, apply_precision, bf16_supported
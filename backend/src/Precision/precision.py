@@ -0,0 +1,81 @@
+import warnings
+
+import torch
+from transformers import PreTrainedModel
+from transformers.modeling_utils import Conv1D
+
+
+# supported modes of inference precision
+PRECISION_MODES = ('fp32', 'int8', 'bf16')
+
+
+def bf16_supported() -> bool:
+    """Check that CPU has native bfloat16 instructions.
+
+    :returns: whether bfloat16 inference is supported and fast enough
+    """
+    try:
+        x = torch.ones(2, 2, dtype=torch.bfloat16)
+        torch.nn.functional.linear(x, x)
+    except RuntimeError:
+        return False
+
+    try:
+        with open('/proc/cpuinfo', 'r') as inf:
+            flags = inf.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def _conv1d_to_linear(model: torch.nn.Module):
+    """Replace GPT-2 Conv1D layers by equivalent Linear layers.
+
+    Dynamic quantization only knows about Linear layers. Linear layers
+    are not initialized and reuse memory of Conv1D weights.
+    """
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if not isinstance(child, Conv1D):
+                continue
+            # skip Linear.__init__, it allocates and fills random weights
+            linear = torch.nn.Linear.__new__(torch.nn.Linear)
+            torch.nn.Module.__init__(linear)
+            linear.in_features, linear.out_features = child.weight.shape
+            linear.weight = torch.nn.Parameter(
+                child.weight.detach().t(), requires_grad=False
+            )
+            linear.bias = torch.nn.Parameter(
+                child.bias.detach(), requires_grad=False
+            )
+            setattr(module, name, linear)
+
+
+def apply_precision(model: PreTrainedModel, mode: str) -> PreTrainedModel:
+    """Convert model for inference with given precision on CPU.
+
+    :param model: model to convert
+    :param mode: one of 'fp32', 'int8' (dynamic quantization
+        of linear layers) and 'bf16' (falls back to 'fp32' if CPU
+        does not support it)
+
+    :returns: converted model in evaluation mode
+    """
+    if mode not in PRECISION_MODES:
+        raise ValueError(
+            f'Unknown precision mode: {mode}, '
+            f'use one of {", ".join(PRECISION_MODES)}'
+        )
+
+    if mode == 'int8':
+        _conv1d_to_linear(model)
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+    elif mode == 'bf16':
+        if bf16_supported():
+            model = model.to(dtype=torch.bfloat16)
+        else:
+            warnings.warn('bfloat16 is not supported by CPU, fp32 is used.')
+
+    return model.eval()
@@ -0,0 +1,3 @@
+from .request_profiler import (
+    RequestProfile, current_profile, run_traced, list_profiles
+)
@@ -0,0 +1,122 @@
+import cProfile
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+_current_profile = ContextVar('request_profile', default=None)
+# profilers of python and torch are not meant to run concurrently
+_profiling_lock = threading.Lock()
+
+
+class RequestProfile:
+    """Class for profiling one request by cProfile and torch.profiler.
+
+    Python code inside the scope is profiled by cProfile. Functions run
+    by run_traced in copied context of the scope, e.g. forward passes
+    in inference threads, are traced by torch.profiler. Files are written
+    into directory with names starting with name of profile.
+    """
+
+    def __init__(self, directory: str, name: str):
+        """Init object.
+
+        :param directory: directory to write files of profile
+        :param name: unique name of profile
+        """
+        self.directory = directory
+        self.name = name
+        self.files = []
+        self._num_traces = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def scope(self):
+        """Profile the block and functions run by run_traced inside it."""
+        os.makedirs(self.directory, exist_ok=True)
+        with _profiling_lock:
+            token = _current_profile.set(self)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield self
+            finally:
+                profiler.disable()
+                _current_profile.reset(token)
+                profiler.dump_stats(self._add_file('pstats'))
+
+    @contextmanager
+    def trace(self):
+        """Trace torch operators of the block."""
+        with torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU],
+                record_shapes=True
+        ) as profiler:
+            yield
+        with self._lock:
+            trace_idx = self._num_traces
+            self._num_traces += 1
+        profiler.export_chrome_trace(
+            self._add_file(f'torch{trace_idx}.json')
+        )
+
+    def _add_file(self, suffix: str) -> str:
+        """Register file of profile.
+
+        :param suffix: suffix of file name after name of profile
+
+        :returns: path of file
+        """
+        path = os.path.join(self.directory, f'{self.name}.{suffix}')
+        with self._lock:
+            self.files.append(path)
+        return path
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """Get profile of the current context.
+
+    :returns: profile if request is profiled, None otherwise
+    """
+    return _current_profile.get()
+
+
+def run_traced(fn: Callable, *args, **kwargs):
+    """Run function traced by profile of the current context if any.
+
+    :param fn: function to run
+    :param args: positional arguments of function
+    :param kwargs: keyword arguments of function
+
+    :returns: result of function
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    with profile.trace():
+        return fn(*args, **kwargs)
+
+
+def list_profiles(directory: str) -> List[Dict]:
+    """Get files of profiles in directory.
+
+    :param directory: directory with files of profiles
+
+    :returns: name, size in bytes and modification time of each file,
+        the newest files first
+    """
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            stat = entry.stat()
+            files.append({
+                'name': entry.name,
+                'size': stat.st_size,
+                'modified': stat.st_mtime
+            })
+    return sorted(files, key=lambda x: x['modified'], reverse=True)
@@ -0,0 +1,4 @@
+from .token_budget_scheduler import TokenBudgetScheduler
+from .shape_buckets import ShapeBuckets
+from .inference_executor import InferenceExecutor, ExecutorBusyError
+from .micro_batcher import MicroBatcher, count_tokens
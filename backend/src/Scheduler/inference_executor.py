@@ -0,0 +1,154 @@
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+
+class ExecutorBusyError(Exception):
+    """Exception raised when queue of inference executor is full."""
+
+
+class InferenceExecutor:
+    """Class for running inference on fixed number of worker threads.
+
+    Each worker owns its own share of cores: it is pinned to them
+    by affinity. Number of intra-op threads of torch is global for
+    the process, so it is set once to the size of the share, and
+    concurrent forward passes don't oversubscribe CPU.
+    """
+
+    def __init__(
+            self,
+            num_workers: int = 1,
+            cores: Optional[List[int]] = None,
+            max_queue: Optional[int] = None
+    ):
+        """Init object.
+
+        :param num_workers: maximum number of concurrent tasks
+        :param cores: ids of cores to split between workers,
+            all cores available to process if None
+        :param max_queue: maximum number of waiting tasks,
+            no limit if None
+        """
+        if cores is None:
+            if hasattr(os, 'sched_getaffinity'):
+                cores = sorted(os.sched_getaffinity(0))
+            else:
+                cores = list(range(os.cpu_count() or 1))
+        self.num_workers = max(1, min(num_workers, len(cores)))
+        self.threads_per_worker = max(1, len(cores) // self.num_workers)
+        self.max_queue = max_queue
+        torch.set_num_threads(self.threads_per_worker)
+
+        # each worker takes its own share of cores on start
+        self._slots = queue.Queue()
+        for i in range(self.num_workers):
+            start_idx = i * self.threads_per_worker
+            self._slots.put(
+                cores[start_idx:start_idx + self.threads_per_worker]
+            )
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.num_workers,
+            thread_name_prefix='inference',
+            initializer=self._init_worker
+        )
+
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _init_worker(self):
+        """Pin the current worker thread to its share of cores."""
+        cores = self._slots.get()
+        if hasattr(os, 'sched_setaffinity'):
+            try:
+                # pid 0 means the calling thread
+                os.sched_setaffinity(0, cores)
+            except OSError:
+                pass
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Schedule task to run on one of workers.
+
+        Context variables of the caller are visible inside the task.
+
+        :param fn: function to run
+        :param args: positional arguments of function
+        :param kwargs: keyword arguments of function
+
+        :returns: future of the result
+        """
+        with self._lock:
+            if self.max_queue is not None and self.queued >= self.max_queue:
+                self.rejected += 1
+                raise ExecutorBusyError(
+                    'Too many requests are waiting for inference!'
+                )
+            self.queued += 1
+
+        context = contextvars.copy_context()
+        submit_time = time.monotonic()
+
+        def run():
+            wait_time = time.monotonic() - submit_time
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        return self._pool.submit(run)
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """Run task on one of workers and wait for its result.
+
+        :param fn: function to run
+        :param args: positional arguments of function
+        :param kwargs: keyword arguments of function
+
+        :returns: result of function
+        """
+        return self.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self, wait: bool = True):
+        """Stop workers.
+
+        :param wait: wait for the end of running tasks
+        """
+        self._pool.shutdown(wait=wait)
+
+    def stats(self) -> Dict[str, float]:
+        """Get counters of the executor.
+
+        :returns: dict with counters
+        """
+        with self._lock:
+            started = self.completed + self.running
+            return {
+                'workers': self.num_workers,
+                'threads_per_worker': self.threads_per_worker,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'mean_wait_time': (
+                    self.total_wait_time / started if started > 0 else 0.0
+                ),
+                'max_wait_time': self.max_wait_time
+            }
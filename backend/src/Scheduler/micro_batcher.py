@@ -0,0 +1,258 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+from src.Metrics import micro_batch_calls
+
+
+def count_tokens(
+        input_ids: List[List[int]], candidates: List[List[List[int]]]
+) -> int:
+    """Estimate number of tokens to score gaps with all candidates.
+
+    :param input_ids: token ids of each sentence
+    :param candidates: token ids of candidates for each gap
+
+    :returns: number of tokens in all hypotheses
+    """
+    return sum(
+        len(gap_candidates)
+        * (len(ids) + max([len(x) for x in gap_candidates], default=0))
+        for ids, gap_candidates in zip(input_ids, candidates)
+    )
+
+
+class _PendingCall:
+    """Call waiting for the flush of micro-batch."""
+
+    def __init__(
+            self,
+            input_ids: List[List[int]],
+            gap_indexes: List[int],
+            candidates: List[List[List[int]]],
+            num_tokens: int,
+            on_gap_scored: Optional[Callable] = None
+    ):
+        self.input_ids = input_ids
+        self.gap_indexes = gap_indexes
+        self.candidates = candidates
+        self.num_tokens = num_tokens
+        self.on_gap_scored = on_gap_scored
+        self.submit_time = time.monotonic()
+        self._reported_gaps = set()
+        self.future = Future()
+
+    def report_gap(self, gap_idx: int, result):
+        """Pass result of gap to the caller once.
+
+        :param gap_idx: index of gap in the call
+        :param result: result of the gap
+        """
+        if gap_idx not in self._reported_gaps:
+            self._reported_gaps.add(gap_idx)
+            self.on_gap_scored(gap_idx, result)
+
+
+class MicroBatcher:
+    """Class for merging concurrent scoring calls into shared calls.
+
+    One dispatcher thread collects pending calls until the token budget
+    or the deadline of the oldest call is reached, scores all their gaps
+    by one call and routes results back to each caller. Calls submitted
+    during scoring are collected for the next flush.
+    """
+
+    def __init__(
+            self,
+            score_fn: Callable,
+            max_batch_tokens: int = 16384,
+            max_wait: float = 0.005,
+            input_errors: Tuple[Type[Exception], ...] = (
+                ValueError, IndexError, KeyError
+            )
+    ):
+        """Init object.
+
+        :param score_fn: function with arguments token ids of sentences,
+            indexes of gaps and token ids of candidates, that returns
+            results for each gap, e.g. score_tokenized method of scorer
+        :param max_batch_tokens: number of tokens in collected calls
+            to flush them without waiting for the deadline
+        :param max_wait: maximum time in seconds to wait for other calls
+        :param input_errors: errors caused by inputs of one of the calls,
+            calls are scored separately after them to find the caller,
+            other errors are passed to all callers
+        """
+        self.score_fn = score_fn
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self.input_errors = input_errors
+
+        self._condition = threading.Condition()
+        self._pending = []
+        self._pending_tokens = 0
+        self._dispatcher = None
+
+        self.flushes = 0
+        self.calls = 0
+        self.gaps = 0
+
+    def submit(
+            self,
+            input_ids: List[List[int]],
+            gap_indexes: List[int],
+            candidates: List[List[List[int]]],
+            on_gap_scored: Optional[Callable] = None
+    ) -> Future:
+        """Schedule scoring of gaps together with concurrent calls.
+
+        If on_gap_scored is given, score_fn is called with priorities
+        and on_gap_scored arguments: gaps of each call are scored in their
+        order, so the first gaps of all merged calls are finished first.
+
+        :param input_ids: token ids of each sentence
+        :param gap_indexes: index of the gap in each sentence
+        :param candidates: token ids of candidates for each gap
+        :param on_gap_scored: function to call with index of gap
+            and its result as soon as the gap is scored
+
+        :returns: future of results of score_fn for each gap
+        """
+        if len(input_ids) == 0:
+            future = Future()
+            future.set_result([])
+            return future
+
+        num_tokens = count_tokens(input_ids, candidates)
+        call = _PendingCall(
+            input_ids, gap_indexes, candidates, num_tokens, on_gap_scored
+        )
+        with self._condition:
+            self._pending.append(call)
+            self._pending_tokens += num_tokens
+            self._condition.notify_all()
+            # thread isn't alive in the child after fork
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(
+                    target=self._dispatch, name='micro-batcher', daemon=True
+                )
+                self._dispatcher.start()
+        return call.future
+
+    def __call__(
+            self,
+            input_ids: List[List[int]],
+            gap_indexes: List[int],
+            candidates: List[List[List[int]]],
+            alone: bool = False
+    ) -> List:
+        """Score gaps together with concurrent calls and wait for results.
+
+        :param input_ids: token ids of each sentence
+        :param gap_indexes: index of the gap in each sentence
+        :param candidates: token ids of candidates for each gap
+        :param alone: call score_fn in the current thread without
+            merging, e.g. to profile only these gaps
+
+        :returns: results of score_fn for each gap
+        """
+        if alone:
+            return self.score_fn(input_ids, gap_indexes, candidates)
+        return self.submit(input_ids, gap_indexes, candidates).result()
+
+    def _dispatch(self):
+        """Collect pending calls until budget or deadline and flush them."""
+        while True:
+            with self._condition:
+                while len(self._pending) == 0:
+                    self._condition.wait()
+                deadline = self._pending[0].submit_time + self.max_wait
+                while self._pending_tokens < self.max_batch_tokens:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                calls = self._pending
+                self._pending = []
+                self._pending_tokens = 0
+            self._flush(calls)
+
+    def _flush(self, calls: List[_PendingCall]):
+        """Score all gaps of calls at once and route results back."""
+        input_ids = []
+        gap_indexes = []
+        candidates = []
+        # call and index inside it for each gap
+        owners = []
+        for call in calls:
+            input_ids += call.input_ids
+            gap_indexes += call.gap_indexes
+            candidates += call.candidates
+            owners += [(call, i) for i in range(len(call.input_ids))]
+        with self._condition:
+            self.flushes += 1
+            self.calls += len(calls)
+            self.gaps += len(input_ids)
+        micro_batch_calls.observe(len(calls))
+
+        kwargs = {}
+        if any(call.on_gap_scored is not None for call in calls):
+            def on_gap_scored(gap_idx, result):
+                call, call_gap_idx = owners[gap_idx]
+                if call.on_gap_scored is not None:
+                    call.report_gap(call_gap_idx, result)
+
+            kwargs['priorities'] = [i for _, i in owners]
+            kwargs['on_gap_scored'] = on_gap_scored
+
+        try:
+            results = self.score_fn(
+                input_ids, gap_indexes, candidates, **kwargs
+            )
+        except self.input_errors as e:
+            if len(calls) == 1:
+                calls[0].future.set_exception(e)
+            else:
+                # score calls separately to route error to its caller
+                for call in calls:
+                    call_kwargs = {}
+                    if call.on_gap_scored is not None:
+                        call_kwargs['priorities'] = list(
+                            range(len(call.input_ids))
+                        )
+                        call_kwargs['on_gap_scored'] = call.report_gap
+                    try:
+                        call.future.set_result(self.score_fn(
+                            call.input_ids, call.gap_indexes,
+                            call.candidates, **call_kwargs
+                        ))
+                    except Exception as call_error:
+                        call.future.set_exception(call_error)
+        except Exception as e:
+            # error doesn't depend on inputs, e.g. executor is busy,
+            # scoring calls separately would fail the same way
+            for call in calls:
+                call.future.set_exception(e)
+        else:
+            cur_cnt = 0
+            for call in calls:
+                cnt = len(call.input_ids)
+                call.future.set_result(results[cur_cnt:cur_cnt+cnt])
+                cur_cnt += cnt
+
+    def stats(self) -> Dict[str, float]:
+        """Get counters of the batcher.
+
+        :returns: dict with counters
+        """
+        with self._condition:
+            return {
+                'flushes': self.flushes,
+                'calls': self.calls,
+                'gaps': self.gaps,
+                'pending_calls': len(self._pending),
+                'mean_calls_per_flush': (
+                    self.calls / self.flushes if self.flushes > 0 else 0.0
+                )
+            }
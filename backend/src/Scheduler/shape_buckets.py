@@ -0,0 +1,50 @@
+from typing import Optional, Sequence
+
+
+class ShapeBuckets:
+    """Class for rounding sizes of tensors up to a fixed set of sizes.
+
+    Compiled graphs are reused for all inputs of the same bucket.
+    """
+
+    def __init__(self, sizes: Sequence[int]):
+        """Init object.
+
+        :param sizes: sizes of buckets
+        """
+        self.sizes = sorted(set(sizes))
+
+    @classmethod
+    def powers_of_two(
+            cls, max_size: int, min_size: int = 8
+    ) -> 'ShapeBuckets':
+        """Create buckets of powers of two up to the maximum size.
+
+        :param max_size: maximum size, it is always a bucket
+        :param min_size: minimum size of bucket
+
+        :returns: created buckets
+        """
+        sizes = []
+        size = min_size
+        while size < max_size:
+            sizes.append(size)
+            size *= 2
+        sizes.append(max_size)
+        return cls(sizes)
+
+    def __call__(self, size: int, limit: Optional[int] = None) -> int:
+        """Round size up to the nearest bucket.
+
+        :param size: size to round
+        :param limit: maximum allowed result, no limit if None
+
+        :returns: size of bucket or size itself if it doesn't fit
+            into any bucket or the limit
+        """
+        for bucket_size in self.sizes:
+            if bucket_size >= size:
+                if limit is not None and bucket_size > limit:
+                    break
+                return bucket_size
+        return size
@@ -0,0 +1,71 @@
+from typing import List, Optional, Sequence
+
+
+class TokenBudgetScheduler:
+    """Class for splitting rows into batches limited by padded tokens."""
+
+    def __init__(
+            self,
+            max_batch_tokens: int = 8192,
+            max_batch_size: Optional[int] = None
+    ):
+        """Init object.
+
+        :param max_batch_tokens: maximum number of tokens in padded batch
+        :param max_batch_size: maximum number of rows in batch,
+            no limit if None
+        """
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+
+    def __call__(
+            self,
+            lengths: Sequence[int],
+            priorities: Optional[Sequence[int]] = None
+    ) -> List[List[int]]:
+        """Split rows into batches.
+
+        Rows are sorted by length, so rows of close length are padded
+        together, and batch is closed as soon as the next row doesn't fit
+        into the budget after padding. Row that is longer than the budget
+        is placed into the separate batch.
+
+        If priorities are given, rows are sorted by priority first,
+        so batches are returned in order of priority and rows of
+        the same priority are finished as early as possible.
+
+        :param lengths: number of tokens in each row
+        :param priorities: priority of each row, lower is scored earlier
+
+        :returns: indices of rows for each batch
+        """
+        if priorities is None:
+            order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        else:
+            order = sorted(
+                range(len(lengths)),
+                key=lambda i: (priorities[i], lengths[i])
+            )
+
+        batches = []
+        current_batch = []
+        current_max_len = 0
+        for idx in order:
+            # batch is padded to its longest row
+            current_max_len = max(current_max_len, lengths[idx])
+            padded_size = (len(current_batch) + 1) * current_max_len
+            is_full = (
+                padded_size > self.max_batch_tokens
+                or (self.max_batch_size is not None
+                    and len(current_batch) >= self.max_batch_size)
+            )
+            if current_batch and is_full:
+                batches.append(current_batch)
+                current_batch = []
+                current_max_len = lengths[idx]
+            current_batch.append(idx)
+
+        if current_batch:
+            batches.append(current_batch)
+
+        return batches
@@ -0,0 +1,4 @@
+from .sentence_splitter import (
+    SPLITTER_KINDS, ABBREVIATIONS, PunktSplitter, RuleSplitter,
+    create_sentence_splitter
+)
@@ -0,0 +1,113 @@
+import os
+import pickle
+import re
+import warnings
+from typing import List, Optional
+
+# supported kinds of sentence splitters
+SPLITTER_KINDS = ('punkt', 'rules')
+
+# end of sentence: terminal punctuation, closing quotes or brackets
+# and whitespace before the next sentence
+_BOUNDARY = re.compile(r'[.!?\u2026]+[\'")\]\u2019\u201d\u00bb]*\s+')
+# words, that are usually followed by period inside sentence
+ABBREVIATIONS = frozenset([
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'st', 'jr', 'sr', 'vs',
+    'e.g', 'i.e', 'a.m', 'p.m', 'u.s', 'u.k'
+])
+
+
+class PunktSplitter:
+    """Class for splitting text by punkt model loaded once from disk."""
+
+    def __init__(self, path: str):
+        """Init object.
+
+        :param path: path to pickled punkt model, e.g. english.pickle
+        """
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                f'Punkt model is not found at {path}, '
+                f'run "python manage.py download_punkt"!'
+            )
+        with open(path, 'rb') as inf:
+            self.tokenizer = pickle.load(inf)
+
+    def __call__(self, text: str) -> List[str]:
+        """Split text into sentences.
+
+        :param text: text to split
+
+        :returns: sentences of text
+        """
+        return self.tokenizer.tokenize(text)
+
+
+class RuleSplitter:
+    """Class for splitting text by punctuation rules.
+
+    Sentence ends at terminal punctuation followed by whitespace, if the
+    next character isn't lowercase and the last word isn't abbreviation
+    or initial. Text is split only at whitespace, so gap tokens without
+    terminal punctuation are never broken.
+    """
+
+    def __init__(self, abbreviations: frozenset = ABBREVIATIONS):
+        """Init object.
+
+        :param abbreviations: lowercased words without the last period,
+            after which sentence doesn't end
+        """
+        self.abbreviations = abbreviations
+
+    def __call__(self, text: str) -> List[str]:
+        """Split text into sentences.
+
+        :param text: text to split
+
+        :returns: sentences of text
+        """
+        sentences = []
+        start_idx = 0
+        for match in _BOUNDARY.finditer(text):
+            end_idx = match.end()
+            if end_idx == len(text) or text[end_idx].islower():
+                continue
+            if match.group().startswith('.'):
+                words = text[start_idx:match.start()].split()
+                last_word = words[-1].lower() if len(words) > 0 else ''
+                if last_word in self.abbreviations or (
+                        len(last_word) == 1 and last_word.isalpha()
+                ):
+                    continue
+            sentences.append(text[start_idx:end_idx].strip())
+            start_idx = end_idx
+
+        sentences.append(text[start_idx:].strip())
+        return [x for x in sentences if len(x) > 0]
+
+
+def create_sentence_splitter(kind: str, punkt_path: Optional[str] = None):
+    """Create sentence splitter of given kind.
+
+    Rule-based splitter is used if punkt model is not saved.
+
+    :param kind: kind of splitter, one of SPLITTER_KINDS
+    :param punkt_path: path to pickled punkt model for punkt splitter
+
+    :returns: function to split text into sentences
+    """
+    if kind == 'punkt':
+        if punkt_path is not None and os.path.isfile(punkt_path):
+            return PunktSplitter(punkt_path)
+        warnings.warn(
+            f'Punkt model is not found at {punkt_path}, sentences are '
+            f'split by rules. Run "python manage.py download_punkt".'
+        )
+        return RuleSplitter()
+    if kind == 'rules':
+        return RuleSplitter()
+    raise ValueError(
+        f'Unknown sentence splitter {kind}, should be one of '
+        f'{", ".join(SPLITTER_KINDS)}!'
+    )
@@ -0,0 +1 @@
+from .stage_timer import StageTimer, timed_stage
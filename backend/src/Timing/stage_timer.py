@@ -0,0 +1,68 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict
+
+from src.Metrics import stage_seconds
+
+_current_timer = ContextVar('stage_timer', default=None)
+
+
+class StageTimer:
+    """Class for collecting time spent in named stages of one request.
+
+    Stages are added to the timer inside its scope. Timer is visible
+    in threads running in copied context of the request.
+    """
+
+    def __init__(self):
+        """Init object."""
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def scope(self):
+        """Open scope in which stages are added to this timer."""
+        token = _current_timer.set(self)
+        try:
+            yield self
+        finally:
+            _current_timer.reset(token)
+
+    def add(self, name: str, seconds: float):
+        """Add time to the stage.
+
+        :param name: name of stage
+        :param seconds: time spent in stage
+        """
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def stats(self) -> Dict[str, float]:
+        """Get time of each stage.
+
+        :returns: dict with seconds spent in each stage
+        """
+        with self._lock:
+            return dict(self.durations)
+
+
+@contextmanager
+def timed_stage(name: str):
+    """Measure time of the block as stage.
+
+    Time is observed by histogram of stages of the process
+    and added to the current timer if there is one.
+
+    :param name: name of stage
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start_time
+        stage_seconds.observe(seconds, stage=name)
+        timer = _current_timer.get()
+        if timer is not None:
+            timer.add(name, seconds)
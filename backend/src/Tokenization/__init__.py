@@ -0,0 +1 @@
+from .tokenization_memo import TokenizationMemo
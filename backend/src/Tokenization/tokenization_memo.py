@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List
+
+
+class TokenizationMemo:
+    """Class for memoized batch tokenization without special tokens.
+
+    Results are remembered within the active scope (usually one request)
+    and short strings are also kept in a bounded LRU shared across scopes.
+    Returned lists of token ids are shared and should not be modified.
+    """
+
+    def __init__(
+            self, tokenizer, max_entries: int = 65536,
+            max_cached_length: int = 32
+    ):
+        """Init object.
+
+        :param tokenizer: tokenizer to use, preferably a fast one
+        :param max_entries: maximum number of strings in the shared LRU,
+            0 disables it
+        :param max_cached_length: maximum length in characters of string
+            to keep in the shared LRU
+        """
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.max_cached_length = max_cached_length
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._scope = ContextVar(
+            f'tokenization_scope_{id(self)}', default=None
+        )
+
+    @contextmanager
+    def scope(self):
+        """Open scope in which all tokenized strings are remembered."""
+        token = self._scope.set({})
+        try:
+            yield
+        finally:
+            self._scope.reset(token)
+
+    def __call__(self, texts: List[str]) -> List[List[int]]:
+        """Tokenize strings without special tokens.
+
+        :param texts: strings to tokenize
+
+        :returns: token ids of each string
+        """
+        scope = self._scope.get()
+        if scope is None:
+            scope = {}
+
+        # find already tokenized strings
+        missing = []
+        with self._lock:
+            for text in texts:
+                if text in scope:
+                    self.hits += 1
+                    continue
+                input_ids = self._entries.get(text)
+                if input_ids is not None:
+                    self._entries.move_to_end(text)
+                    scope[text] = input_ids
+                    self.hits += 1
+                else:
+                    missing.append(text)
+                    self.misses += 1
+
+        # tokenize the rest by one call
+        missing = list(dict.fromkeys(missing))
+        if len(missing) > 0:
+            tokenized_missing = self.tokenizer(
+                missing,
+                add_special_tokens=False,
+                padding=False,
+                truncation='do_not_truncate',
+            )['input_ids']
+            with self._lock:
+                for text, input_ids in zip(missing, tokenized_missing):
+                    scope[text] = input_ids
+                    if len(text) <= self.max_cached_length:
+                        self._entries[text] = input_ids
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return [scope[text] for text in texts]
+
+    def clear(self):
+        """Remove all entries from the shared LRU."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Get counters of the memo.
+
+        :returns: dict with counters
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses
+            }